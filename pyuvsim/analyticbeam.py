@@ -92,6 +92,16 @@ class AnalyticBeam(object):
         self.freq_interp_kind = 'linear'
         self.beam_type = 'efield'
 
+    @property
+    def diagonal_jones(self):
+        """
+        Whether the beam's Jones matrices are diagonal.
+
+        All analytic beam types only respond to the co-polarized component of the
+        electric field, so their E-field Jones matrices are diagonal.
+        """
+        return self.beam_type == 'efield'
+
     def peak_normalize(self):
         pass
 
@@ -28,7 +28,7 @@ class Antenna(object):
         self.beam_id = beam_id
 
     def get_beam_jones(self, array, source_alt_az, frequency, reuse_spline=True,
-                       interpolation_function=None, freq_interp_kind=None):
+                       interpolation_function=None, freq_interp_kind=None, diagonal=False):
         """
         2x2 array of Efield vectors in Az/Alt
 
@@ -40,8 +40,8 @@ class Antenna(object):
             Positions to evaluate in alt/az, where
             source_alt_az[0] gives list of alts
             soruce_alt_az[1] gives list of corresponding az
-        frequency : float or Quantity
-            Frequency. Assumed to be Hz if float.
+        frequency : float or Quantity, or array_like of float or Quantity
+            Frequency or frequencies. Assumed to be Hz if float.
         reuse_spline : bool
             Option to keep and reuse interpolation splines in UVBeam.
         interpolation_function: str
@@ -51,11 +51,18 @@ class Antenna(object):
             Interpolation method for frequencies.
             Note -- This overrides whatever method may be set on the
             UVBeam objects.
+        diagonal : bool
+            Only return the diagonal of the Jones matrix, for beams with no
+            cross-polarized response (see AnalyticBeam.diagonal_jones). The
+            off-diagonal elements are not computed.
         Returns
         -------
-        jones_matrix : (2,2) ndarray, dtype float
+        jones_matrix : (2,2,Ncomponents) or (2,2,Nfreqs,Ncomponents) ndarray, dtype complex
             The first axis is feed, the second axis is vector component
-            on the sky in az/za.
+            on the sky in az/za. The frequency axis is only present if
+            more than one frequency (or a frequency array) is passed in.
+            If diagonal is True, the diagonal elements only, with shape
+            (2,Ncomponents) or (2,Nfreqs,Ncomponents).
         """
         # get_direction_jones needs to be defined on UVBeam
         # 2x2 array of Efield vectors in alt/az
@@ -66,9 +73,10 @@ class Antenna(object):
         )
 
         if isinstance(frequency, units.Quantity):
-            freq = np.array([frequency.to('Hz').value])
+            freq = np.atleast_1d(frequency.to('Hz').value)
         else:
-            freq = np.array([frequency])
+            freq = np.atleast_1d(frequency)
+        scalar_freq = np.ndim(frequency) == 0
 
         beam = array.beam_list[self.beam_id]
 
@@ -108,15 +116,25 @@ class Antenna(object):
         Ncomponents = source_za.shape[-1]
 
         # interp_data has shape:
-        #   (Naxes_vec, Nspws, Nfeeds, 1 (freq),  Ncomponents (source positions))
-        jones_matrix = np.zeros((2, 2, Ncomponents), dtype=np.complex)
+        #   (Naxes_vec, Nspws, Nfeeds, Nfreqs,  Ncomponents (source positions))
+        if diagonal:
+            jones_diag = np.zeros((2, freq.size, Ncomponents), dtype=complex)
+            jones_diag[0] = interp_data[1, 0, 0, :, :]
+            jones_diag[1] = interp_data[0, 0, 1, :, :]
+            if scalar_freq:
+                return jones_diag[:, 0, :]
+            return jones_diag
+
+        jones_matrix = np.zeros((2, 2, freq.size, Ncomponents), dtype=complex)
 
         # first axis is feed, second axis is theta, phi (opposite order of beam!)
-        jones_matrix[0, 0] = interp_data[1, 0, 0, 0, :]
-        jones_matrix[1, 1] = interp_data[0, 0, 1, 0, :]
-        jones_matrix[0, 1] = interp_data[0, 0, 0, 0, :]
-        jones_matrix[1, 0] = interp_data[1, 0, 1, 0, :]
+        jones_matrix[0, 0] = interp_data[1, 0, 0, :, :]
+        jones_matrix[1, 1] = interp_data[0, 0, 1, :, :]
+        jones_matrix[0, 1] = interp_data[0, 0, 0, :, :]
+        jones_matrix[1, 0] = interp_data[1, 0, 1, :, :]
 
+        if scalar_freq:
+            return jones_matrix[:, :, 0, :]
         return jones_matrix
 
     def __eq__(self, other):
@@ -4,6 +4,7 @@
 
 import numpy as np
 import sys
+import time as pytime
 from array import array as _array
 import struct as _struct
 import resource
@@ -25,6 +26,9 @@ rank_comm = None
 # Split serialized objects into chunks of 2 GiB
 INT_MAX = 2**31 - 1
 
+# Size of the chunks that shared_mem_bcast sends between nodes.
+SHARED_BCAST_CHUNK_BYTES = 2**27
+
 
 def set_mpi_excepthook(mpi_comm):
     """Kill the whole job on an uncaught python exception"""
@@ -69,7 +73,7 @@ def start_mpi(block_nonroot_stdout=True):
         atexit.register(sys.stdout.close)
 
 
-def shared_mem_bcast(arr, root=0):
+def shared_mem_bcast(arr, root=0, chunk_bytes=SHARED_BCAST_CHUNK_BYTES):
     """
     Allocate shared memory on each node and place contents of arr in it.
 
@@ -82,44 +86,43 @@ def shared_mem_bcast(arr, root=0):
         Data to be shared.
     root: int
         Root rank on COMM_WORLD, from which data will be broadcast.
+    chunk_bytes: int
+        Size in bytes of the chunks the data are broadcast in between nodes.
 
     Notes
     -----
     Data will be duplicated once per node, but will be shared among
     processes on each node.
+
+    The root process copies arr into the shared memory of its node, from which the
+    data are broadcast in chunks straight into the shared memory of the other nodes,
+    without serializing or buffering them.
     """
-    nbytes = 0
-    itemsize = 0
-    dtype = None
-    Nitems = 0
-    shape = tuple()  # noqa
-
-    if node_comm.rank == root:
-        # Data cannot be shared between nodes.
-        # Need to broadcast to the root process on each node.
-        arr = big_bcast(rank_comm, arr, root=root)
-        dtype = arr.dtype
-        Nitems = arr.size
-        shape = arr.shape
-        itemsize = sys.getsizeof(arr.flatten()[0])
-        nbytes = itemsize * Nitems
-
-    itemsize = node_comm.bcast(itemsize, root=root)
-    dtype = node_comm.bcast(dtype, root=root)
-    Nitems = node_comm.bcast(Nitems, root=root)
-    shape = node_comm.bcast(shape, root=root)
+    meta = None
+    if world_comm.rank == root:
+        arr = np.asarray(arr)
+        meta = (arr.shape, arr.dtype)
+    shape, dtype = world_comm.bcast(meta, root=root)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
 
     # Allocate a window if the node_comm rank is 0
     # Otherwise, make a handle to the window.
     # This will allocate nbytes on each node.
-
-    win = MPI.Win.Allocate_shared(nbytes, itemsize, comm=node_comm)
-    buf, itemsize = win.Shared_query(0)
+    win = MPI.Win.Allocate_shared(nbytes if node_comm.rank == 0 else 0, dtype.itemsize,
+                                  comm=node_comm)
+    buf, _ = win.Shared_query(0)
     sh_arr = np.ndarray(buffer=buf, dtype=dtype, shape=shape)
 
-    if node_comm.rank == root:
-        # Now fill the window on each node with the data.
-        sh_arr[:] = arr[()]
+    if world_comm.rank == root:
+        sh_arr[...] = arr
+    # Data cannot be shared between nodes, so the node roots pass it on from the
+    # shared memory of the root's node.
+    is_root_node = node_comm.allreduce(world_comm.rank == root, op=MPI.LOR)
+    if node_comm.rank == 0:
+        source = rank_comm.allreduce(rank_comm.rank if is_root_node else -1, op=MPI.MAX)
+        sh_bytes = sh_arr.reshape(-1).view(np.uint8)
+        for start in range(0, nbytes, chunk_bytes):
+            rank_comm.Bcast(sh_bytes[start:start + chunk_bytes], root=source)
 
     # Access is not synchronized, so no process
     # should be allowed to overwrite.
@@ -152,6 +155,55 @@ def quantity_shared_bcast(obj, root=0):
     return sclass(value, copy=False, unit=unit)
 
 
+def uvdata_shared_bcast(uv, root=0, min_bytes=2**16):
+    """
+    Broadcast a UVData object, with its large arrays in shared memory.
+
+    Arrays of at least min_bytes (such as the per-baseline-time time, lst, uvw and
+    baseline arrays) are placed in shared memory on each node with
+    :func:`shared_mem_bcast`, and the rest of the object is pickled without them.
+    This works for other pyuvdata UVBase objects as well.
+
+    Must be called from all PUs.
+
+    Parameters
+    ----------
+    uv: UVData
+        Object to broadcast. Only used on the root process.
+    root: int
+        Root rank on COMM_WORLD, from which data will be broadcast.
+    min_bytes: int
+        Size in bytes above which arrays are shared.
+
+    Returns
+    -------
+    UVData
+        The broadcast object. Shared arrays are read-only, including on the root
+        process, where they replace the arrays of uv.
+    """
+    shared = None
+    if world_comm.rank == root:
+        shared = {
+            key: param.value for key, param in uv.__dict__.items()
+            # Plain arrays only, which leaves out Quantities.
+            if type(getattr(param, 'value', None)) is np.ndarray
+            and param.value.nbytes >= min_bytes
+        }
+        # Pickle the object without the shared arrays.
+        for key in shared:
+            uv.__dict__[key].value = None
+    keys = world_comm.bcast(None if shared is None else sorted(shared), root=root)
+    uv_bcast = world_comm.bcast(uv, root=root)
+    if world_comm.rank != root:
+        uv = uv_bcast
+
+    for key in keys:
+        value = shared[key] if world_comm.rank == root else None
+        uv.__dict__[key].value = shared_mem_bcast(value, root=root)
+
+    return uv
+
+
 def big_bcast(comm, objs, root=0, return_split_info=False, MAX_BYTES=INT_MAX):
     """
     Broadcast operation that can exceed the MPI limit of ~4 GiB.
@@ -346,6 +398,9 @@ class Counter:
     Notes
     -----
     Must be initialized on all processes.
+
+    The count is a 64-bit integer, so it can count the tasks of simulations with
+    more than 2**31 tasks.
     """
 
     def __init__(self, comm=None, count_rank=0):
@@ -353,7 +408,7 @@ class Counter:
         if comm is None:
             comm = world_comm.Dup()
         rank = comm.Get_rank()
-        itemsize = MPI.INT.Get_size()
+        itemsize = MPI.INT64_T.Get_size()
         nint = 0
         if rank == count_rank:
             nint = 1
@@ -361,7 +416,7 @@ class Counter:
                                     MPI.INFO_NULL, comm)
         if rank == count_rank:
             mem = self.win.tomemory()
-            mem[:] = _struct.pack('i', 0)
+            mem[:] = _struct.pack('q', 0)
 
         comm.Barrier()
 
@@ -369,23 +424,111 @@ class Counter:
         self.win.Free()
 
     def next(self, increment=1):
-        incr = _array('i', [increment])
-        nval = _array('i', [0])
+        incr = _array('q', [increment])
+        nval = _array('q', [0])
         self.win.Lock(self.count_rank)
-        self.win.Get_accumulate([incr, 1, MPI.INT],
-                                [nval, 1, MPI.INT],
+        self.win.Get_accumulate([incr, 1, MPI.INT64_T],
+                                [nval, 1, MPI.INT64_T],
                                 self.count_rank, op=MPI.SUM)
         self.win.Unlock(self.count_rank)
         return nval[0]
 
     def current_value(self):
         self.win.Lock(self.count_rank)
-        nval = _array('i', [0])
-        self.win.Get([nval, 1, MPI.INT], self.count_rank)
+        nval = _array('q', [0])
+        self.win.Get([nval, 1, MPI.INT64_T], self.count_rank)
         self.win.Unlock(self.count_rank)
         return nval[0]
 
 
+class ProgressCounter:
+    """
+    A hierarchical counter of finished tasks, for progress reports.
+
+    Each rank counts its tasks locally and adds them to a counter shared by the ranks
+    on its node at most once every `interval` seconds. The root rank of each node adds
+    the new counts of its node to a counter on rank 0 on the same schedule, so that
+    remote atomic operations scale with the number of nodes and the run time rather
+    than with the number of tasks.
+
+    Parameters
+    ----------
+    interval : float
+        Seconds between updates of the node and global counters.
+    report : callable
+        Called on rank 0 with the global count each time it is updated.
+
+    Notes
+    -----
+    Must be initialized on all processes, after :func:`start_mpi`.
+    The global count lags the number of finished tasks by up to two intervals,
+    until :meth:`finish` is called.
+    """
+
+    def __init__(self, interval=1.0, report=None):
+        self.interval = interval
+        self.report = report
+        self.pending = 0
+        self.forwarded = 0
+        self.last_flush = pytime.time()
+        self.node_counter = Counter(comm=node_comm)
+        self.global_counter = None
+        if node_comm.rank == 0:
+            # rank_comm connects the root ranks of all nodes, with rank 0 first.
+            self.global_counter = Counter(comm=rank_comm)
+
+    def next(self, increment=1):
+        """Count finished tasks, passing them on if the interval has passed."""
+        self.pending += increment
+        if pytime.time() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Add the local count to the node counter, and forward node counts on node roots."""
+        if self.pending:
+            self.node_counter.next(self.pending)
+            self.pending = 0
+        if self.global_counter is not None:
+            self._forward()
+        self.last_flush = pytime.time()
+
+    def _forward(self):
+        node_count = self.node_counter.current_value()
+        if node_count > self.forwarded:
+            self.global_counter.next(node_count - self.forwarded)
+            self.forwarded = node_count
+        if self.report is not None and rank == 0:
+            self.report(self.global_counter.current_value())
+
+    def current_value(self):
+        """Get the global count. Only available on rank 0, returns None elsewhere."""
+        if rank != 0:
+            return None
+        return self.global_counter.current_value()
+
+    def finish(self):
+        """
+        Pass on all remaining counts, and wait for all ranks to finish.
+
+        Node roots keep forwarding the counts of the other ranks on their node until
+        all of them have finished, and rank 0 keeps reporting progress until all
+        ranks have finished. Must be called on all processes.
+        """
+        self.flush()
+        for comm in [node_comm, world_comm]:
+            request = comm.Ibarrier()
+            while not request.Test():
+                if pytime.time() - self.last_flush >= self.interval:
+                    self.flush()
+                pytime.sleep(min(self.interval, 0.01))
+            self.flush()
+
+    def free(self):
+        self.node_counter.free()
+        if self.global_counter is not None:
+            self.global_counter.free()
+
+
 def get_max_node_rss(return_per_node=False):
     """
     Find the maximum memory usage on any node in the job in GiB.
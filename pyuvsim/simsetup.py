@@ -1170,6 +1170,190 @@ def parse_time_params(time_params):
     return return_dict
 
 
+def parse_simulation_params(sim_params):
+    """
+    Parse the "simulation" section of obsparam.
+
+    These options control how the simulation is carried out, and are passed along
+    to :func:`pyuvsim.uvsim.run_uvdata_uvsim` as keywords. None of them are required.
+
+    Args:
+        sim_params: Dictionary of simulation parameters.
+            See pyuvsim documentation for the list of allowed keywords.
+            https://pyuvsim.readthedocs.io/en/latest/parameter_files.html#simulation
+
+    Returns:
+        dict
+            * `vectorize_freqs`: (bool) Compute all frequencies of a (baseline, time)
+              in a single task.
+            * `factorize_antennas`: (bool) Compute all baselines at a time in a single
+              task, evaluating fringes and beams per antenna.
+            * `jones_cache_mb`: (float) Memory budget in MiB for the cache of beam
+              Jones matrices on each rank.
+            * `precision`: (str) Working precision of the engine, 'double' or 'single'.
+            * `source_tile_size`: (int or str) Number of sources processed at a time
+              by the engine, or 'auto' to choose it by timing the engine.
+            * `fringe_anchor_interval`: (int) Number of channels between exact fringe
+              evaluations, for frequency-vectorized tasks with uniform channels.
+            * `simulate_redundant_once`: (bool) Simulate one baseline per redundant group
+              and fill in the rest of the group.
+            * `redundancy_tol`: (float) Tolerance in meters for redundant baselines.
+            * `task_scheduling`: (str) 'static' to divide tasks among ranks in advance,
+              'dynamic' for ranks to claim chunks of tasks as they go, or 'balanced'
+              to divide tasks in advance into ranges of equal modeled cost.
+            * `task_chunk_size`: (int or str) Number of tasks claimed at a time with
+              dynamic scheduling, or 'auto'.
+            * `jones_prefetch_depth`: (int) Number of tasks read ahead whose beam Jones
+              matrices are computed in background threads, or 0 to not prefetch.
+            * `jones_prefetch_threads`: (int) Number of prefetch threads on each rank.
+    """
+    sim_options = {'vectorize_freqs': False, 'factorize_antennas': False,
+                   'jones_cache_mb': 256, 'precision': 'double', 'source_tile_size': 'auto',
+                   'fringe_anchor_interval': 16, 'simulate_redundant_once': False,
+                   'redundancy_tol': 0.01, 'task_scheduling': 'static',
+                   'task_chunk_size': 'auto', 'jones_prefetch_depth': 0,
+                   'jones_prefetch_threads': 2}
+
+    if sim_params is None:
+        sim_params = {}
+
+    unknown = set(sim_params.keys()) - set(sim_options.keys())
+    if len(unknown) > 0:
+        raise ValueError(
+            "Unrecognized simulation parameters: " + ", ".join(sorted(unknown))
+        )
+
+    for key in ['vectorize_freqs', 'factorize_antennas', 'simulate_redundant_once']:
+        if key in sim_params:
+            sim_options[key] = bool(sim_params[key])
+
+    if 'jones_cache_mb' in sim_params:
+        sim_options['jones_cache_mb'] = float(sim_params['jones_cache_mb'])
+        if sim_options['jones_cache_mb'] < 0:
+            raise ValueError("jones_cache_mb must be non-negative.")
+
+    if 'precision' in sim_params:
+        precision = str(sim_params['precision']).lower()
+        if precision not in ['single', 'double']:
+            raise ValueError("precision must be either 'single' or 'double'.")
+        sim_options['precision'] = precision
+
+    if 'source_tile_size' in sim_params:
+        tile_size = sim_params['source_tile_size']
+        if not tile_size == 'auto':
+            tile_size = int(tile_size)
+            if tile_size < 0:
+                raise ValueError("source_tile_size must be 'auto' or a non-negative integer.")
+        sim_options['source_tile_size'] = tile_size
+
+    if 'fringe_anchor_interval' in sim_params:
+        sim_options['fringe_anchor_interval'] = int(sim_params['fringe_anchor_interval'])
+        if sim_options['fringe_anchor_interval'] < 0:
+            raise ValueError("fringe_anchor_interval must be non-negative.")
+
+    if 'redundancy_tol' in sim_params:
+        sim_options['redundancy_tol'] = float(sim_params['redundancy_tol'])
+        if sim_options['redundancy_tol'] < 0:
+            raise ValueError("redundancy_tol must be non-negative.")
+
+    if 'task_scheduling' in sim_params:
+        scheduling = str(sim_params['task_scheduling']).lower()
+        if scheduling not in ['static', 'dynamic', 'balanced']:
+            raise ValueError(
+                "task_scheduling must be one of 'static', 'dynamic' or 'balanced'."
+            )
+        sim_options['task_scheduling'] = scheduling
+
+    if 'task_chunk_size' in sim_params:
+        chunk_size = sim_params['task_chunk_size']
+        if not chunk_size == 'auto':
+            chunk_size = int(chunk_size)
+            if chunk_size < 1:
+                raise ValueError("task_chunk_size must be 'auto' or a positive integer.")
+        sim_options['task_chunk_size'] = chunk_size
+
+    if 'jones_prefetch_depth' in sim_params:
+        sim_options['jones_prefetch_depth'] = int(sim_params['jones_prefetch_depth'])
+        if sim_options['jones_prefetch_depth'] < 0:
+            raise ValueError("jones_prefetch_depth must be non-negative.")
+
+    if 'jones_prefetch_threads' in sim_params:
+        sim_options['jones_prefetch_threads'] = int(sim_params['jones_prefetch_threads'])
+        if sim_options['jones_prefetch_threads'] < 1:
+            raise ValueError("jones_prefetch_threads must be a positive integer.")
+
+    return sim_options
+
+
+def parse_checkpoint_params(filing_params, config_path=''):
+    """
+    Parse the checkpoint options in the "filing" section of obsparam.
+
+    Args:
+        filing_params: Dictionary of filing parameters.
+        config_path: Directory of the obsparam file. A relative checkpoint_dir is
+            taken to be relative to it, so that a simulation is resumed from and its
+            checkpoints are removed in the same place wherever it is run from.
+
+    Returns:
+        dict
+            * `checkpoint_interval`: (float) Minutes between checkpoints of each rank,
+              or None if checkpoints are not written.
+            * `checkpoint_dir`: (str) Absolute path of the directory for checkpoint
+              files. Defaults to the `pyuvsim_checkpoint` subdirectory of `outdir`.
+    """
+    if filing_params is None:
+        filing_params = {}
+
+    interval = filing_params.get('checkpoint_interval', None)
+    if interval is not None:
+        interval = float(interval)
+        if interval < 0:
+            raise ValueError("checkpoint_interval must be non-negative.")
+        if interval == 0:
+            interval = None
+
+    checkpoint_dir = filing_params.get(
+        'checkpoint_dir', os.path.join(filing_params.get('outdir', '.'), 'pyuvsim_checkpoint')
+    )
+    checkpoint_dir = os.path.abspath(os.path.join(config_path, checkpoint_dir))
+
+    return {'checkpoint_interval': interval, 'checkpoint_dir': checkpoint_dir}
+
+
+def parse_output_params(filing_params):
+    """
+    Parse the options in the "filing" section of obsparam for how results are written.
+
+    Args:
+        filing_params: Dictionary of filing parameters.
+
+    Returns:
+        dict
+            * `output_mode`: (str) 'single' to collect all visibilities on rank 0 and
+              write them from there, 'shards' for the root rank of each node to write
+              the visibilities of its node to a shard file at the end, or 'stream'
+              for every rank to write visibilities to a shard file as it finishes them.
+              Shards are merged into a single uvh5 file.
+            * `shard_dir`: (str) Directory for shard files. Defaults to the
+              `pyuvsim_shards` subdirectory of `outdir`.
+    """
+    if filing_params is None:
+        filing_params = {}
+
+    output_mode = str(filing_params.get('output_mode', 'single')).lower()
+    if output_mode not in ['single', 'shards', 'stream']:
+        raise ValueError("output_mode must be one of 'single', 'shards' or 'stream'.")
+    if output_mode != 'single' and filing_params.get('output_format', 'uvh5') != 'uvh5':
+        raise ValueError("output_format must be uvh5 to write shards.")
+
+    shard_dir = filing_params.get(
+        'shard_dir', os.path.join(filing_params.get('outdir', '.'), 'pyuvsim_shards')
+    )
+
+    return {'output_mode': output_mode, 'shard_dir': shard_dir}
+
+
 def freq_array_to_params(freq_array):
     """
     Give the channel width, bandwidth, start, and end frequencies corresponding
@@ -1710,7 +1894,7 @@ def uvdata_to_config_file(uvdata_in, param_filename=None, telescope_config_name=
         yaml.dump(param_dict, yfile, default_flow_style=False)
 
 
-def _complete_uvdata(uv_in, inplace=False):
+def _complete_uvdata(uv_in, inplace=False, metadata_only=False):
     """Fill out all required parameters of a :class:~`pyuvdata.UVData` object such that
     it passes the :func:~`pyuvdata.UVData.check()`.
 
@@ -1722,6 +1906,8 @@ def _complete_uvdata(uv_in, inplace=False):
         Usually an incomplete object, containing only metadata.
     inplace : bool, optional
         Whether to perform the filling on the passed object, or a copy.
+    metadata_only : bool, optional
+        Do not allocate the data, flag and nsample arrays, and remove them if present.
 
     Returns
     -------
@@ -1756,10 +1942,15 @@ def _complete_uvdata(uv_in, inplace=False):
         )
 
     # Clear existing data, if any.
-    _shape = (uv_obj.Nblts, uv_obj.Nspws, uv_obj.Nfreqs, uv_obj.Npols)
-    uv_obj.data_array = np.zeros(_shape, dtype=np.complex)
-    uv_obj.flag_array = np.zeros(_shape, dtype=bool)
-    uv_obj.nsample_array = np.ones(_shape, dtype=float)
+    if metadata_only:
+        uv_obj.data_array = None
+        uv_obj.flag_array = None
+        uv_obj.nsample_array = None
+    else:
+        _shape = (uv_obj.Nblts, uv_obj.Nspws, uv_obj.Nfreqs, uv_obj.Npols)
+        uv_obj.data_array = np.zeros(_shape, dtype=np.complex)
+        uv_obj.flag_array = np.zeros(_shape, dtype=bool)
+        uv_obj.nsample_array = np.ones(_shape, dtype=float)
 
     uv_obj.extra_keywords = {}
 
@@ -89,3 +89,20 @@ def test_set_interps(cst_beam, hera_loc):
         antenna1.get_beam_jones(array, source_altaz, freq)
 
     assert beam.interpolation_function == 'az_za_simple'
+
+
+def test_jones_freq_array(cst_beam, hera_loc):
+    # Passing an array of frequencies gives the stacked single-frequency results.
+    beam_list = pyuvsim.BeamList([cst_beam.copy(), pyuvsim.AnalyticBeam('airy', diameter=14)])
+    array = pyuvsim.Telescope('telescope_name', hera_loc, beam_list)
+    source_altaz = np.array([[np.pi / 2, np.pi / 3, np.pi / 4], [0.0, 1.0, 2.0]])
+    freqs = np.array([125e6, 130e6, 140e6]) * units.Hz
+
+    for beam_id in range(2):
+        antenna = pyuvsim.Antenna('ant1', 1, np.array([0, 10, 0]), beam_id)
+        jones = antenna.get_beam_jones(array, source_altaz, freqs)
+        assert jones.shape == (2, 2, freqs.size, 3)
+        for fi, freq in enumerate(freqs):
+            jones_single = antenna.get_beam_jones(array, source_altaz, freq)
+            assert jones_single.shape == (2, 2, 3)
+            assert np.allclose(jones[:, :, fi], jones_single)
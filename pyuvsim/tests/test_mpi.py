@@ -2,11 +2,14 @@
 # Copyright (c) 2018 Radio Astronomy Software Group
 # Licensed under the 3-clause BSD License
 
+import os
+
 import numpy as np
 import resource
 import time
 import pytest
 import sys
+from pyuvdata import UVData
 
 pytest.importorskip('mpi4py')  # noqa
 import mpi4py
@@ -76,6 +79,17 @@ def test_shared_mem():
     pytest.raises(ValueError, sA.itemset, 0, 3.0)
 
 
+@pytest.mark.parallel(3)
+@pytest.mark.parametrize('dtype', [np.float32, np.complex128])
+def test_shared_mem_chunks(dtype):
+    # Broadcast in chunks smaller than the array and not aligned with its items.
+    A = (np.arange(1000) * (1 + 1j)).astype(dtype).reshape(50, 20)[:, ::2]
+    sA = mpi.shared_mem_bcast(A if mpi.rank == 0 else None, chunk_bytes=333)
+    assert sA.dtype == dtype
+    assert np.all(sA == A)
+    assert not sA.flags['WRITEABLE']
+
+
 def test_mem_usage():
     # Check that the mpi-enabled memory check is consistent
     # with a local memory check.
@@ -112,6 +126,37 @@ def test_mpi_counter(count_rank):
     count.free()
 
 
+@pytest.mark.parallel(4)
+def test_progress_counter():
+    # Counts from all ranks are passed on through the node roots to rank 0,
+    # and the full count is reported once all ranks have finished.
+    mpi.start_mpi()
+    reported = []
+    count = mpi.ProgressCounter(interval=0, report=reported.append)
+    N = 20
+    for i in range(N * (mpi.rank + 1)):
+        count.next()
+    count.finish()
+    Ntot = N * sum(range(1, mpi.Npus + 1))
+    if mpi.rank == 0:
+        assert count.current_value() == Ntot
+        assert reported[-1] == Ntot
+        assert reported == sorted(reported)
+    else:
+        assert count.current_value() is None
+        assert reported == []
+    count.free()
+
+
+def test_mpi_counter_64bit():
+    # The counter does not overflow at 2**31.
+    mpi.start_mpi()
+    count = mpi.Counter()
+    count.next(2**31)
+    assert count.next() >= 2**31
+    count.free()
+
+
 @pytest.mark.parametrize('MAX_BYTES', [mpi.INT_MAX, 100])
 def test_big_gather(MAX_BYTES, fake_tasks):
 
@@ -189,6 +234,20 @@ def test_sharedmem_bcast_with_quantities():
         assert np.all(freq_return.to("MHz") == freqs.to("MHz"))
 
 
+@pytest.mark.parallel(3)
+def test_uvdata_shared_bcast():
+    uv_ref = UVData()
+    uv_ref.read_uvfits(os.path.join(pyuvsim.data.DATA_PATH, '28m_triangle_10time_10chan.uvfits'))
+    uv = uv_ref.copy() if mpi.rank == 0 else UVData()
+
+    uv = mpi.uvdata_shared_bcast(uv, min_bytes=1000)
+    assert uv == uv_ref
+    # Large arrays are shared and read-only, small ones are not.
+    assert not uv.uvw_array.flags['WRITEABLE']
+    assert not uv.data_array.flags['WRITEABLE']
+    assert uv.antenna_numbers.flags['WRITEABLE']
+
+
 @pytest.mark.parallel(3)
 def test_skymodeldata_share():
     # Test the SkyModelData share method.
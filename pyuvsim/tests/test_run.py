@@ -2,6 +2,7 @@
 # Copyright (c) 2020 Radio Astronomy Software Group
 # Licensed under the 3-clause BSD License
 
+import copy
 import numpy as np
 import os
 import pytest
@@ -157,7 +158,11 @@ def test_run_gleam_uvsim(spectral_type):
 @pytest.mark.parametrize(
     "spectral_type",
     ["subband", "spectral_index"])
-def test_zenith_spectral_sim(spectral_type, tmpdir):
+@pytest.mark.parametrize(
+    "sim_options",
+    [{}, {'vectorize_freqs': True}, {'factorize_antennas': True},
+     {'vectorize_freqs': True, 'factorize_antennas': True}, {'precision': 'single'}])
+def test_zenith_spectral_sim(spectral_type, sim_options, tmpdir):
     # Make a power law source at zenith in three ways.
     # Confirm that simulated visibilities match expectation.
 
@@ -193,11 +198,14 @@ def test_zenith_spectral_sim(spectral_type, tmpdir):
     params['freq'] = freq_params
     params['time']['start_time'] = kwds['time']
     params['select'] = {'antenna_nums' : [1, 2]}
+    params['simulation'] = sim_options
 
     uv_out = pyuvsim.run_uvsim(params, return_uv=True)
 
     for ii in range(uv_out.Nbls):
         assert np.allclose(uv_out.data_array[ii, 0, :, 0], spectrum / 2)
+    precision = sim_options.get('precision', 'double')
+    assert f"Precision = {precision}." in uv_out.history
 
 
 def test_pol_error():
@@ -215,6 +223,133 @@ def test_input_uv_error():
         pyuvsim.run_uvdata_uvsim(None, None)
 
 
+@pytest.fixture(scope='module')
+def hex_sim():
+    # A small simulation setup and its visibilities from a default run. Antennas 7 and 8
+    # make some baselines the reverse of the first baseline of their redundant group.
+    param_filename = os.path.join(SIM_DATA_PATH, 'test_config', 'obsparam_hex37_14.6m.yaml')
+    param_dict = pyuvsim.simsetup._config_str_to_dict(param_filename)
+    uv_obj, beam_list, beam_dict = pyuvsim.initialize_uvdata_from_params(param_dict)
+    uv_obj.select(times=np.unique(uv_obj.time_array)[:3], freq_chans=[0, 1],
+                  antenna_nums=[0, 1, 2, 3, 4, 7, 8])
+    beam_list[0] = pyuvsim.AnalyticBeam('airy', diameter=14.6)
+
+    time = Time(uv_obj.time_array[0], format='jd', scale='utc')
+    sources, _ = pyuvsim.create_mock_catalog(
+        time, arrangement='long-line', Nsrcs=20, return_data=True
+    )
+    sources.polarized = np.array([10, 11])
+    sources.stokes_Q = np.array([0.1] * 2)[None, :]
+    sources.stokes_U = np.array([2.0] * 2)[None, :]
+    sources.stokes_V = np.array([0.3] * 2)[None, :]
+
+    uv_ref = pyuvsim.run_uvdata_uvsim(uv_obj, beam_list, beam_dict=beam_dict,
+                                      catalog=sources, quiet=True)
+    return uv_obj, beam_list, beam_dict, sources, uv_ref
+
+
+@pytest.mark.parametrize('sim_options', [
+    {'task_scheduling': 'balanced'},
+    {'output_mode': 'shards'},
+    {'output_mode': 'stream'},
+    {'simulate_redundant_once': True, 'redundancy_tol': 0.1},
+], ids=['balanced', 'shards', 'stream', 'redundant_once'])
+@pytest.mark.parallel(2)
+def test_run_options(hex_sim, sim_options, tmpdir):
+    # Options that change how a simulation is run should not change its visibilities.
+    uv_obj, beam_list, beam_dict, sources, uv_ref = hex_sim
+    sim_options = dict(sim_options, catalog=sources, quiet=True)
+    sharded = sim_options.get('output_mode') in ['shards', 'stream']
+    if sharded:
+        # Broadcast so that every rank writes to the same directory.
+        shard_dir = pyuvsim.mpi.world_comm.bcast(str(tmpdir.join('shards')), root=0)
+        sim_options['shard_dir'] = shard_dir
+    uv_out = pyuvsim.run_uvdata_uvsim(uv_obj, beam_list, beam_dict=beam_dict, **sim_options)
+    if pyuvsim.mpi.rank == 0:
+        if sharded:
+            assert uv_out.data_array is None
+            pyuvsim.utils.merge_shards(uv_out, shard_dir)
+        assert uv_out.Nbls == uv_ref.Nbls
+        assert np.allclose(uv_out.data_array, uv_ref.data_array)
+
+
+def test_simulate_redundant_once_beam_error(hex_sim):
+    uv_obj, beam_list, beam_dict, sources, _ = hex_sim
+    beam_list = copy.deepcopy(beam_list)
+    beam_list.append(pyuvsim.AnalyticBeam('gaussian', diameter=12.0))
+    beam_dict = dict(beam_dict, ANT1=1)
+    with pytest.raises(ValueError, match="requires all antennas to share a beam"):
+        pyuvsim.run_uvdata_uvsim(
+            uv_obj, beam_list, beam_dict=beam_dict, catalog=sources, quiet=True,
+            simulate_redundant_once=True
+        )
+
+
+@pytest.mark.parametrize('task_scheduling', ['static', 'dynamic'])
+@pytest.mark.parallel(2)
+def test_checkpoint_resume(hex_sim, task_scheduling, tmpdir, monkeypatch):
+    # A simulation that fails part way through and is resumed from its
+    # checkpoints should match one that runs straight through.
+    uv_obj, beam_list, beam_dict, sources, uv_ref = hex_sim
+    sim_options = {'catalog': sources, 'quiet': True, 'task_scheduling': task_scheduling,
+                   'task_chunk_size': 2}
+
+    # Broadcast so that every rank uses the same checkpoint directory.
+    checkpoint_dir = pyuvsim.mpi.world_comm.bcast(str(tmpdir.join('checkpoint')), root=0)
+    make_visibility = pyuvsim.UVEngine.make_visibility
+    Ndone = []
+
+    def failing_make_visibility(engine):
+        if len(Ndone) == 5:
+            raise RuntimeError("Simulated failure")
+        Ndone.append(1)
+        return make_visibility(engine)
+
+    monkeypatch.setattr(pyuvsim.UVEngine, 'make_visibility', failing_make_visibility)
+    with pytest.raises(RuntimeError, match="Simulated failure"):
+        pyuvsim.run_uvdata_uvsim(
+            uv_obj, beam_list, beam_dict=beam_dict, checkpoint_interval=1e-9,
+            checkpoint_dir=checkpoint_dir, **sim_options
+        )
+    pyuvsim.mpi.world_comm.Barrier()
+
+    def counting_make_visibility(engine):
+        Ndone.append(1)
+        return make_visibility(engine)
+
+    Ndone.clear()
+    monkeypatch.setattr(pyuvsim.UVEngine, 'make_visibility', counting_make_visibility)
+    uv_resumed = pyuvsim.run_uvdata_uvsim(
+        uv_obj, beam_list, beam_dict=beam_dict, checkpoint_interval=1e-9,
+        checkpoint_dir=checkpoint_dir, resume=True, **sim_options
+    )
+    # Only the tasks not finished before the failure are simulated again.
+    Ntasks = uv_obj.Nblts * uv_obj.Nfreqs
+    Nresumed = pyuvsim.mpi.world_comm.allreduce(len(Ndone))
+    assert Nresumed == Ntasks - 5 * pyuvsim.mpi.Npus
+    if pyuvsim.mpi.rank == 0:
+        assert np.allclose(uv_resumed.data_array, uv_ref.data_array)
+    monkeypatch.setattr(pyuvsim.UVEngine, 'make_visibility', make_visibility)
+
+    with pytest.raises(ValueError, match="checkpoint_dir must be set"):
+        pyuvsim.run_uvdata_uvsim(uv_obj, beam_list, beam_dict=beam_dict, resume=True,
+                                 **sim_options)
+
+
+@pytest.mark.parametrize('output_mode', ['shards', 'stream'])
+def test_shard_dir_errors(hex_sim, output_mode, tmpdir):
+    uv_obj, beam_list, beam_dict, sources, _ = hex_sim
+    sim_options = {'catalog': sources, 'quiet': True, 'output_mode': output_mode}
+    with pytest.raises(ValueError, match="shard_dir must be set"):
+        pyuvsim.run_uvdata_uvsim(uv_obj, beam_list, beam_dict=beam_dict, **sim_options)
+    if output_mode == 'stream':
+        with pytest.raises(ValueError, match="Checkpoints cannot be used"):
+            pyuvsim.run_uvdata_uvsim(
+                uv_obj, beam_list, beam_dict=beam_dict, shard_dir=str(tmpdir),
+                checkpoint_interval=1, checkpoint_dir=str(tmpdir), **sim_options
+            )
+
+
 @pytest.mark.skipif('not pyuvsim.astropy_interface.hasmoon')
 def test_sim_on_moon():
     from pyuvsim.astropy_interface import MoonLocation
@@ -593,6 +593,110 @@ def test_freq_parser():
         pyuvsim.parse_frequency_params(subdict)
 
 
+def test_simulation_parser():
+    # Defaults are returned for an empty or missing section.
+    defaults = pyuvsim.parse_simulation_params({})
+    assert defaults == pyuvsim.parse_simulation_params(None)
+    assert defaults['vectorize_freqs'] is False
+    assert defaults['factorize_antennas'] is False
+
+    test = pyuvsim.parse_simulation_params({'vectorize_freqs': True, 'factorize_antennas': 1})
+    assert test['vectorize_freqs'] is True
+    assert test['factorize_antennas'] is True
+
+    test = pyuvsim.parse_simulation_params({'jones_cache_mb': 10})
+    assert test['jones_cache_mb'] == 10.0
+
+    with pytest.raises(ValueError, match='jones_cache_mb must be non-negative'):
+        pyuvsim.parse_simulation_params({'jones_cache_mb': -1})
+
+    assert defaults['precision'] == 'double'
+    test = pyuvsim.parse_simulation_params({'precision': 'Single'})
+    assert test['precision'] == 'single'
+
+    with pytest.raises(ValueError, match="precision must be either 'single' or 'double'"):
+        pyuvsim.parse_simulation_params({'precision': 'half'})
+
+    assert defaults['source_tile_size'] == 'auto'
+    test = pyuvsim.parse_simulation_params({'source_tile_size': 4096})
+    assert test['source_tile_size'] == 4096
+
+    with pytest.raises(ValueError, match="source_tile_size must be 'auto'"):
+        pyuvsim.parse_simulation_params({'source_tile_size': -1})
+
+    assert defaults['fringe_anchor_interval'] == 16
+    with pytest.raises(ValueError, match="fringe_anchor_interval must be non-negative"):
+        pyuvsim.parse_simulation_params({'fringe_anchor_interval': -1})
+
+    test = pyuvsim.parse_simulation_params({'simulate_redundant_once': True,
+                                            'redundancy_tol': 0.1})
+    assert test['simulate_redundant_once'] is True
+    assert test['redundancy_tol'] == 0.1
+    with pytest.raises(ValueError, match="redundancy_tol must be non-negative"):
+        pyuvsim.parse_simulation_params({'redundancy_tol': -1})
+
+    assert defaults['task_scheduling'] == 'static'
+    assert defaults['task_chunk_size'] == 'auto'
+    test = pyuvsim.parse_simulation_params({'task_scheduling': 'Dynamic', 'task_chunk_size': 8})
+    assert test['task_scheduling'] == 'dynamic'
+    assert test['task_chunk_size'] == 8
+    test = pyuvsim.parse_simulation_params({'task_scheduling': 'balanced'})
+    assert test['task_scheduling'] == 'balanced'
+    with pytest.raises(ValueError, match="task_scheduling must be one of"):
+        pyuvsim.parse_simulation_params({'task_scheduling': 'random'})
+    with pytest.raises(ValueError, match="task_chunk_size must be 'auto' or a positive integer"):
+        pyuvsim.parse_simulation_params({'task_chunk_size': 0})
+
+    assert defaults['jones_prefetch_depth'] == 0
+    test = pyuvsim.parse_simulation_params({'jones_prefetch_depth': 4,
+                                            'jones_prefetch_threads': 3})
+    assert test['jones_prefetch_depth'] == 4
+    assert test['jones_prefetch_threads'] == 3
+    with pytest.raises(ValueError, match="jones_prefetch_depth must be non-negative"):
+        pyuvsim.parse_simulation_params({'jones_prefetch_depth': -1})
+    with pytest.raises(ValueError, match="jones_prefetch_threads must be a positive integer"):
+        pyuvsim.parse_simulation_params({'jones_prefetch_threads': 0})
+
+    with pytest.raises(ValueError, match='Unrecognized simulation parameters: foo'):
+        pyuvsim.parse_simulation_params({'foo': 1, 'vectorize_freqs': True})
+
+
+def test_checkpoint_parser():
+    defaults = pyuvsim.parse_checkpoint_params({'outdir': 'results'})
+    assert defaults['checkpoint_interval'] is None
+    assert defaults['checkpoint_dir'] == os.path.abspath(
+        os.path.join('results', 'pyuvsim_checkpoint')
+    )
+    test = pyuvsim.parse_checkpoint_params({'checkpoint_interval': 0})
+    assert test['checkpoint_interval'] is None
+
+    test = pyuvsim.parse_checkpoint_params({'checkpoint_interval': 30, 'checkpoint_dir': 'ckpt'})
+    assert test == {'checkpoint_interval': 30.0, 'checkpoint_dir': os.path.abspath('ckpt')}
+
+    # Relative directories are anchored to the obsparam file's directory.
+    config_path = os.path.join(SIM_DATA_PATH, 'test_config')
+    test = pyuvsim.parse_checkpoint_params({'outdir': 'results'}, config_path=config_path)
+    assert test['checkpoint_dir'] == os.path.join(config_path, 'results', 'pyuvsim_checkpoint')
+    test = pyuvsim.parse_checkpoint_params({'checkpoint_dir': '/tmp/ckpt'},
+                                           config_path=config_path)
+    assert test['checkpoint_dir'] == '/tmp/ckpt'
+    with pytest.raises(ValueError, match="checkpoint_interval must be non-negative"):
+        pyuvsim.parse_checkpoint_params({'checkpoint_interval': -1})
+
+
+def test_output_parser():
+    defaults = pyuvsim.parse_output_params({'outdir': 'results'})
+    assert defaults == {'output_mode': 'single',
+                        'shard_dir': os.path.join('results', 'pyuvsim_shards')}
+    test = pyuvsim.parse_output_params({'output_mode': 'Stream', 'shard_dir': 'shards'})
+    assert test == {'output_mode': 'stream', 'shard_dir': 'shards'}
+
+    with pytest.raises(ValueError, match="output_mode must be one of"):
+        pyuvsim.parse_output_params({'output_mode': 'gather'})
+    with pytest.raises(ValueError, match="output_format must be uvh5 to write shards"):
+        pyuvsim.parse_output_params({'output_mode': 'shards', 'output_format': 'uvfits'})
+
+
 def test_time_parser():
     """
     Check a variety of cases for the time parser.
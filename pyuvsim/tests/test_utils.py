@@ -4,6 +4,7 @@
 
 import os
 
+import h5py
 import numpy as np
 import pytest
 from pyuvdata import UVData
@@ -152,3 +153,61 @@ def test_file_format_in_filing_dict(tmpdir):
 
     # Cleanup
     os.remove(ofname + '.uvfits')
+
+
+def test_merge_shards(tmpdir):
+    uv = UVData()
+    uv.read_uvfits(triangle_uvfits_file)
+    uv.reorder_blts('time', minor_order='baseline')
+    data = uv.data_array[:, 0].reshape(uv.Ntimes, uv.Nbls, uv.Nfreqs, uv.Npols)
+
+    # Shards hold some of the times, and partial sums of others.
+    shard_dir = str(tmpdir.join('shards'))
+    os.makedirs(shard_dir)
+    with h5py.File(simutils.shard_filename(shard_dir, 0), 'w') as shard:
+        shard['time_0'] = data[0] / 4
+        for time_i in range(2, uv.Ntimes):
+            shard[f"time_{time_i}"] = data[time_i]
+    with h5py.File(simutils.shard_filename(shard_dir, 3), 'w') as shard:
+        shard['time_0'] = data[0] * 3 / 4
+        shard['time_1'] = data[1]
+
+    uv_merged = uv.copy(metadata_only=True)
+    simutils.merge_shards(uv_merged, shard_dir)
+    assert np.allclose(uv_merged.data_array, uv.data_array)
+
+    filename = simutils.write_uvdata(uv.copy(metadata_only=True),
+                                     {'outfile_name': str(tmpdir.join('merged'))},
+                                     return_filename=True, shard_dir=shard_dir)
+    assert filename.endswith('.uvh5')
+    uv_file = UVData()
+    uv_file.read(filename)
+    assert np.allclose(uv_file.data_array, uv.data_array)
+
+    with pytest.raises(ValueError, match="Shards can only be merged into a uvh5 file"):
+        simutils.write_uvdata(uv, {'outfile_name': filename}, out_format='uvfits',
+                              shard_dir=shard_dir)
+
+    simutils.remove_shards(shard_dir)
+    assert not os.path.exists(shard_dir)
+
+
+@pytest.mark.parametrize(('size', 'nbytes'), [(1000, 1000), ('1000', 1000), ('2K', 2048),
+                                              ('1.5MB', 1.5 * 2**20), ('200G', 200 * 2**30),
+                                              ('1TiB', 2**40), (' 3 gb', 3 * 2**30)])
+def test_parse_memory_size(size, nbytes):
+    assert simutils.parse_memory_size(size) == nbytes
+
+
+def test_parse_memory_size_error():
+    with pytest.raises(ValueError, match="Invalid memory size: lots"):
+        simutils.parse_memory_size('lots')
+
+
+def test_estimate_source_memory_usage():
+    mem = simutils.estimate_source_memory_usage(10, 1)
+    assert mem == 10 * simutils.estimate_source_memory_usage(1, 1)
+    # More frequencies in the sky model and in the engine take more memory.
+    assert simutils.estimate_source_memory_usage(10, 5) > mem
+    assert simutils.estimate_source_memory_usage(10, 1, Nfreqs_per_task=5) > mem
+    assert simutils.estimate_source_memory_usage(10, 1, precision='single') < mem
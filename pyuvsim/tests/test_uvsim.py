@@ -5,6 +5,7 @@
 import numpy as np
 import copy
 import itertools
+import json
 import os
 import warnings
 
@@ -562,6 +563,56 @@ def test_local_task_gen():
         assert np.allclose(engine1.make_visibility(), engine0.make_visibility())
 
 
+@pytest.mark.parametrize('spectral_type', ['flat', 'spectral_index'])
+def test_vectorized_freqs(spectral_type):
+    # Frequency-vectorized tasks should match the single-frequency tasks.
+    hera_uv = UVData()
+    hera_uv.read_uvfits(EW_uvfits_10time10chan)
+    hera_uv.select(times=np.unique(hera_uv.time_array)[0:2], freq_chans=range(4))
+    time = Time(hera_uv.time_array[0], scale='utc', format='jd')
+    sources, kwds = pyuvsim.create_mock_catalog(
+        time, arrangement='random', Nsrcs=10, return_data=True, rseed=3
+    )
+    if spectral_type == 'spectral_index':
+        sources.spectral_type = 'spectral_index'
+        sources.reference_frequency = np.full(sources.Ncomponents, 100e6)
+        sources.spectral_index = np.linspace(-2, 0, sources.Ncomponents)
+
+    beam_list = pyuvsim.BeamList(multi_beams[1:])
+    beam_dict = {'ANT1': 1, 'ANT2': 2}
+
+    Nbls, Ntimes, Nfreqs = hera_uv.Nbls, hera_uv.Ntimes, hera_uv.Nfreqs
+    Ntasks = Nbls * Ntimes * Nfreqs
+
+    uvtask_list = list(pyuvsim.uvdata_to_task_iter(
+        np.arange(Ntasks), hera_uv, sources, beam_list, beam_dict
+    ))
+    vec_task_list = list(pyuvsim.uvdata_to_task_iter(
+        np.arange(Nbls * Ntimes), hera_uv, sources, beam_list, beam_dict,
+        vectorize_freqs=True
+    ))
+    assert len(vec_task_list) == Ntasks // Nfreqs
+
+    engine = pyuvsim.UVEngine()
+    vis_single = np.zeros((hera_uv.Nblts, Nfreqs, 4), dtype=complex)
+    for task in uvtask_list:
+        engine.set_task(task)
+        blti, _, fi = task.uvdata_index
+        vis_single[blti, fi] = engine.make_visibility()
+
+    vis_vec = np.zeros_like(vis_single)
+    for task in vec_task_list:
+        engine.set_task(task)
+        blti, _, fi = task.uvdata_index
+        assert fi == slice(0, Nfreqs)
+        vis = engine.make_visibility()
+        assert vis.shape == (Nfreqs, 4)
+        assert vis.flags['C_CONTIGUOUS']
+        vis_vec[blti, fi] = vis
+
+    assert np.allclose(vis_single, vis_vec)
+
+
 def test_task_coverage():
     """
     Check that the task ids generated in different scenarios
@@ -626,6 +677,44 @@ def test_task_coverage():
         inds = np.lexsort((tasks[:, 0], tasks[:, 1]), axis=0)
         assert np.all(tasks[inds] == tasks_expected)
 
+        # Frequency-vectorized tasks don't split the frequency axis.
+        Nbls = 3
+        Ntimes = 4
+        Nfreqs = 7
+        Nsrcs = 10
+        task_inds_all = []
+        for rank in range(Npus):
+            task_inds, src_inds, Ntasks_local, Nsrcs_local = pyuvsim.uvsim._make_task_inds(
+                Nbls, Ntimes, Nfreqs, Nsrcs, rank, Npus, vectorize_freqs=True
+            )
+            task_inds_all.extend(task_inds)
+        if Npus < Nbls * Ntimes:
+            assert task_inds_all == list(range(Nbls * Ntimes))
+
+
+@pytest.mark.parametrize(
+    ('Ntasks', 'Nsrcs', 'Npus', 'max_srcs_local', 'grid_shape'),
+    [(12, 10, 4, None, (4, 1)),
+     (4, 100, 5, None, (1, 5)),
+     (4, 100, 6, None, (3, 2)),
+     (12, 100, 6, 50, (3, 2)),
+     (12, 100, 6, 40, (2, 3)),
+     (12, 100, 6, 10, (1, 6)),
+     (3, 2, 5, None, (5, 1))]
+)
+def test_process_grid(Ntasks, Nsrcs, Npus, max_srcs_local, grid_shape):
+    assert pyuvsim.uvsim._process_grid(Ntasks, Nsrcs, Npus, max_srcs_local) == grid_shape
+
+    # Every (task, source) pair is covered by exactly one rank.
+    pairs = []
+    for rank in range(Npus):
+        task_inds, src_inds, Ntasks_local, Nsrcs_local = pyuvsim.uvsim._make_task_inds(
+            Ntasks, 1, 1, Nsrcs, rank, Npus, grid_shape=grid_shape
+        )
+        assert (len(task_inds), len(src_inds)) == (Ntasks_local, Nsrcs_local)
+        pairs.extend(itertools.product(task_inds, src_inds))
+    assert sorted(pairs) == list(itertools.product(range(Ntasks), range(Nsrcs)))
+
 
 def test_source_splitting():
     # Check that if the available memory is less than the expected size of the source catalog,
@@ -794,20 +883,434 @@ def test_update_flags(uvobj_beams_srcs):
     assert all(axes_covered)
 
 
-def test_overflow_check():
-    # Ensure error before running sim for too many tasks.
+@pytest.mark.parametrize('Nfreqs', [None, 3])
+@pytest.mark.parametrize(('dtype', 'rtol'), [(np.complex128, 1e-12), (np.complex64, 1e-5)])
+def test_coherency_kernels(Nfreqs, dtype, rtol):
+    # The in-place kernels should match the direct calculation, in single
+    # or double precision.
+    rng = np.random.default_rng(11)
+    Nsrcs = 40
+    comp_shape = (Nsrcs,) if Nfreqs is None else (Nfreqs, Nsrcs)
+
+    def crandn(shape):
+        return rng.standard_normal(shape) + 1j * rng.standard_normal(shape)
+
+    jones1 = crandn((2, 2) + comp_shape)
+    jones2 = crandn((2, 2) + comp_shape)
+    # Flat-spectrum coherencies have no frequency axis.
+    coherency = crandn((2, 2, Nsrcs))
+    uvw = rng.standard_normal(3) * 20
+    inv_wavelength = 1.2 if Nfreqs is None else np.linspace(1, 1.5, Nfreqs)
+    pos_lmn = rng.standard_normal((3, Nsrcs)) * 0.1
+
+    app_ref = np.einsum(
+        "ab...,bc...,cd...->ad...", jones1, coherency, np.swapaxes(jones2, 0, 1).conj()
+    )
+    fringe = np.exp(2j * np.pi * np.multiply.outer(inv_wavelength, np.dot(uvw, pos_lmn)))
+    vis_ref = np.stack([np.sum(app_ref[a, d] * fringe, axis=-1)
+                        for a, d in [(0, 0), (1, 1), (0, 1), (1, 0)]], axis=-1)
+
+    work = pyuvsim.uvsim._Workspace()
+    real_dtype = np.finfo(dtype).dtype
+    app_coh = work.get('app', comp_shape[:-1] + (4, Nsrcs), dtype)
+    pyuvsim.uvsim._apparent_coherency(
+        jones1.astype(dtype), coherency.astype(dtype), jones2.astype(dtype), app_coh,
+        work.get('work', (5,) + comp_shape, dtype)
+    )
+    for pol_i, (a, d) in enumerate([(0, 0), (1, 1), (0, 1), (1, 0)]):
+        assert np.allclose(app_coh[..., pol_i, :], app_ref[a, d], rtol=rtol, atol=0)
+
+    vis = np.zeros(comp_shape[:-1] + (4,), dtype=dtype)
+    pyuvsim.uvsim._fringe_reduce(
+        uvw.astype(real_dtype), inv_wavelength, pos_lmn.astype(real_dtype), app_coh, vis, work
+    )
+    assert np.allclose(vis, vis_ref, rtol=10 * rtol, atol=10 * rtol * np.abs(vis_ref).max())
+
+    # Buffers are reused when the requested size does not grow.
+    fringe_buf = work.get('fringe', comp_shape, dtype)
+    smaller = work.get('fringe', (Nsrcs // 2,), dtype)
+    assert np.shares_memory(smaller, fringe_buf)
+    assert smaller.flags['C_CONTIGUOUS']
+
+
+@pytest.mark.parametrize(('dtype', 'atol'), [(np.float64, 1e-12), (np.float32, 2e-4)])
+@pytest.mark.parametrize('anchor_interval', [1, 4, 100])
+def test_phasor_recurrence(dtype, atol, anchor_interval):
+    # Phasors stepped between channels should match direct evaluation,
+    # with the error of the recurrence reported.
+    rng = np.random.default_rng(3)
+    freqs = np.linspace(100e6, 120e6, 33)
+    assert np.isclose(pyuvsim.uvsim._uniform_spacing(freqs), freqs[1] - freqs[0])
+    assert pyuvsim.uvsim._uniform_spacing(freqs[[0, 1, 3]]) is None
+    assert pyuvsim.uvsim._uniform_spacing(freqs[:2]) is None
+
+    inv_wavelength = freqs / pyuvsim.uvsim.c_ms
+    delay = (rng.standard_normal((5, 40)) * 100).astype(dtype)
+    ref = np.exp(2j * np.pi * np.multiply.outer(inv_wavelength, delay.astype(float)))
+
+    complex_dtype = np.result_type(dtype, np.complex64)
+    out = np.zeros(ref.shape, dtype=complex_dtype)
+    error = pyuvsim.uvsim._phasors(delay, inv_wavelength, out, pyuvsim.uvsim._Workspace(),
+                                   anchor_interval=anchor_interval)
+    assert np.allclose(out, ref, rtol=0, atol=atol * 10)
+    if anchor_interval == 1:
+        assert error == 0
+    elif anchor_interval == 4:
+        assert 0 < error < atol
+    else:
+        # No anchors after the first channel, so the error is that of the last channel,
+        # which is the furthest from the anchor. Rounding of the direct evaluation
+        # differs between channels, so it bounds the true error to within a factor of 2.
+        assert 0 < error < atol
+        assert np.max(np.abs(out - ref)) <= 2 * error
+
+
+def test_jones_cache():
+    arr = np.zeros((2, 2, 10), dtype=complex)
+    cache = pyuvsim.JonesCache(max_bytes=2 * arr.nbytes)
+
+    assert cache.get('a') is None
+    cache.put('a', arr)
+    cache.put('b', arr.copy())
+    assert cache.get('a') is arr
+    assert not arr.flags.writeable
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.nbytes == 2 * arr.nbytes
+
+    # 'b' is the least recently used entry, so it is evicted.
+    cache.put('c', arr.copy())
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+    assert len(cache) == 2
+
+    # Arrays larger than the budget are not cached.
+    cache.put('d', np.zeros(100, dtype=complex))
+    assert 'd' not in cache
+
+    cache.clear()
+    assert len(cache) == 0 and cache.nbytes == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache = pyuvsim.JonesCache(max_bytes=0)
+    cache.put('a', arr)
+    assert len(cache) == 0
+
+
+def test_jones_cache_engine(uvobj_beams_srcs):
+    # Jones matrices are computed once per beam, time, frequency, and source chunk,
+    # and the cached values match those computed directly.
+    uv_obj, beam_list, beam_dict, sources = uvobj_beams_srcs
+    beam_list.set_obj_mode()
+
+    Nsky_parts = 2
+    Ntasks = uv_obj.Nblts * uv_obj.Nfreqs
+    taskiter = pyuvsim.uvdata_to_task_iter(
+        range(Ntasks), uv_obj, sources, beam_list, beam_dict, Nsky_parts=Nsky_parts
+    )
+
+    engine = pyuvsim.UVEngine()
+    nocache_engine = pyuvsim.UVEngine(jones_cache=pyuvsim.JonesCache(max_bytes=0))
+    keys = set()
+    sky, sky_chunk = None, -1
+    for task in taskiter:
+        if task.sources is not sky:
+            sky, sky_chunk = task.sources, sky_chunk + 1
+        engine.set_task(task)
+        vis = engine.make_visibility()
+        nocache_engine.set_task(task)
+        assert np.allclose(vis, nocache_engine.make_visibility())
+        for ant in [task.baseline.antenna1, task.baseline.antenna2]:
+            keys.add((ant.beam_id, task.time.jd, task.freq.to_value('Hz'), sky_chunk))
+
+    assert sky_chunk == Nsky_parts - 1
+
+    assert engine.jones_cache.misses == len(keys)
+    assert engine.jones_cache.hits > 0
+    assert len(nocache_engine.jones_cache) == 0
+
 
-    # This is a large number of tasks that has been run successfully.
-    should_pass = 2004992
-    pyuvsim.uvsim._check_ntasks_valid(should_pass)
+def simulate_tasks(uvobj_beams_srcs, factorize_antennas=False, vectorize_freqs=False,
+                   engine_kwargs=None, jones_cache_mb=None, is_diagonal=None,
+                   task_attrs=None, Nsky_parts=1, prefetch_depth=0):
+    # Simulate all tasks of uvobj_beams_srcs with an engine configured by the options,
+    # with the sky parts summed, and return the engine and the visibilities.
+    uv_obj, beam_list, beam_dict, sources = uvobj_beams_srcs
+    engine_kwargs = dict(engine_kwargs or {})
+    if jones_cache_mb is not None:
+        engine_kwargs['jones_cache'] = pyuvsim.JonesCache(max_bytes=jones_cache_mb * 2**20)
+    if prefetch_depth:
+        engine_kwargs['prefetch_threads'] = 2
+    engine_class = pyuvsim.UVArrayEngine if factorize_antennas else pyuvsim.UVEngine
+    engine = engine_class(**engine_kwargs)
+    if is_diagonal is not None:
+        engine.is_diagonal = is_diagonal
+
+    Ntasks = uv_obj.Ntimes
+    if not factorize_antennas:
+        Ntasks *= uv_obj.Nbls
+    if not vectorize_freqs:
+        Ntasks *= uv_obj.Nfreqs
+    tasks = pyuvsim.uvdata_to_task_iter(
+        range(Ntasks), uv_obj, sources, beam_list, beam_dict, Nsky_parts=Nsky_parts,
+        vectorize_freqs=vectorize_freqs, factorize_antennas=factorize_antennas
+    )
+    if prefetch_depth:
+        tasks = pyuvsim.uvsim._PrefetchingTasks(tasks, engine, prefetch_depth)
+    vis = np.zeros((uv_obj.Nblts, uv_obj.Nfreqs, 4), dtype=complex)
+    for task in tasks:
+        for name, value in (task_attrs or {}).items():
+            setattr(task, name, value)
+        engine.set_task(task)
+        blti, _, freq_i = task.uvdata_index
+        vis[blti, freq_i] += engine.make_visibility()
+    engine.close()
+    return engine, vis
+
+
+def check_factorized(uv_obj, beam_list, engine, ref_engine, vis, vis_ref):
+    # All four beams are in use, so there are several groups of baselines.
+    assert len(engine.beam_pair_groups) > 1
+    assert len(engine.beam_jones) == len(beam_list)
+
+
+def check_prefetched(uv_obj, beam_list, engine, ref_engine, vis, vis_ref):
+    assert engine.jones_prefetched > 0
+    assert engine._prefetch_pool is None and len(engine._prefetching) == 0
+
+
+def check_zero_length(uv_obj, beam_list, engine, ref_engine, vis, vis_ref):
+    # The xy and yx autocorrelations are complex conjugates.
+    autos = uv_obj.ant_1_array == uv_obj.ant_2_array
+    assert np.any(autos)
+    assert np.allclose(vis[autos, :, 2], np.conj(vis[autos, :, 3]))
+
+
+def check_unpolarized(uv_obj, beam_list, engine, ref_engine, vis, vis_ref):
+    assert engine.local_coherency is None
+    assert ref_engine.local_coherency is not None
+
+
+def check_diagonal(uv_obj, beam_list, engine, ref_engine, vis, vis_ref):
+    # The engine keeps the diagonals of the dense Jones matrices.
+    assert all(beam.diagonal_jones for beam in beam_list)
+    if isinstance(engine, pyuvsim.UVArrayEngine):
+        jones = engine.beam_jones[0]
+        jones_dense = ref_engine.beam_jones[0]
+    else:
+        jones = engine.beam1_jones
+        jones_dense = ref_engine.beam1_jones
+    assert jones.shape == jones_dense.shape[1:]
+    assert np.all(jones == np.diagonal(jones_dense, axis1=0, axis2=1).T)
+
+
+def check_single_precision(uv_obj, beam_list, engine, ref_engine, vis, vis_ref):
+    # Single precision engines work in float32, with double precision output.
+    assert engine.make_visibility().dtype == np.complex128
+    if isinstance(engine, pyuvsim.UVArrayEngine):
+        assert engine.antenna_phasors.dtype == np.complex64
+        assert all(jones.dtype == np.complex64 for jones in engine.beam_jones.values())
+    else:
+        assert engine.pos_lmn.dtype == np.float32
+        assert engine.beam1_jones.dtype == np.complex64
+    assert np.any(vis != vis_ref)
+
+
+def all_dense(beam_id):
+    return False
+
+
+def first_beam_dense(beam_id):
+    return beam_id != 0
+
+
+def engine_comparisons():
+    # Engine configurations that should give the same visibilities as a reference
+    # configuration: (id, sky, options, reference options, rtol, check).
+    comparisons = []
+    for vectorize_freqs in [False, True]:
+        # The antenna-factorized engine against one baseline at a time.
+        comparisons.append((
+            f"factorize_antennas-vectorize_freqs={vectorize_freqs}", None,
+            {'factorize_antennas': True, 'vectorize_freqs': vectorize_freqs}, {},
+            1e-12, check_factorized
+        ))
+    for factorize_antennas, jones_cache_mb, uvbeam in [
+        (False, 256, False), (False, 0, False), (True, 256, False),
+        (False, 256, True), (True, 0, True)
+    ]:
+        # Jones matrices computed by the prefetch threads, including for UVBeams, which
+        # keep interpolation splines on the beam object.
+        options = {'factorize_antennas': factorize_antennas, 'Nsky_parts': 2}
+        comparisons.append((
+            f"jones_prefetch-factorize_antennas={factorize_antennas}"
+            f"-jones_cache_mb={jones_cache_mb}-uvbeam={uvbeam}", 'uvbeam' if uvbeam else None,
+            dict(options, jones_cache_mb=jones_cache_mb, prefetch_depth=4), options,
+            1e-14, check_prefetched
+        ))
+    for precision in ['double', 'single']:
+        # Autocorrelations skip the fringe.
+        options = {'vectorize_freqs': True, 'engine_kwargs': {'precision': precision}}
+        comparisons.append((
+            f"zero_length-precision={precision}", None,
+            options, dict(options, task_attrs={'zero_length': False}),
+            1e-6, check_zero_length
+        ))
+    for factorize_antennas, vectorize_freqs in itertools.product([False, True], repeat=2):
+        # The Stokes I path for unpolarized skies.
+        options = {'factorize_antennas': factorize_antennas,
+                   'vectorize_freqs': vectorize_freqs}
+        comparisons.append((
+            f"unpolarized_sky-factorize_antennas={factorize_antennas}"
+            f"-vectorize_freqs={vectorize_freqs}", 'unpolarized',
+            options, dict(options, task_attrs={'unpolarized': False}),
+            1e-12, check_unpolarized
+        ))
+    for factorize_antennas, sky, mixed in itertools.product(
+        [False, True], [None, 'unpolarized'], [False, True]
+    ):
+        # Kernels for diagonal Jones matrices, including for baselines with one
+        # diagonal and one dense beam.
+        options = {'factorize_antennas': factorize_antennas}
+        comparisons.append((
+            f"diagonal_jones-factorize_antennas={factorize_antennas}-sky={sky}-mixed={mixed}",
+            sky, dict(options, is_diagonal=first_beam_dense if mixed else None),
+            dict(options, is_diagonal=all_dense), 1e-12, None if mixed else check_diagonal
+        ))
+    for factorize_antennas in [False, True]:
+        options = {'factorize_antennas': factorize_antennas}
+        comparisons.append((
+            f"single_precision-factorize_antennas={factorize_antennas}", None,
+            dict(options, engine_kwargs={'precision': 'single'}), options,
+            1e-5, check_single_precision
+        ))
+        for precision in ['double', 'single']:
+            # The tile size does not divide the number of sources.
+            ref_options = dict(options, engine_kwargs={'precision': precision})
+            comparisons.append((
+                f"source_tiles-factorize_antennas={factorize_antennas}-precision={precision}",
+                None, dict(options, engine_kwargs={'precision': precision, 'source_tile': 3}),
+                ref_options, 1e-5 if precision == 'single' else 1e-12, None
+            ))
+    return [pytest.param(*comparison[1:], id=comparison[0]) for comparison in comparisons]
+
+
+@pytest.mark.parametrize(('sky', 'options', 'ref_options', 'rtol', 'check'),
+                         engine_comparisons())
+def test_engine_comparison(uvobj_beams_srcs, sky, options, ref_options, rtol, check):
+    # Engine options that change how visibilities are computed should not change them.
+    uv_obj, beam_list, beam_dict, sources = uvobj_beams_srcs
+    if sky == 'unpolarized':
+        sources.polarized = None
+        sources.stokes_Q = sources.stokes_U = sources.stokes_V = None
+    elif sky == 'uvbeam':
+        # UVBeam interpolation is slow, so use fewer times and frequencies.
+        beam_list[0] = os.path.join(SIM_DATA_PATH, 'HERA_NicCST.uvbeam')
+        uv_obj.select(times=np.unique(uv_obj.time_array)[:2], freq_chans=[0, 1, 2])
+    beam_list.set_obj_mode()
+    assert isinstance(beam_list[0], UVBeam) == (sky == 'uvbeam')
+
+    engine, vis = simulate_tasks(uvobj_beams_srcs, **options)
+    ref_engine, vis_ref = simulate_tasks(uvobj_beams_srcs, **ref_options)
+    assert np.max(np.abs(vis - vis_ref)) <= rtol * np.max(np.abs(vis_ref))
+    if check is not None:
+        check(uv_obj, beam_list, engine, ref_engine, vis, vis_ref)
+
+
+def test_prefetching_tasks_lookahead():
+    class Engine:
+        # Tasks are (time, index) pairs, which can be prefetched at the current time.
+        def __init__(self):
+            self.time = None
+            self.prefetched = []
+
+        def prefetch_jones(self, task):
+            if task[0] != self.time:
+                return False
+            self.prefetched.append(task)
+            return True
+
+    engine = Engine()
+    task_inds = pyuvsim.uvsim._ResumableTaskIndices(range(8), 8, pyuvsim.uvsim._TaskRanges())
+    tasks = ((index // 3, index) for index in task_inds)
+    tasks = pyuvsim.uvsim._PrefetchingTasks(tasks, engine, 2, task_inds=task_inds)
+
+    for time, index in tasks:
+        # The current index is that of the task being run, despite reading ahead.
+        assert task_inds.current == index
+        engine.time = time
+    # Each task is prefetched once, when it is at the time of the task before it.
+    assert engine.prefetched == [(0, 1), (0, 2), (1, 4), (1, 5), (2, 7)]
+
+
+def test_probe_source_tile():
+    # The probe returns one of the candidates, or None for no tiling.
+    candidates = (16, 32, 64, 400)
+    tile_size = pyuvsim.probe_source_tile(Nsrcs=200, repeats=1, candidates=candidates)
+    assert tile_size in [16, 32, 64, None]
+
+    # Tiles are scaled down for tasks with many frequencies.
+    tile_size = pyuvsim.probe_source_tile(
+        Nsrcs=200, Nfreqs=16, precision='single', repeats=1, candidates=candidates
+    )
+    assert tile_size in [4, 8, 16, None]
+
+
+def test_precision_error():
+    with pytest.raises(ValueError, match="precision must be one of: double, single"):
+        pyuvsim.UVEngine(precision='half')
+
+
+@pytest.mark.parametrize('block_bytes', [16, 2**10, pyuvsim.uvsim.GEMM_BLOCK_BYTES])
+def test_baseline_gemm(block_bytes):
+    # The blocked matrix product should match a direct sum over sources
+    # for any block size.
+    rng = np.random.default_rng(5)
+    Nants, Nsrcs = 7, 50
+    phasors = np.exp(2j * np.pi * rng.random((Nants, Nsrcs)))
+    coherency = rng.standard_normal((Nsrcs, 4)) + 1j * rng.standard_normal((Nsrcs, 4))
+    ant1_inds, ant2_inds = np.triu_indices(Nants)
+
+    fringe = phasors[ant1_inds].conj() * phasors[ant2_inds]
+    vis_ref = np.einsum("bs,sp->bp", fringe, coherency)
 
-    # This number of tasks is known to produce an overflow error
-    # on bcast/gather operations in MPI.
-    # This test just makes sure that the right error is raised
-    # by the checker function for this value.
-    should_fail = 22118400
-    with pytest.raises(ValueError, match="Too many tasks"):
-        pyuvsim.uvsim._check_ntasks_valid(should_fail)
+    vis = np.zeros((ant1_inds.size, 4), dtype=complex)
+    pyuvsim.uvsim._baseline_gemm(
+        phasors, coherency, ant1_inds, ant2_inds, vis, block_bytes=block_bytes
+    )
+    assert np.allclose(vis, vis_ref)
+
+    bl_block, src_block = pyuvsim.uvsim._gemm_block_shape(
+        ant1_inds.size, Nsrcs, phasors.itemsize, block_bytes
+    )
+    assert 1 <= bl_block <= ant1_inds.size
+    assert 1 <= src_block <= Nsrcs
+    if block_bytes == pyuvsim.uvsim.GEMM_BLOCK_BYTES:
+        assert (bl_block, src_block) == (ant1_inds.size, Nsrcs)
+    else:
+        assert bl_block * src_block * phasors.itemsize <= max(block_bytes, phasors.itemsize)
+
+
+def test_redundancy_map():
+    # Redundant groups should match those found by pyuvdata, including conjugates.
+    param_filename = os.path.join(SIM_DATA_PATH, 'test_config', 'obsparam_hex37_14.6m.yaml')
+    param_dict = pyuvsim.simsetup._config_str_to_dict(param_filename)
+    uv_obj, _, _ = pyuvsim.initialize_uvdata_from_params(param_dict)
+    tol = 0.1
+
+    rep_inds, group_inds, conj = pyuvsim.uvsim._redundancy_map(uv_obj, tol)
+    assert np.all(np.diff(rep_inds) > 0)
+    assert np.all(group_inds[rep_inds] == np.arange(rep_inds.size))
+    assert not np.any(conj[rep_inds])
+
+    antpos, antnums = uv_obj.get_ENU_antpos()
+    antpos = dict(zip(antnums, antpos))
+    bl_vecs = np.array([antpos[a2] - antpos[a1] for a1, a2 in
+                        zip(uv_obj.ant_1_array[:uv_obj.Nbls], uv_obj.ant_2_array[:uv_obj.Nbls])])
+    sign = np.where(conj, -1, 1)[:, None]
+    assert np.allclose(bl_vecs, sign * bl_vecs[rep_inds][group_inds], atol=tol)
+
+    baseline_groups = uv_obj.get_redundancies(tol=tol, include_conjugates=True)[0]
+    assert rep_inds.size == len(baseline_groups)
 
 
 def test_fullfreq_check(uvobj_beams_srcs):
@@ -891,3 +1394,371 @@ def test_run_mpierr():
 
         with pytest.raises(ImportError, match='You need mpi4py to use the uvsim module'):
             pyuvsim.run_uvdata_uvsim(UVData(), ['beamlist'])
+
+
+def test_visibility_blocks():
+    # Visibilities of all task types are added to blocks of whole times.
+    vis_blocks = pyuvsim.uvsim._VisibilityBlocks(Nbls=3, Nfreqs=2)
+    vis_blocks.add((4, 0, 1), np.full(4, 1.0))  # time 1, baseline 1, frequency 1
+    vis_blocks.add((4, 0, slice(0, 2)), np.full((2, 4), 2.0))
+    vis_blocks.add((slice(3, 6), 0, 0), np.full((3, 4), 3.0))
+    vis_blocks.add((slice(6, 9), 0, slice(0, 2)), np.full((3, 2, 4), 4.0))
+
+    assert sorted(vis_blocks.blocks) == [1, 2]
+    expected = np.zeros((3, 2, 4), dtype=complex)
+    expected[:, 0] = 3
+    expected[1] += 2
+    expected[1, 1] += 1
+    assert np.all(vis_blocks.blocks[1] == expected)
+    assert np.all(vis_blocks.blocks[2] == 4)
+
+
+def test_task_range_extent():
+    # Blocks cover the baselines and frequencies of a range of tasks at each time.
+    extent = pyuvsim.uvsim._task_range_extent
+    # Tasks 2 to 8 at time 1 cover all baselines of frequencies 0 and 1.
+    assert extent(range(17, 24), 1, 5, 3, 5, 3) == ((0, 0), (5, 2))
+    assert extent(range(17, 19), 1, 5, 3, 5, 3) == ((2, 0), (2, 1))
+    assert extent(range(17, 24), 0, 5, 3, 5, 3) == ((0, 0), (0, 0))
+    # Tasks of all baselines, and of all frequencies.
+    assert extent(range(4, 6), 1, 5, 3, 1, 3) == ((0, 1), (5, 2))
+    assert extent(range(6, 8), 1, 5, 3, 5, 1) == ((1, 0), (2, 3))
+
+    assert pyuvsim.uvsim._task_range_bytes(range(17, 24), 5, 3, 5, 3) == 5 * 2 * 4 * 16
+    assert pyuvsim.uvsim._task_range_bytes(range(13, 47), 5, 3, 5, 3) == (
+        (2 + 15 + 15 + 2) * 4 * 16
+    )
+
+    vis_blocks = pyuvsim.uvsim._VisibilityBlocks(
+        5, 3, extent=pyuvsim.uvsim._rank_extent(range(17, 19), 5, 3, 5, 3)
+    )
+    vis_blocks.add((7, 0, 0), np.full(4, 1.0))
+    vis_blocks.add((8, 0, 0), np.full(4, 2.0))
+    assert vis_blocks.offsets == {1: (2, 0)}
+    assert np.all(vis_blocks.blocks[1] == np.array([1.0, 2.0])[:, None, None])
+
+    # Restored blocks are widened to the tasks at their time.
+    vis_blocks.clear()
+    vis_blocks.restore(1, np.full((1, 2, 4), 3.0), (4, 1))
+    vis_blocks.add((7, 0, 0), np.full(4, 1.0))
+    assert vis_blocks.offsets[1] == (2, 0)
+    assert vis_blocks.blocks[1].shape == (3, 3, 4)
+    assert np.all(vis_blocks.blocks[1][2, 1:] == 3) and np.sum(vis_blocks.blocks[1]) == 28
+    # With dynamic scheduling, blocks cover all baselines and frequencies.
+    assert pyuvsim.uvsim._rank_extent(iter([]), 5, 3, 5, 3) is None
+
+
+@pytest.mark.parallel(3)
+def test_reduce_visibilities():
+    # Local blocks on all ranks, with overlapping times, are summed into rank 0.
+    mpi = pyuvsim.mpi
+    mpi.start_mpi()
+    Nbls, Nfreqs, Ntimes = 4, 3, 5
+    data = None
+    if mpi.rank == 0:
+        data = np.zeros((Ntimes * Nbls, 1, Nfreqs, 4), dtype=complex)
+    vis_data = mpi.MPI.Win.Create(data, comm=mpi.world_comm)
+
+    vis_blocks = pyuvsim.uvsim._VisibilityBlocks(Nbls, Nfreqs)
+    for time_i in [mpi.rank, mpi.rank + 1]:
+        vis_blocks.add((slice(time_i * Nbls, (time_i + 1) * Nbls), 0, slice(0, Nfreqs)),
+                       np.full((Nbls, Nfreqs, 4), mpi.rank + 1.0))
+    pyuvsim.uvsim._reduce_visibilities(vis_blocks, vis_data)
+    mpi.world_comm.Barrier()
+    vis_data.Free()
+
+    if mpi.rank == 0:
+        expected = np.zeros(Ntimes)
+        for rank in range(mpi.Npus):
+            expected[[rank, rank + 1]] += rank + 1
+        data = data.reshape(Ntimes, Nbls * Nfreqs * 4)
+        assert np.all(data == expected[:, np.newaxis])
+
+
+@pytest.mark.parallel(3)
+def test_window_writer():
+    # Blocks streamed from all ranks, revisiting times, are added to the data on rank 0.
+    mpi = pyuvsim.mpi
+    mpi.start_mpi()
+    Nbls, Nfreqs, Ntimes = 4, 3, 5
+    data = None
+    if mpi.rank == 0:
+        data = np.zeros((Ntimes * Nbls, 1, Nfreqs, 4), dtype=complex)
+    vis_data = mpi.MPI.Win.Create(data, comm=mpi.world_comm)
+
+    vis_blocks = pyuvsim.uvsim._VisibilityBlocks(
+        Nbls, Nfreqs, stream_to=pyuvsim.uvsim._WindowWriter(vis_data, (Nbls, Nfreqs, 4))
+    )
+    times = [mpi.rank, mpi.rank + 1, mpi.rank]
+    for time_i in times:
+        vis_blocks.add((slice(time_i * Nbls, (time_i + 1) * Nbls), 0, slice(0, Nfreqs)),
+                       np.full((Nbls, Nfreqs, 4), mpi.rank + 1.0))
+        assert list(vis_blocks.blocks) == [time_i]
+    vis_blocks.write(vis_blocks.stream_to)
+    mpi.world_comm.Barrier()
+    vis_data.Free()
+
+    if mpi.rank == 0:
+        expected = np.zeros(Ntimes)
+        for rank in range(mpi.Npus):
+            for time_i in [rank, rank + 1, rank]:
+                expected[time_i] += rank + 1
+        data = data.reshape(Ntimes, Nbls * Nfreqs * 4)
+        assert np.all(data == expected[:, np.newaxis])
+
+
+@pytest.mark.parallel(3)
+def test_reduce_node():
+    # Blocks are summed in shared memory, in which the node root gets views.
+    mpi = pyuvsim.mpi
+    mpi.start_mpi()
+    Nbls, Nfreqs = 5, 2
+    vis_blocks = pyuvsim.uvsim._VisibilityBlocks(Nbls, Nfreqs)
+    for time_i in [0, mpi.rank + 2]:
+        vis_blocks.add((slice(time_i * Nbls, (time_i + 1) * Nbls), 0, slice(0, Nfreqs)),
+                       np.full((Nbls, Nfreqs, 4), mpi.rank + 1.0))
+    node_win = pyuvsim.uvsim._reduce_node(vis_blocks)
+
+    if mpi.get_node_comm().rank == 0:
+        assert sorted(vis_blocks.blocks) == [0] + [rank + 2 for rank in range(mpi.Npus)]
+        assert np.all(vis_blocks.blocks[0] == mpi.Npus * (mpi.Npus + 1) / 2)
+        for rank in range(mpi.Npus):
+            assert np.all(vis_blocks.blocks[rank + 2] == rank + 1)
+    else:
+        assert vis_blocks.blocks == {}
+    mpi.get_node_comm().Barrier()
+    node_win.Free()
+
+
+@pytest.mark.parallel(3)
+def test_reduce_task_range_blocks():
+    # Blocks covering parts of times, with boundaries inside times, are summed into
+    # their place in the data array on rank 0.
+    mpi = pyuvsim.mpi
+    mpi.start_mpi()
+    Nbls, Nfreqs, Ntimes = 4, 3, mpi.Npus
+    Ntasks = Nbls * Nfreqs * Ntimes
+    bounds = [0] + [Nbls * Nfreqs * rank - 1 for rank in range(1, mpi.Npus)] + [Ntasks]
+    task_range = range(bounds[mpi.rank], bounds[mpi.rank + 1])
+    data = None
+    if mpi.rank == 0:
+        data = np.zeros((Ntimes * Nbls, 1, Nfreqs, 4), dtype=complex)
+    vis_data = mpi.MPI.Win.Create(data, comm=mpi.world_comm)
+
+    vis_blocks = pyuvsim.uvsim._VisibilityBlocks(
+        Nbls, Nfreqs, extent=pyuvsim.uvsim._rank_extent(task_range, Nbls, Nfreqs, Nbls, Nfreqs)
+    )
+    for task_index in task_range:
+        time_i, freq_i, bl_i = np.unravel_index(task_index, (Ntimes, Nfreqs, Nbls))
+        vis_blocks.add((bl_i + time_i * Nbls, 0, freq_i), np.full(4, task_index + 1.0))
+    if mpi.rank > 0:
+        # The first task of the range is the last one at the previous time.
+        assert vis_blocks.blocks[mpi.rank - 1].shape == (1, 1, 4)
+    pyuvsim.uvsim._reduce_visibilities(vis_blocks, vis_data)
+    mpi.world_comm.Barrier()
+    vis_data.Free()
+
+    if mpi.rank == 0:
+        expected = np.arange(1.0, Ntasks + 1).reshape(Ntimes, Nfreqs, Nbls).transpose(0, 2, 1)
+        assert np.all(data[:, 0] == expected.reshape(Ntimes * Nbls, Nfreqs)[..., None])
+
+
+@pytest.mark.parallel(4)
+def test_reduce_source_groups():
+    # Partial visibilities are summed within each group of two ranks.
+    mpi = pyuvsim.mpi
+    mpi.start_mpi()
+    Nbls, Nfreqs = 4, 3
+    source_comm = mpi.world_comm.Split(color=mpi.rank // 2, key=mpi.rank)
+    vis_blocks = pyuvsim.uvsim._VisibilityBlocks(Nbls, Nfreqs)
+    for time_i in [mpi.rank // 2, 2]:
+        vis_blocks.add((slice(time_i * Nbls, (time_i + 1) * Nbls), 0, slice(0, Nfreqs)),
+                       np.full((Nbls, Nfreqs, 4), mpi.rank + 1.0))
+    pyuvsim.uvsim._reduce_source_groups(vis_blocks, source_comm)
+    source_comm.Free()
+
+    if mpi.rank % 2 == 0:
+        assert sorted(vis_blocks.blocks) == sorted({mpi.rank // 2, 2})
+        for block in vis_blocks.blocks.values():
+            assert np.all(block == 2 * mpi.rank + 3)
+    else:
+        assert vis_blocks.blocks == {}
+
+
+def test_task_ranges():
+    ranges = pyuvsim.uvsim._TaskRanges()
+    for index in [0, 1, 2, 5, 7, 6, 3]:
+        ranges.add(index)
+    assert ranges.ranges.tolist() == [[0, 4], [5, 8]]
+    assert len(ranges) == 7
+    assert 3 in ranges and 4 not in ranges and 8 not in ranges
+    ranges.add(4)
+    assert ranges.ranges.tolist() == [[0, 8]]
+    assert pyuvsim.uvsim._TaskRanges(ranges.ranges).ranges.tolist() == [[0, 8]]
+    assert pyuvsim.uvsim._TaskRanges().ranges.shape == (0, 2)
+
+    # Finished tasks are skipped in each sky part.
+    skip = pyuvsim.uvsim._TaskRanges([[1, 3], [10, 11]])
+    task_inds = pyuvsim.uvsim._ResumableTaskIndices(range(4), 8, skip)
+    assert list(task_inds) == [0, 3]
+    assert task_inds.current == 3
+    assert list(task_inds) == [0, 1, 3]
+    assert task_inds.current == 11
+
+
+class _LocalCounter(object):
+    # Stands in for mpi.Counter on a single process.
+    def __init__(self):
+        self.value = 0
+
+    def next(self, increment=1):
+        value = self.value
+        self.value += increment
+        return value
+
+
+def test_dynamic_task_indices():
+    # Chunks cover every task once per sky part, with a chunk
+    # claimed at the end of a sky part kept for the next one.
+    task_inds = pyuvsim.uvsim._DynamicTaskIndices(10, 4, _LocalCounter())
+    assert task_inds.Nchunks == 3
+    for sky_part in range(2):
+        assert list(task_inds) == list(range(10))
+        assert task_inds.claimed == 3 * (sky_part + 1)
+
+    assert pyuvsim.uvsim._dynamic_task_chunk_size('auto', 1000, 10, 4) == 10
+    assert pyuvsim.uvsim._dynamic_task_chunk_size('auto', 40, 10, 4) == 2
+    assert pyuvsim.uvsim._dynamic_task_chunk_size('auto', 4, 10, 4) == 1
+    assert pyuvsim.uvsim._dynamic_task_chunk_size(7, 40, 10, 4) == 7
+
+
+@pytest.mark.parallel(3)
+def test_dynamic_task_indices_mpi():
+    # With a shared counter, every task is claimed by exactly one rank.
+    mpi = pyuvsim.mpi
+    mpi.start_mpi()
+    counter = mpi.Counter()
+    task_inds = pyuvsim.uvsim._DynamicTaskIndices(50, 3, counter)
+    claimed = [list(task_inds) for sky_part in range(2)]
+    mpi.world_comm.Barrier()
+    counter.free()
+
+    claimed = mpi.world_comm.gather(claimed, root=0)
+    if mpi.rank == 0:
+        for sky_part in range(2):
+            all_claimed = sum((rank_claimed[sky_part] for rank_claimed in claimed), [])
+            assert sorted(all_claimed) == list(range(50))
+
+
+def test_task_cost_model():
+    # Two times with 2 frequencies and 3 baselines, with all sources up at the second
+    # time, and one UVBeam antenna on the last baseline.
+    model = pyuvsim.uvsim._TaskCostModel(
+        (1.0, 0.5, 0.25), up_fraction=[0, 1], Nsrcs=4, Nuvbeams=[0, 0, 1], Nfreqs_task=2
+    )
+    costs = np.array([1, 1, 1] * 2 + [3, 3, 4] * 2, dtype=float)
+    assert model.total == costs.sum()
+    for index in range(costs.size + 1):
+        assert model.cumulative(index) == costs[:index].sum()
+
+    bounds = model.split(3)
+    assert bounds[0] == 0 and bounds[-1] == costs.size
+    assert bounds.tolist() == [0, 7, 10, 12]
+    assert np.all(np.diff(bounds) >= 0)
+
+    # Equal costs give equal ranges.
+    model = pyuvsim.uvsim._TaskCostModel((1.0, 0.0, 0.0), [0.5] * 4, 10, [0] * 5, 1)
+    assert model.split(4).tolist() == [0, 5, 10, 15, 20]
+
+
+def test_sky_decomposition():
+    src_mem = simutils.estimate_source_memory_usage(1, 1)
+    # Plenty of memory: tasks are split among ranks, sources are not.
+    grid, Nsky_parts, Nsrcs_local = pyuvsim.uvsim._sky_decomposition(
+        100, 1000, 4, 2, 2**30, src_mem
+    )
+    assert grid == (4, 1) and Nsky_parts == 1 and Nsrcs_local == 1000
+
+    # Room for a few hundred sources per rank: sources are split among ranks.
+    grid, Nsky_parts, Nsrcs_local = pyuvsim.uvsim._sky_decomposition(
+        100, 1000, 4, 2, 2 * 2 * 300 * src_mem, src_mem
+    )
+    assert grid == (1, 4) and Nsky_parts == 1 and Nsrcs_local == 250
+
+    # Fewer tasks than source groups needed: the rest goes to sky parts.
+    grid, Nsky_parts, Nsrcs_local = pyuvsim.uvsim._sky_decomposition(
+        4, 1000, 4, 2, 2 * 2 * 100 * src_mem, src_mem
+    )
+    assert grid == (1, 4) and Nsky_parts == 3
+
+    with pytest.raises(ValueError, match="Insufficient memory for simulation."):
+        pyuvsim.uvsim._sky_decomposition(4, 10, 2, 2, src_mem, src_mem)
+
+
+def test_plan_visibilities(uvobj_beams_srcs):
+    # A rank holds visibility blocks for the baselines and frequencies of its tasks, and
+    # with dynamic scheduling, for all baselines and frequencies of one chunk of tasks.
+    input_uv, beam_list, beam_dict, sources = uvobj_beams_srcs
+    input_uv.select(times=np.unique(input_uv.time_array)[:4], freq_chans=[0, 1])
+    block_bytes = input_uv.Nbls * input_uv.Nfreqs * 4 * 16
+
+    plans = {
+        task_scheduling: pyuvsim.plan_uvdata_uvsim(
+            input_uv, beam_list, beam_dict=beam_dict, catalog=sources, Nranks_per_node=8,
+            time_tasks=False, task_scheduling=task_scheduling, task_chunk_size=input_uv.Nbls
+        )
+        for task_scheduling in ['static', 'dynamic']
+    }
+    assert plans['dynamic']['task_scheduling'] == 'dynamic'
+    # Each rank has the baselines of one time and frequency.
+    assert plans['static']['memory']['per_rank']['visibilities'] == block_bytes // 2
+    assert plans['static']['memory']['node_shared']['reduction'] == 4 * block_bytes
+    assert plans['dynamic']['memory']['per_rank']['visibilities'] == 2 * block_bytes
+
+
+@pytest.mark.parametrize('output_mode', ['single', 'stream'])
+def test_plan_uvdata_uvsim(uvobj_beams_srcs, output_mode):
+    input_uv, beam_list, beam_dict, sources = uvobj_beams_srcs
+    input_uv.select(times=np.unique(input_uv.time_array)[:2], freq_chans=[0, 1])
+    Nsrcs = sources.Ncomponents
+
+    plan = pyuvsim.plan_uvdata_uvsim(
+        input_uv, beam_list, beam_dict=beam_dict, catalog=sources, Nnodes=2,
+        Nranks_per_node=2, mem_per_node='4G', output_mode=output_mode
+    )
+    assert json.loads(json.dumps(plan)) == plan
+    assert plan['Ntasks'] == input_uv.Nblts * input_uv.Nfreqs
+    assert plan['process_grid'] == {'Ntask_groups': 4, 'Nsrc_groups': 1}
+    assert plan['Nsky_parts'] == 1
+    memory = plan['memory']
+    assert memory['fits']
+    assert memory['peak_per_node'] == (2 * sum(memory['per_rank'].values())
+                                       + sum(memory['node_shared'].values())
+                                       + sum(memory['rank0'].values()))
+    if output_mode == 'single':
+        assert memory['rank0']['output'] == input_uv.Nblts * input_uv.Nfreqs * 4 * 25
+    else:
+        assert memory['rank0']['output'] == 0
+        assert 'reduction' not in memory['node_shared']
+    runtime = plan['runtime']
+    assert runtime['wall_time'] > 0
+    assert runtime['cpu_time'] >= 4 * runtime['wall_time'] / runtime['imbalance'] * 0.99
+
+    # Leave just enough room for the sources with sky parts.
+    setup = (2 * memory['per_rank']['process'] + sum(memory['node_shared'].values())
+             - memory['node_shared'].get('reduction', 0))
+    src_mem = simutils.estimate_source_memory_usage(1, 1)
+    plan = pyuvsim.plan_uvdata_uvsim(
+        input_uv, beam_list, beam_dict=beam_dict, catalog=sources, Nnodes=1,
+        Nranks_per_node=2, mem_per_node=setup + 2 * 2 * (Nsrcs // 6) * src_mem,
+        time_tasks=False, output_mode=output_mode, jones_cache_mb=0
+    )
+    # Sources are split among the ranks, and then into sky parts.
+    assert plan['runtime'] is None
+    assert plan['process_grid'] == {'Ntask_groups': 1, 'Nsrc_groups': 2}
+    assert plan['Nsrcs_per_rank'] == Nsrcs // 2
+    assert plan['Nsky_parts'] == 3
+
+    with pytest.raises(ValueError, match="Insufficient memory for simulation."):
+        pyuvsim.plan_uvdata_uvsim(input_uv, beam_list, beam_dict=beam_dict, catalog=sources,
+                                  Nranks_per_node=2, mem_per_node=setup, time_tasks=False)
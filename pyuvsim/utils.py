@@ -2,12 +2,15 @@
 # Copyright (c) 2018 Radio Astronomy Software Group
 # Licensed under the 3-clause BSD License
 
+import glob
 import os
 import sys
 import time as pytime
 from datetime import timedelta
 
+import h5py
 import numpy as np
+from pyuvdata import UVData
 try:
     import psutil
     HAVE_PSUTIL = True
@@ -63,9 +66,9 @@ class progsteps:
                 frac_done = count / self.maxval
                 self.remain = dt * (1 / frac_done - 1)
                 print(("{:0.2f}% completed. {}  elapsed. "
-                       + "{} remaining. \n").format(
+                       + "{} remaining. {:0.1f} tasks/s. \n").format(
                     frac_done * 100., str(timedelta(seconds=dt)),
-                    str(timedelta(seconds=self.remain))), flush=True)
+                    str(timedelta(seconds=self.remain)), count / max(dt, 1e-9)), flush=True)
 
     def finish(self):
         self.update(self.maxval)
@@ -175,7 +178,74 @@ def check_file_exists_and_increment(filepath, extension=None):
     return filepath
 
 
-def write_uvdata(uv_obj, param_dict, return_filename=False, dryrun=False, out_format=None):
+def shard_filename(shard_dir, index):
+    """Path of the visibility shard file with the given index (usually the rank)."""
+    return os.path.join(shard_dir, f"shard_{index:05d}.h5")
+
+
+def remove_shards(shard_dir):
+    """Remove the visibility shard files in shard_dir, and the directory if it is empty."""
+    for path in glob.glob(os.path.join(shard_dir, 'shard_*.h5')):
+        os.remove(path)
+    if os.path.isdir(shard_dir) and not os.listdir(shard_dir):
+        os.rmdir(shard_dir)
+
+
+def merge_shards(uv_obj, shard_dir, filename=None, clobber=False):
+    """
+    Sum the visibility shards written by the ranks of a simulation into one data set.
+
+    Each shard file holds visibilities for some of the times, as datasets named
+    `time_<index>` of shape (Nbls, Nfreqs, 4), each a contiguous block of rows of the
+    data array. Shards may hold partial sums for the same time, which are added up.
+    Only one time is held in memory at a time when writing to a file.
+
+    Args:
+        uv_obj: UVData object with the metadata of the simulation. Baselines must be
+            the fastest axis of the baseline-time axis.
+        shard_dir: Directory with the shard files.
+        filename: Path of the uvh5 file to write. If None, the data, flag and nsample
+            arrays of uv_obj are filled in instead.
+        clobber: (Default false) Overwrite an existing file.
+    """
+    Nbls = uv_obj.Nbls
+    block_shape = (Nbls, 1, uv_obj.Nfreqs, uv_obj.Npols)
+    if filename is None:
+        data_shape = (uv_obj.Nblts, 1, uv_obj.Nfreqs, uv_obj.Npols)
+        uv_obj.data_array = np.zeros(data_shape, dtype=complex)
+        uv_obj.flag_array = np.zeros(data_shape, dtype=bool)
+        uv_obj.nsample_array = np.ones(data_shape, dtype=float)
+    else:
+        uv_obj.initialize_uvh5_file(filename, clobber=clobber)
+        # Parts are checked against the header, so write them from the header as read
+        # back, which may gain defaults when written.
+        uv_file = UVData()
+        uv_file.read(filename, read_data=False)
+        flags = np.zeros(block_shape, dtype=bool)
+        nsamples = np.ones(block_shape, dtype=float)
+
+    shards = [h5py.File(path, 'r')
+              for path in sorted(glob.glob(os.path.join(shard_dir, 'shard_*.h5')))]
+    try:
+        for time_i in range(uv_obj.Ntimes):
+            block = np.zeros(block_shape, dtype=complex)
+            for shard in shards:
+                name = f"time_{time_i}"
+                if name in shard:
+                    block[:, 0] += shard[name][()]
+            blts = slice(time_i * Nbls, (time_i + 1) * Nbls)
+            if filename is None:
+                uv_obj.data_array[blts] = block
+            else:
+                uv_file.write_uvh5_part(filename, block, flags, nsamples,
+                                        blt_inds=np.arange(blts.start, blts.stop))
+    finally:
+        for shard in shards:
+            shard.close()
+
+
+def write_uvdata(uv_obj, param_dict, return_filename=False, dryrun=False, out_format=None,
+                 shard_dir=None):
     """
     Parse output file information from parameters and write uvfits to file.
 
@@ -186,6 +256,10 @@ def write_uvdata(uv_obj, param_dict, return_filename=False, dryrun=False, out_fo
         return_filename: (Default false) Return the file path
         dryrun: (Default false) Don't write to file.
         out_format: (Default uvfits) Write as uvfits/miriad/uvh5
+        shard_dir: (Default None) Directory of visibility shards to merge into the output
+                   file (see :func:`merge_shards`), in which case uv_obj only needs to
+                   hold the metadata. Shards are only merged into uvh5 files, which is
+                   the default format if this is set.
 
     Returns:
         File path, if return_filename is True
@@ -197,7 +271,9 @@ def write_uvdata(uv_obj, param_dict, return_filename=False, dryrun=False, out_fo
     if 'output_format' in param_dict:
         out_format = param_dict['output_format']
     elif out_format is None:
-        out_format = 'uvfits'
+        out_format = 'uvfits' if shard_dir is None else 'uvh5'
+    if shard_dir is not None and out_format != 'uvh5':
+        raise ValueError("Shards can only be merged into a uvh5 file.")
 
     if 'outfile_name' not in param_dict or param_dict['outfile_name'] == '':
         outfile_prefix = ""
@@ -228,7 +304,9 @@ def write_uvdata(uv_obj, param_dict, return_filename=False, dryrun=False, out_fo
 
     print('Outfile path: ', outfile_name, flush=True)
     if not dryrun:
-        if out_format == 'uvfits':
+        if shard_dir is not None:
+            merge_shards(uv_obj, shard_dir, outfile_name, clobber=not noclobber)
+        elif out_format == 'uvfits':
             uv_obj.write_uvfits(outfile_name, force_phase=True, spoof_nonessential=True)
         elif out_format == 'miriad':
             uv_obj.write_miriad(outfile_name, clobber=not noclobber)
@@ -323,3 +401,74 @@ def estimate_skymodel_memory_usage(Ncomponents, Nfreqs):
     mem_est += np.sum([sys.getsizeof(v) * Ncomponents * Nfreqs
                        for k, v in Ncomp_Nfreq_attrs.items()])
     return mem_est
+
+
+def estimate_source_memory_usage(Ncomponents, Nfreqs, Nfreqs_per_task=1, precision='double'):
+    """
+    Estimate the memory used on a rank by sources in the simulation task loop.
+
+    Unlike :func:`estimate_skymodel_memory_usage`, this counts the arrays that are
+    actually made for each source at their data types: the positions and Stokes
+    parameters of the SkyModel, its coherencies, the temporaries of the coordinate
+    transformation at each time, and the engine work arrays (beam Jones matrices of
+    both antennas, apparent coherencies and fringes) in the working precision.
+
+    Parameters
+    ----------
+    Ncomponents : int
+        Number of source components.
+    Nfreqs : int
+        Number of frequencies of the SkyModel Stokes parameters (the number of
+        simulated frequencies unless the spectral type is flat).
+    Nfreqs_per_task : int
+        Number of frequencies computed at once by the engine.
+    precision : str
+        Working precision of the engine, 'double' or 'single'.
+
+    Returns
+    -------
+    mem_est : int
+        Estimate of memory usage in bytes
+    """
+    real_size = 4 if precision == 'single' else 8
+    # ra, dec, alt_az, pos_lmn, rise and set LSTs as float64, and the horizon mask.
+    per_src = 8 * 9 + 1
+    # The alt/az transformation makes several (3, Ncomponents) float64 arrays.
+    per_src += 8 * 3 * 8
+    # Stokes as float64, coherencies in ra/dec and local frames as 2x2 complex128.
+    per_src += Nfreqs * (4 * 8 + 2 * 4 * 16)
+    # Jones matrices of both antennas and the apparent coherency (2x2 each), the
+    # fringe and a few work arrays, as complex numbers in the working precision.
+    per_src += Nfreqs_per_task * 2 * real_size * (3 * 4 + 3)
+    return int(Ncomponents) * per_src
+
+
+def parse_memory_size(size):
+    """
+    Convert a memory size like '200G' or '512MB' to bytes.
+
+    Parameters
+    ----------
+    size : str or int
+        Number of bytes, optionally followed by a unit K, M, G or T (powers of 1024),
+        with or without a trailing 'B' or 'iB'.
+
+    Returns
+    -------
+    int
+        Size in bytes.
+    """
+    if isinstance(size, (int, np.integer)):
+        return int(size)
+    units = {'': 0, 'K': 1, 'M': 2, 'G': 3, 'T': 4}
+    value = str(size).strip().upper()
+    for suffix in ('IB', 'B'):
+        if value.endswith(suffix) and value[:-len(suffix)][-1:] in 'KMGT0123456789':
+            value = value[:-len(suffix)]
+            break
+    unit = value[-1:] if value[-1:] in 'KMGT' else ''
+    try:
+        number = float(value[:len(value) - len(unit)])
+    except ValueError:
+        raise ValueError(f"Invalid memory size: {size}")
+    return int(number * 1024 ** units[unit])
@@ -2,13 +2,26 @@
 # Copyright (c) 2018 Radio Astronomy Software Group
 # Licensed under the 3-clause BSD License
 
+import bisect
+import functools
+import glob
+import os
+import threading
+import time as pytime
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
 import numpy as np
 import yaml
 from astropy.coordinates import EarthLocation
 import astropy.units as units
 from astropy.units import Quantity
 from astropy.constants import c as speed_of_light
-from pyuvdata import UVData
+from pyuvdata import UVBeam, UVData
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
 
 from . import mpi
 from . import simsetup
@@ -21,12 +34,31 @@ from .simsetup import SkyModelData
 from .astropy_interface import MoonLocation, hasmoon, Time
 
 
-__all__ = ['UVTask', 'UVEngine', 'uvdata_to_task_iter', 'run_uvsim', 'run_uvdata_uvsim']
+c_ms = speed_of_light.to('m/s').value
+
+# Order of the visibility polarizations [xx, yy, xy, yx], as (feed1, feed2) pairs.
+_POL_PAIRS = ((0, 0), (1, 1), (0, 1), (1, 0))
+
+# Real and complex dtypes used by the engines for each simulation precision.
+PRECISION_DTYPES = {
+    'double': (np.float64, np.complex128),
+    'single': (np.float32, np.complex64),
+}
+
+# Number of sources summed at a time at the working precision when the visibilities
+# are accumulated at a higher precision. Rounding errors of single precision sums
+# grow with the number of terms, so longer sums are split into blocks whose partial
+# sums are accumulated in double precision.
+MIXED_SUM_BLOCK = 1024
+
+__all__ = ['UVTask', 'UVArrayTask', 'JonesCache', 'UVEngine', 'UVArrayEngine',
+           'probe_source_tile', 'uvdata_to_task_iter', 'run_uvsim', 'run_uvdata_uvsim',
+           'plan_uvsim', 'plan_uvdata_uvsim']
 
 
 class UVTask(object):
     # holds all the information necessary to calculate a visibility for a set of sources at a
-    # single (t, f, bl)
+    # single (t, f, bl), or at a single (t, bl) for all frequencies if freq is an array.
 
     def __init__(self, sources, time, freq, baseline, telescope, freq_i=0):
         self.time = time
@@ -37,17 +69,20 @@ class UVTask(object):
         self.freq_i = freq_i
         self.visibility_vector = None
         self.uvdata_index = None  # Where to add the visibility in the uvdata object.
+        self.zero_length = False  # The baseline has zero length, so the fringe is one.
+        self.unpolarized = False  # The sources only have Stokes I.
 
         if isinstance(self.time, float):
             self.time = Time(self.time, format='jd')
-        if isinstance(self.freq, float):
+        if isinstance(self.freq, (float, np.ndarray)) and not isinstance(self.freq, Quantity):
             self.freq = self.freq * units.Hz
         if sources.spectral_type == 'flat':
             self.freq_i = 0
 
     def __eq__(self, other):
         return (np.isclose(self.time.jd, other.time.jd, atol=1e-4)
-                and np.isclose(self.freq.value, other.freq.value, atol=1e-4)
+                and np.shape(self.freq) == np.shape(other.freq)
+                and np.allclose(self.freq.value, other.freq.value, atol=1e-4)
                 and (self.sources == other.sources)
                 and (self.baseline == other.baseline)
                 and (self.visibility_vector == other.visibility_vector)
@@ -79,13 +114,505 @@ class UVTask(object):
         return not self.__gt__(other)
 
 
+class UVArrayTask(object):
+    # holds all the information necessary to calculate visibilities for a set of sources on
+    # all baselines at a single time, for a single frequency or an array of frequencies.
+
+    def __init__(self, sources, time, freq, antennas, ant1_inds, ant2_inds, telescope,
+                 freq_i=0):
+        self.time = time
+        self.freq = freq
+        self.sources = sources  # SkyModel object
+        self.antennas = antennas  # list of Antenna objects
+        self.ant1_inds = ant1_inds  # index in antennas of the first antenna of each baseline
+        self.ant2_inds = ant2_inds
+        self.telescope = telescope
+        self.freq_i = freq_i
+        self.visibility_vector = None
+        self.uvdata_index = None  # Where to add the visibilities in the uvdata object.
+        self.unpolarized = False  # The sources only have Stokes I.
+
+        if isinstance(self.time, float):
+            self.time = Time(self.time, format='jd')
+        if isinstance(self.freq, (float, np.ndarray)) and not isinstance(self.freq, Quantity):
+            self.freq = self.freq * units.Hz
+        if sources.spectral_type == 'flat':
+            self.freq_i = 0
+
+    @property
+    def Nbls(self):
+        return len(self.ant1_inds)
+
+
+class JonesCache(object):
+    """
+    Bounded least-recently-used cache of beam Jones matrices.
+
+    Jones matrices depend only on the beam, time, frequency and set of sources, so they
+    can be shared by all baselines computed on a rank. Entries are keyed by
+    (beam_id, time, frequency, sky chunk) tuples.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Memory budget for the cached arrays. The least recently used entries are
+        evicted to stay within it. Set to zero to disable caching.
+
+    Attributes
+    ----------
+    nbytes : int
+        Total size of the cached arrays.
+    hits, misses : int
+        Number of lookups that found or did not find an entry.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """Return the cached array for key, or None if it is not cached."""
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Add an array to the cache, evicting old entries to stay within the budget."""
+        if value.nbytes > self.max_bytes:
+            return
+        # Cached arrays are shared, so protect them from modification.
+        value.flags.writeable = False
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key).nbytes
+        self._entries[key] = value
+        self.nbytes += value.nbytes
+        while self.nbytes > self.max_bytes:
+            _, old_value = self._entries.popitem(last=False)
+            self.nbytes -= old_value.nbytes
+
+    def clear(self):
+        """Remove all entries. The hit and miss counters are kept."""
+        self._entries.clear()
+        self.nbytes = 0
+
+
+class _Workspace(object):
+    """
+    Scratch arrays for the engine kernels, reused from task to task.
+
+    Each named buffer is reallocated only when a larger size or a different
+    dtype is requested, so the kernels run without allocating temporaries.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name, shape, dtype):
+        """Return a C-contiguous array of the given shape and dtype backed by buffer name."""
+        size = int(np.prod(shape))
+        buf = self._buffers.get(name)
+        if buf is None or buf.size < size or buf.dtype != dtype:
+            buf = np.empty(size, dtype=dtype)
+            self._buffers[name] = buf
+        return buf[:size].reshape(shape)
+
+
+def _apparent_coherency(jones1, coherency, jones2, out, work):
+    """
+    Compute the apparent coherency J1 C J2^H of each source component, in place.
+
+    Parameters
+    ----------
+    jones1, jones2 : ndarray of complex
+        Jones matrices of the two antennas, shape (2, 2, [Nfreqs,] Nsrcs).
+    coherency : ndarray of complex
+        Local coherency matrices, shape (2, 2, [Nfreqs,] Nsrcs). If the frequency
+        axis is missing it is broadcast.
+    out : ndarray of complex
+        Output array of shape ([Nfreqs,] 4, Nsrcs), with polarizations ordered
+        as [xx, yy, xy, yx]. Its dtype sets the precision of the result.
+    work : ndarray of complex
+        Scratch array of shape (5, [Nfreqs,] Nsrcs), with the same dtype as out.
+    """
+    # J1 C, stored with index 2 * a + c for element (a, c).
+    jc = work[:4]
+    tmp = work[4]
+    for a in range(2):
+        for c in range(2):
+            np.multiply(jones1[a, 0], coherency[0, c], out=jc[2 * a + c])
+            np.multiply(jones1[a, 1], coherency[1, c], out=tmp)
+            np.add(jc[2 * a + c], tmp, out=jc[2 * a + c])
+
+    # (J1 C J2^H)[a, d] = sum_c (J1 C)[a, c] conj(J2[d, c])
+    for pol_i, (a, d) in enumerate(_POL_PAIRS):
+        out_pol = out[..., pol_i, :]
+        np.conjugate(jones2[d, 0], out=tmp)
+        np.multiply(jc[2 * a], tmp, out=out_pol)
+        np.conjugate(jones2[d, 1], out=tmp)
+        np.multiply(jc[2 * a + 1], tmp, out=tmp)
+        np.add(out_pol, tmp, out=out_pol)
+
+
+def _apparent_coherency_unpolarized(jones1, half_stokes_I, jones2, out, work):
+    """
+    Compute the apparent coherency of unpolarized source components, in place.
+
+    The coherency of an unpolarized source is I/2 times the identity, so its
+    apparent coherency is (I/2) J1 J2^H.
+
+    Parameters
+    ----------
+    jones1, jones2 : ndarray of complex
+        Jones matrices of the two antennas, shape (2, 2, [Nfreqs,] Nsrcs).
+    half_stokes_I : ndarray of float
+        Half the Stokes I of each source component, shape ([Nfreqs,] Nsrcs). If the
+        frequency axis is missing it is broadcast.
+    out : ndarray of complex
+        Output array of shape ([Nfreqs,] 4, Nsrcs), with polarizations ordered
+        as [xx, yy, xy, yx]. Its dtype sets the precision of the result.
+    work : ndarray of complex
+        Scratch array of shape (1, [Nfreqs,] Nsrcs), with the same dtype as out.
+    """
+    tmp = work[0]
+    for pol_i, (a, d) in enumerate(_POL_PAIRS):
+        out_pol = out[..., pol_i, :]
+        np.conjugate(jones2[d, 0], out=tmp)
+        np.multiply(jones1[a, 0], tmp, out=out_pol)
+        np.conjugate(jones2[d, 1], out=tmp)
+        np.multiply(jones1[a, 1], tmp, out=tmp)
+        np.add(out_pol, tmp, out=out_pol)
+        np.multiply(out_pol, half_stokes_I, out=out_pol)
+
+
+def _apparent_coherency_diagonal(jones1, coherency, jones2, out, work):
+    """
+    Compute the apparent coherency of each source component for diagonal Jones matrices.
+
+    For diagonal Jones matrices, (J1 C J2^H)[a, d] = J1[a, a] C[a, d] conj(J2[d, d]).
+
+    Parameters
+    ----------
+    jones1, jones2 : ndarray of complex
+        Diagonals of the Jones matrices of the two antennas, shape (2, [Nfreqs,] Nsrcs).
+    coherency : ndarray of complex
+        Local coherency matrices, shape (2, 2, [Nfreqs,] Nsrcs). If the frequency
+        axis is missing it is broadcast.
+    out : ndarray of complex
+        Output array of shape ([Nfreqs,] 4, Nsrcs), with polarizations ordered
+        as [xx, yy, xy, yx]. Its dtype sets the precision of the result.
+    work : ndarray of complex
+        Scratch array of shape (1, [Nfreqs,] Nsrcs), with the same dtype as out.
+    """
+    tmp = work[0]
+    for pol_i, (a, d) in enumerate(_POL_PAIRS):
+        out_pol = out[..., pol_i, :]
+        np.conjugate(jones2[d], out=tmp)
+        np.multiply(jones1[a], tmp, out=out_pol)
+        np.multiply(out_pol, coherency[a, d], out=out_pol)
+
+
+def _apparent_coherency_diagonal_unpolarized(jones1, half_stokes_I, jones2, out, work):
+    """
+    Compute the apparent coherency of unpolarized source components for diagonal Jones matrices.
+
+    The cross-polarizations (xy and yx) are zero. The arguments are as for
+    _apparent_coherency_diagonal, with half_stokes_I as for
+    _apparent_coherency_unpolarized.
+    """
+    tmp = work[0]
+    for pol_i in range(2):
+        out_pol = out[..., pol_i, :]
+        np.conjugate(jones2[pol_i], out=tmp)
+        np.multiply(jones1[pol_i], tmp, out=out_pol)
+        np.multiply(out_pol, half_stokes_I, out=out_pol)
+    out[..., 2:, :] = 0
+
+
+def _full_jones(jones_diag):
+    """Make full Jones matrices, shape (2, 2, ...), from their diagonals, shape (2, ...)."""
+    jones = np.zeros((2,) + jones_diag.shape, dtype=jones_diag.dtype)
+    jones[0, 0] = jones_diag[0]
+    jones[1, 1] = jones_diag[1]
+    return jones
+
+
+def _uniform_spacing(values, rtol=1e-8):
+    """Return the step of a uniformly spaced 1D array with at least 3 values, else None."""
+    values = np.asarray(values)
+    if values.ndim != 1 or values.size < 3:
+        return None
+    step = (values[-1] - values[0]) / (values.size - 1)
+    if step == 0 or not np.allclose(np.diff(values), step, rtol=rtol, atol=0):
+        return None
+    return step
+
+
+def _phasors(delay, inv_wavelength, out, work, anchor_interval=None):
+    """
+    Compute the phasors exp(2 pi i delay / wavelength) at each frequency, in place.
+
+    For uniformly spaced frequencies, the phasors of successive channels differ by a
+    constant factor exp(2 pi i delay * dinv), where dinv is the step in inverse
+    wavelength. If anchor_interval is set, only every anchor_interval-th channel is
+    evaluated with a complex exponential, and the channels in between are stepped from
+    the previous one with a complex multiplication. Re-anchoring keeps the rounding
+    error of the recurrence bounded.
+
+    Parameters
+    ----------
+    delay : ndarray of float
+        Geometric delays in meters, of any shape.
+    inv_wavelength : float or ndarray of float
+        Inverse wavelengths in 1/m, a scalar or shape (Nfreqs,).
+    out : ndarray of complex
+        Output array of shape ([Nfreqs,] + delay.shape).
+    work : _Workspace
+        Provides the scratch buffers.
+    anchor_interval : int
+        Number of channels per anchor. Only used for uniformly spaced inverse
+        wavelengths, which is not checked here.
+
+    Returns
+    -------
+    float
+        The largest difference between a stepped phasor and the directly
+        evaluated one at the anchor channels and the last channel, or zero if the
+        recurrence was not used.
+    """
+    if (np.ndim(inv_wavelength) == 0 or anchor_interval is None or anchor_interval < 2
+            or len(inv_wavelength) < 3):
+        phase = work.get('phasor_phase', out.shape, delay.dtype)
+        np.multiply.outer(np.asarray(inv_wavelength, dtype=delay.dtype), delay, out=phase)
+        np.multiply(phase, 2j * np.pi, out=out)
+        np.exp(out, out=out)
+        return 0.0
+
+    Nfreqs = len(inv_wavelength)
+    phase = work.get('phasor_phase', delay.shape, delay.dtype)
+    step = work.get('phasor_step', delay.shape, out.dtype)
+    check = work.get('phasor_check', delay.shape, out.dtype)
+    dinv = (inv_wavelength[-1] - inv_wavelength[0]) / (Nfreqs - 1)
+    np.multiply(delay, delay.dtype.type(dinv), out=phase)
+    np.multiply(phase, 2j * np.pi, out=step)
+    np.exp(step, out=step)
+
+    max_error = 0.0
+    for fi in range(Nfreqs):
+        if fi % anchor_interval == 0:
+            np.multiply(delay, delay.dtype.type(inv_wavelength[fi]), out=phase)
+            np.multiply(phase, 2j * np.pi, out=out[fi])
+            np.exp(out[fi], out=out[fi])
+            if fi > 0 and delay.size > 0:
+                # Error accumulated by the recurrence since the last anchor.
+                np.multiply(out[fi - 1], step, out=check)
+                np.subtract(check, out[fi], out=check)
+                np.abs(check, out=phase)
+                max_error = max(max_error, float(phase.max()))
+        else:
+            np.multiply(out[fi - 1], step, out=out[fi])
+    if (Nfreqs - 1) % anchor_interval != 0 and delay.size > 0:
+        # The last channel is not an anchor, so compare it with a direct evaluation.
+        np.multiply(delay, delay.dtype.type(inv_wavelength[-1]), out=phase)
+        np.multiply(phase, 2j * np.pi, out=check)
+        np.exp(check, out=check)
+        np.subtract(check, out[-1], out=check)
+        np.abs(check, out=phase)
+        max_error = max(max_error, float(phase.max()))
+    return max_error
+
+
+def _fringe_reduce(uvw, inv_wavelength, pos_lmn, app_coh, out, work, anchor_interval=None):
+    """
+    Compute the fringe of a baseline and add the fringe-weighted apparent coherency to out.
+
+    Parameters
+    ----------
+    uvw : ndarray of float
+        Baseline vector in meters, shape (3,). Must have the same dtype as pos_lmn.
+    inv_wavelength : float or ndarray of float
+        Inverse wavelengths in 1/m, a scalar or shape (Nfreqs,).
+    pos_lmn : ndarray of float
+        Source direction cosines, shape (3, Nsrcs).
+    app_coh : ndarray of complex
+        Apparent coherency, shape ([Nfreqs,] 4, Nsrcs).
+    out : ndarray of complex
+        Visibilities to add to, shape ([Nfreqs,] 4). If it has a higher precision than
+        app_coh, the sum is done in blocks of MIXED_SUM_BLOCK sources whose partial sums
+        are accumulated at the precision of out.
+    work : _Workspace
+        Provides the scratch buffers.
+    anchor_interval : int
+        Passed to _phasors, for uniformly spaced frequencies.
+
+    Returns
+    -------
+    float
+        The error of the fringe recurrence (see _phasors).
+    """
+    Nsrcs = pos_lmn.shape[-1]
+    delay = work.get('delay', (Nsrcs,), pos_lmn.dtype)
+    np.dot(uvw, pos_lmn, out=delay)
+    fringe = work.get('fringe', np.shape(inv_wavelength) + (Nsrcs,), app_coh.dtype)
+    error = _phasors(delay, inv_wavelength, fringe, work, anchor_interval=anchor_interval)
+
+    block = Nsrcs if out.dtype == app_coh.dtype else MIXED_SUM_BLOCK
+    for src0 in range(0, Nsrcs, block):
+        srcs = slice(src0, src0 + block)
+        out += np.matmul(app_coh[..., srcs], fringe[..., srcs, np.newaxis])[..., 0]
+    return error
+
+
+def _coherency_sum(app_coh, out):
+    """
+    Add the apparent coherency summed over sources to out, for zero-length baselines.
+
+    Parameters
+    ----------
+    app_coh : ndarray of complex
+        Apparent coherency, shape ([Nfreqs,] 4, Nsrcs).
+    out : ndarray of complex
+        Visibilities to add to, shape ([Nfreqs,] 4). As in _fringe_reduce, the sum
+        is done in blocks if out has a higher precision than app_coh.
+    """
+    Nsrcs = app_coh.shape[-1]
+    block = Nsrcs if out.dtype == app_coh.dtype else MIXED_SUM_BLOCK
+    for src0 in range(0, Nsrcs, block):
+        out += app_coh[..., src0:src0 + block].sum(axis=-1)
+
+
+def _source_tiles(Nsrcs, tile_size=None):
+    """Yield slices covering Nsrcs sources in tiles of tile_size (or a single tile if None)."""
+    if not tile_size:
+        tile_size = max(Nsrcs, 1)
+    for src0 in range(0, Nsrcs, tile_size):
+        yield slice(src0, min(src0 + tile_size, Nsrcs))
+
+
+# Source tile sizes tried by probe_source_tile.
+SOURCE_TILE_CANDIDATES = tuple(2 ** p for p in range(9, 17))
+
+
+def probe_source_tile(Nsrcs=2 ** 18, Nfreqs=1, precision='double', repeats=3,
+                      candidates=SOURCE_TILE_CANDIDATES):
+    """
+    Find the fastest source tile size for the engine on this machine.
+
+    Times the fringe kernel on random data over Nsrcs sources, split into tiles
+    of each candidate size and in a single pass over all sources. The best tile
+    is usually the largest one whose working arrays still fit in the CPU cache,
+    but tiling does not pay off if the kernel is limited by computation rather
+    than by memory bandwidth.
+
+    Parameters
+    ----------
+    Nsrcs : int
+        Number of sources in the probe.
+    Nfreqs : int
+        Number of frequencies per task. The probe is run with at most 4
+        frequencies, and the tile size is scaled down for more.
+    precision : str
+        Working precision of the engine, 'double' or 'single'.
+    repeats : int
+        Number of times to time each tile size. The fastest time is used.
+    candidates : sequence of int
+        Tile sizes to try. Sizes that are not smaller than Nsrcs are skipped.
+
+    Returns
+    -------
+    int or None
+        The source tile size, or None if a single pass over all sources was fastest.
+    """
+    real_dtype, complex_dtype = PRECISION_DTYPES[precision]
+    Nfreqs_probe = min(Nfreqs, 4)
+    rng = np.random.default_rng(0)
+    uvw = rng.standard_normal(3).astype(real_dtype) * 100
+    inv_wavelength = np.linspace(1, 1.5, Nfreqs_probe)
+    pos_lmn = rng.standard_normal((3, Nsrcs)).astype(real_dtype)
+    app_coh = np.ones((Nfreqs_probe, 4, Nsrcs), dtype=complex_dtype)
+    work = _Workspace()
+    out = np.zeros((Nfreqs_probe, 4), dtype=complex)
+
+    timings = {}
+    for tile_size in [c for c in candidates if c < Nsrcs] + [Nsrcs]:
+        best = np.inf
+        for _ in range(repeats):
+            start = pytime.perf_counter()
+            for srcs in _source_tiles(Nsrcs, tile_size):
+                _fringe_reduce(uvw, inv_wavelength, pos_lmn[:, srcs], app_coh[..., srcs], out,
+                               work)
+            best = min(best, pytime.perf_counter() - start)
+        timings[tile_size] = best
+
+    tile_size = min(timings, key=timings.get)
+    if tile_size == Nsrcs:
+        return None
+    return max(tile_size * Nfreqs_probe // Nfreqs, 1)
+
+
 class UVEngine(object):
 
-    def __init__(self, task=None, update_positions=True, update_beams=True, reuse_spline=True):
+    def __init__(self, task=None, update_positions=True, update_beams=True, reuse_spline=True,
+                 jones_cache=None, precision='double', source_tile=None, anchor_interval=16,
+                 prefetch_threads=0):
         self.reuse_spline = reuse_spline  # Reuse spline fits in beam interpolation
         self.update_positions = update_positions
         self.update_beams = update_beams
 
+        # Working precision of source positions, Jones matrices, coherencies and fringes.
+        # Visibilities are always accumulated in double precision.
+        if precision not in PRECISION_DTYPES:
+            raise ValueError(
+                "precision must be one of: " + ", ".join(PRECISION_DTYPES.keys())
+            )
+        self.precision = precision
+        self.real_dtype, self.complex_dtype = PRECISION_DTYPES[precision]
+
+        # The source axis is processed in tiles of this many sources, so the work
+        # arrays of each tile stay in the CPU cache. None processes all sources at once.
+        self.source_tile = source_tile
+
+        # For tasks with uniformly spaced frequencies, fringes are stepped from one
+        # channel to the next, with an exact evaluation every anchor_interval channels.
+        # The largest error of the stepped fringes is kept in fringe_error.
+        self.anchor_interval = anchor_interval
+        self.uniform_freqs = False
+        self.fringe_error = 0.0
+
+        # Jones matrices for all beams used on this rank, shared by all baselines.
+        if jones_cache is None:
+            jones_cache = JonesCache()
+        self.jones_cache = jones_cache
+        self.sky_chunk = -1  # Counts the source chunks seen, to key the jones cache.
+        self._work = _Workspace()
+        self.pos_lmn = None
+
+        # Jones matrices of upcoming tasks are computed by a pool of prefetch_threads
+        # threads (see prefetch_jones). Keys of the matrices being computed map to
+        # their futures. Only beams that have already been evaluated on this thread are
+        # prefetched, since the first evaluation may set up the beam object.
+        self._prefetch_pool = None
+        if prefetch_threads > 0:
+            self._prefetch_pool = ThreadPoolExecutor(max_workers=prefetch_threads)
+        self._prefetching = {}
+        self._prefetch_alt_az = None
+        self._prepared_beams = set()
+        self._beam_locks = {}
+        self.jones_prefetched = 0
+
         self.sources = None
         self.current_time = None
         self.current_freq = None
@@ -93,7 +620,8 @@ class UVEngine(object):
         self.beam1_jones = None
         self.beam2_jones = None
         self.local_coherency = None
-        self.apparent_coherency = None
+        self.local_stokes_I = None
+        self.apparent_coherency_pols = None
 
         if task is not None:
             self.set_task(task)
@@ -109,6 +637,9 @@ class UVEngine(object):
         baseline = self.task.baseline
         beam_pair = (baseline.antenna1.beam_id, baseline.antenna2.beam_id)
 
+        if self.sources is not task.sources:
+            self.sky_chunk += 1
+
         if (not self.current_time == task.time.jd) or (self.sources is not task.sources):
             self.update_positions = True
             self.update_local_coherency = True
@@ -119,8 +650,9 @@ class UVEngine(object):
             self.update_beams = False
             self.update_local_coherency = False
 
-        if not self.current_freq == task.freq.to('Hz').value:
+        if not np.array_equal(self.current_freq, task.freq.to('Hz').value):
             self.update_beams = True
+            self.uniform_freqs = _uniform_spacing(task.freq.to('Hz').value) is not None
 
         if not self.current_beam_pair == beam_pair:
             self.current_beam_pair = beam_pair
@@ -130,6 +662,189 @@ class UVEngine(object):
         self.current_freq = task.freq.to("Hz").value
         self.sources = task.sources
 
+    @property
+    def apparent_coherency(self):
+        """Apparent coherency as 2x2 matrices, shape (2, 2, [Nfreqs,] Nsrcs)."""
+        if self.apparent_coherency_pols is None:
+            return None
+        app_coh = np.moveaxis(self.apparent_coherency_pols, -2, 0)
+        return app_coh[[0, 2, 3, 1]].reshape((2, 2) + app_coh.shape[1:])
+
+    def is_diagonal(self, beam_id):
+        """Whether a beam advertises diagonal Jones matrices (see AnalyticBeam.diagonal_jones)."""
+        return getattr(self.task.telescope.beam_list[beam_id], 'diagonal_jones', False)
+
+    def _jones_key(self, beam_id, freq):
+        """Key of the Jones matrix of a beam at a frequency, for the current time and sources."""
+        return (beam_id, self.current_time, freq.tobytes(), self.sky_chunk)
+
+    def _beam_lock(self, beam_id):
+        """Lock held while a beam is evaluated, made on the main thread."""
+        return self._beam_locks.setdefault(beam_id, threading.Lock())
+
+    def _compute_jones(self, antenna, telescope, alt_az, freq, diagonal, lock):
+        """
+        Evaluate the Jones matrix of an antenna's beam in the working precision.
+
+        UVBeams keep their interpolation splines on the beam object, so each beam is
+        evaluated by one thread at a time, holding lock.
+        """
+        with lock:
+            jones = antenna.get_beam_jones(
+                telescope, alt_az, freq, reuse_spline=self.reuse_spline, diagonal=diagonal
+            )
+        return jones.astype(self.complex_dtype, copy=False)
+
+    def get_beam_jones(self, antenna):
+        """
+        Get the Jones matrix of an antenna's beam for the current task.
+
+        The matrix is taken from the jones cache if it was already computed for
+        this beam, time, frequency and source chunk, or from the prefetch threads if
+        they are computing it. Cached matrices are read-only, and are stored at the
+        working precision of the engine. For beams with diagonal Jones matrices, only
+        the diagonal is computed and returned.
+        """
+        key = self._jones_key(antenna.beam_id, self.current_freq)
+        jones = self.jones_cache.get(key)
+        if jones is None:
+            future = self._prefetching.pop(key, None)
+            if future is not None:
+                jones = future.result()
+                self.jones_prefetched += 1
+            else:
+                sources = self.task.sources
+                jones = self._compute_jones(antenna, self.task.telescope,
+                                            sources.alt_az[..., sources.above_horizon],
+                                            self.task.freq, self.is_diagonal(antenna.beam_id),
+                                            self._beam_lock(antenna.beam_id))
+                self._prepared_beams.add(antenna.beam_id)
+            self.jones_cache.put(key, jones)
+        return jones
+
+    def _task_beam_antennas(self, task):
+        """An antenna for each beam whose Jones matrix a task needs."""
+        baseline = task.baseline
+        return {baseline.antenna1.beam_id: baseline.antenna1,
+                baseline.antenna2.beam_id: baseline.antenna2}
+
+    def prefetch_jones(self, task):
+        """
+        Start computing the beam Jones matrices of an upcoming task in the background.
+
+        The matrices are computed by the prefetch threads and picked up by
+        :meth:`get_beam_jones` when the task is run. Only tasks at the current time and
+        with the current sources can be prefetched, since their source positions must
+        be known. Prefetches for earlier times or sources are dropped.
+
+        Parameters
+        ----------
+        task : UVTask or UVArrayTask
+            A task to be run after the current one.
+
+        Returns
+        -------
+        bool
+            False if the task cannot be prefetched yet, because it is at a later time
+            or with later sources than the current task. True otherwise, including if
+            the engine has no prefetch threads.
+        """
+        if self._prefetch_pool is None:
+            return True
+        if task.sources is not self.sources or task.time.jd != self.current_time:
+            return False
+
+        current = (self.current_time, self.sky_chunk)
+        if self._prefetch_alt_az is None or self._prefetch_alt_az[0] != current:
+            # The time or sources moved on, so earlier prefetches will not be used.
+            for future in self._prefetching.values():
+                future.cancel()
+            self._prefetching = {}
+            sources = self.sources
+            # Positions are copied, so that the threads do not see later updates.
+            self._prefetch_alt_az = (current, sources.alt_az[..., sources.above_horizon])
+        alt_az = self._prefetch_alt_az[1]
+
+        freq = task.freq.to('Hz').value
+        for beam_id, antenna in self._task_beam_antennas(task).items():
+            key = self._jones_key(beam_id, freq)
+            if (beam_id not in self._prepared_beams or key in self._prefetching
+                    or key in self.jones_cache):
+                continue
+            self._prefetching[key] = self._prefetch_pool.submit(
+                self._compute_jones, antenna, task.telescope, alt_az, task.freq,
+                self.is_diagonal(beam_id), self._beam_lock(beam_id)
+            )
+        return True
+
+    def close(self):
+        """Stop the prefetch threads, if any."""
+        for future in self._prefetching.values():
+            future.cancel()
+        self._prefetching = {}
+        if self._prefetch_pool is not None:
+            self._prefetch_pool.shutdown(wait=True)
+            self._prefetch_pool = None
+
+    def update_source_coherency(self):
+        """
+        Set the local coherency of the sources above the horizon.
+
+        For unpolarized sources only Stokes I is kept, in local_stokes_I, and
+        local_coherency is None.
+        """
+        sources = self.task.sources
+        if self.task.unpolarized:
+            self.local_coherency = None
+            self.local_stokes_I = np.asarray(sources.stokes[0][..., sources.above_horizon])
+        else:
+            self.local_coherency = sources.coherency_calc()
+            self.local_stokes_I = None
+
+    def apply_jones(self, jones1, jones2, out, diagonal=(False, False)):
+        """
+        Set the apparent coherency of the current task's sources for a pair of Jones matrices.
+
+        Parameters
+        ----------
+        jones1, jones2 : ndarray of complex
+            Jones matrices of the two antennas, shape (2, 2, [Nfreqs,] Nsrcs), or their
+            diagonals, shape (2, [Nfreqs,] Nsrcs), for diagonal beams.
+        out : ndarray of complex
+            Output array of shape ([Nfreqs,] 4, Nsrcs), ordered as [xx, yy, xy, yx].
+        diagonal : tuple of bool
+            Whether jones1 and jones2 are diagonals.
+        """
+        both_diagonal = all(diagonal)
+        if not both_diagonal:
+            # The dense kernels need full matrices for both beams.
+            jones1 = _full_jones(jones1) if diagonal[0] else jones1
+            jones2 = _full_jones(jones2) if diagonal[1] else jones2
+
+        # The coherency of a flat-spectrum sky has no frequency axis and is broadcast.
+        if self.local_coherency is None:
+            source_coherency = 0.5 * np.asarray(self.local_stokes_I[self.task.freq_i],
+                                                dtype=self.real_dtype)
+            if both_diagonal:
+                kernel, Nwork = _apparent_coherency_diagonal_unpolarized, 1
+            else:
+                kernel, Nwork = _apparent_coherency_unpolarized, 1
+        else:
+            source_coherency = np.asarray(self.local_coherency[:, :, self.task.freq_i, :],
+                                          dtype=self.complex_dtype)
+            if both_diagonal:
+                kernel, Nwork = _apparent_coherency_diagonal, 1
+            else:
+                kernel, Nwork = _apparent_coherency, 5
+
+        comp_shape = out.shape[:-2] + out.shape[-1:]
+        for srcs in _source_tiles(comp_shape[-1], self.source_tile):
+            work_shape = (Nwork,) + comp_shape[:-1] + (srcs.stop - srcs.start,)
+            kernel(
+                jones1[..., srcs], source_coherency[..., srcs], jones2[..., srcs], out[..., srcs],
+                self._work.get('coherency_work', work_shape, self.complex_dtype)
+            )
+
     def apply_beam(self):
         """ Set apparent coherency from jones matrices and source coherency. """
 
@@ -142,225 +857,1805 @@ class UVEngine(object):
             sources.update_positions(self.task.time, self.task.telescope.location)
 
         if self.update_local_coherency:
-            self.local_coherency = sources.coherency_calc()
+            self.update_source_coherency()
 
-        self.beam1_jones = baseline.antenna1.get_beam_jones(
-            self.task.telescope, sources.alt_az[..., sources.above_horizon],
-            self.task.freq, reuse_spline=self.reuse_spline
-        )
+        self.beam1_jones = self.get_beam_jones(baseline.antenna1)
 
         if beam1_id == beam2_id:
-            self.beam2_jones = np.copy(self.beam1_jones)
+            self.beam2_jones = self.beam1_jones
+        else:
+            self.beam2_jones = self.get_beam_jones(baseline.antenna2)
+
+        # coherency is a 2x2 matrix
+        # [ |Ex|^2, Ex* Ey, Ey* Ex |Ey|^2 ]
+        # where x and y vectors along the local alt/az axes.
+
+        # Apparent coherency gives the direction and polarization dependent baseline response to
+        # a source.
+
+        # The jones matrices have shape (2, 2, [Nfreqs,] Nsrcs), with a frequency axis
+        # for frequency-vectorized tasks.
+        # The result is stored with the polarizations ordered as [xx, yy, xy, yx].
+        Nsrcs = self.beam1_jones.shape[-1]
+        app_coh = self._work.get(
+            'apparent_coherency', np.shape(self.current_freq) + (4, Nsrcs), self.complex_dtype
+        )
+        self.apply_jones(self.beam1_jones, self.beam2_jones, app_coh,
+                         diagonal=(self.is_diagonal(beam1_id), self.is_diagonal(beam2_id)))
+        self.apparent_coherency_pols = app_coh
+
+    def make_visibility(self):
+        """
+        Visibility contribution from a set of source components.
+
+        Returns
+        -------
+        vis_vector : ndarray of complex
+            Visibilities ordered as [xx, yy, xy, yx]. Shape (4,) for a single frequency,
+            or (Nfreqs, 4) if the task frequency is an array.
+        """
+        assert (isinstance(self.task.freq, Quantity))
+        srcs = self.task.sources
+        time = self.task.time
+        location = self.task.telescope.location
+
+        if self.update_positions:
+            srcs.update_positions(time, location)
+            self.pos_lmn = np.ascontiguousarray(
+                srcs.pos_lmn[..., srcs.above_horizon], dtype=self.real_dtype
+            )
+
+        if self.update_beams:
+            self.apply_beam()
+
+        inv_wavelength = self.current_freq / c_ms
+        vis_vector = np.zeros(np.shape(inv_wavelength) + (4,), dtype=complex)
+        if self.task.zero_length:
+            # Autocorrelations and other zero-length baselines have no fringe.
+            _coherency_sum(self.apparent_coherency_pols, vis_vector)
+            return vis_vector
+
+        uvw = self.task.baseline.uvw.to_value('m').astype(self.real_dtype)
+        anchor_interval = self.anchor_interval if self.uniform_freqs else None
+        for srcs in _source_tiles(self.pos_lmn.shape[-1], self.source_tile):
+            error = _fringe_reduce(
+                uvw, inv_wavelength, self.pos_lmn[:, srcs], self.apparent_coherency_pols[..., srcs],
+                vis_vector, self._work, anchor_interval=anchor_interval
+            )
+            self.fringe_error = max(self.fringe_error, error)
+        return vis_vector
+
+
+# Target size in bytes of one block of the baseline-by-source fringe matrix.
+# Blocks of this size fit within a typical per-core L2/L3 cache, so each block is
+# still cached when it is reduced by the matrix product.
+GEMM_BLOCK_BYTES = 2 ** 22
+
+
+def _gemm_block_shape(Nbls, Nsrcs, itemsize, block_bytes=GEMM_BLOCK_BYTES, max_src_block=None):
+    """
+    Choose the (baseline, source) shape of fringe matrix blocks for _baseline_gemm.
+
+    Blocks span all sources (up to max_src_block, if given) if at least a few
+    baselines fit within block_bytes, otherwise the source axis is split as well.
+    The block never exceeds the full (Nbls, Nsrcs) matrix.
+    """
+    min_bl_block = 16
+    max_elements = max(int(block_bytes) // itemsize, 1)
+    if max_src_block is not None:
+        Nsrcs = min(Nsrcs, max_src_block)
+    src_block = max(min(Nsrcs, max_elements // min_bl_block), 1)
+    bl_block = max(min(Nbls, max_elements // src_block), 1)
+    return bl_block, src_block
+
+
+def _baseline_gemm(phasors, coherency, ant1_inds, ant2_inds, out,
+                   block_bytes=GEMM_BLOCK_BYTES, max_src_block=None, work=None):
+    """
+    Add visibilities for a set of baselines to out, as a matrix product over sources.
+
+    The fringe matrix F[bl, src] = conj(phasors[ant1, src]) * phasors[ant2, src] is
+    built one block at a time and reduced against the coherency with a (BLAS)
+    matrix multiply, V[bl, pol] += sum_src F[bl, src] * coherency[src, pol].
+
+    Parameters
+    ----------
+    phasors : ndarray of complex
+        Antenna phasors, shape (Nants, Nsrcs).
+    coherency : ndarray of complex
+        Apparent coherency of the beam pair shared by the baselines, shape (Nsrcs, 4).
+    ant1_inds, ant2_inds : ndarray of int
+        Indices in the phasor array of the antennas of each baseline.
+    out : ndarray of complex
+        Visibility array of shape (Nbls, 4) to add to. If it has a higher precision
+        than the phasors, the source blocks are limited to MIXED_SUM_BLOCK sources,
+        and their partial sums are accumulated at the precision of out.
+    block_bytes : int
+        Target size in bytes of a block of the fringe matrix.
+    max_src_block : int
+        Maximum number of sources in a block, e.g. the engine's source tile size.
+    work : _Workspace
+        Provides the block buffers, so they can be reused between calls.
+    """
+    if work is None:
+        work = _Workspace()
+    Nbls = ant1_inds.size
+    Nsrcs = phasors.shape[-1]
+    if out.dtype != phasors.dtype:
+        max_src_block = min(max_src_block or MIXED_SUM_BLOCK, MIXED_SUM_BLOCK)
+    bl_block, src_block = _gemm_block_shape(
+        Nbls, Nsrcs, phasors.itemsize, block_bytes, max_src_block=max_src_block
+    )
+
+    for src0 in range(0, Nsrcs, src_block):
+        srcs = slice(src0, src0 + src_block)
+        block_phasors = phasors[:, srcs]
+        block_coherency = coherency[srcs]
+        for bl0 in range(0, Nbls, bl_block):
+            bls = slice(bl0, bl0 + bl_block)
+            block_shape = (ant1_inds[bls].size, block_phasors.shape[1])
+            fringe = work.get('gemm_fringe', block_shape, phasors.dtype)
+            phasors2 = work.get('gemm_phasors', block_shape, phasors.dtype)
+            vis = work.get('gemm_vis', (block_shape[0], 4), phasors.dtype)
+            np.take(block_phasors, ant1_inds[bls], axis=0, out=fringe, mode='clip')
+            np.take(block_phasors, ant2_inds[bls], axis=0, out=phasors2, mode='clip')
+            np.conjugate(fringe, out=fringe)
+            np.multiply(fringe, phasors2, out=fringe)
+            np.matmul(fringe, block_coherency, out=vis)
+            out[bls] += vis
+
+
+class UVArrayEngine(UVEngine):
+    """
+    Calculate visibilities for all baselines at a time from a UVArrayTask.
+
+    The fringe term of a baseline factorizes into a product of per-antenna phasors,
+    and the beam response depends only on the beam model of each antenna. So the
+    calculation is done in two stages:
+
+        * The antenna stage computes the phasor exp(2 pi i x_a.lmn / lambda) for
+          each antenna, the Jones matrices for each beam, and the apparent coherency
+          for each pair of beams in use.
+        * The baseline stage forms the visibility of every baseline as a sum over
+          sources of the apparent coherency times conj(phasor_1) * phasor_2. This
+          is done as a matrix product of the baseline-by-source fringe matrix with
+          the coherencies, in cache-sized blocks (see _baseline_gemm), so a
+          multithreaded BLAS will parallelize it.
+
+    This reduces the number of complex exponentials per source from Nbls to Nants.
+    """
+
+    def __init__(self, task=None, update_positions=True, update_beams=True, reuse_spline=True,
+                 jones_cache=None, precision='double', source_tile=None, anchor_interval=16,
+                 prefetch_threads=0):
+        self.antennas = None
+        self.antpos_enu = None
+        self.beam_pair_groups = None
+        self.antenna_phasors = None
+        self.beam_jones = {}
+        self.pair_coherency = {}
+        super().__init__(task=task, update_positions=update_positions,
+                         update_beams=update_beams, reuse_spline=reuse_spline,
+                         jones_cache=jones_cache, precision=precision,
+                         source_tile=source_tile, anchor_interval=anchor_interval,
+                         prefetch_threads=prefetch_threads)
+
+    def set_task(self, task):
+        self.task = task
+
+        if self.sources is not task.sources:
+            self.sky_chunk += 1
+
+        # These flags control whether quantities can be re-used from the last task:
+        #   Update local coherency and source positions when time or sources changes.
+        #   Update antenna phasors and beam jones matrices when time, sources,
+        #   or frequency changes.
+
+        if (not self.current_time == task.time.jd) or (self.sources is not task.sources):
+            self.update_positions = True
+            self.update_local_coherency = True
+            self.update_beams = True
         else:
-            self.beam2_jones = baseline.antenna2.get_beam_jones(
-                self.task.telescope, sources.alt_az[..., sources.above_horizon],
-                self.task.freq, reuse_spline=self.reuse_spline
+            self.update_positions = False
+            self.update_local_coherency = False
+            self.update_beams = False
+
+        if not np.array_equal(self.current_freq, task.freq.to('Hz').value):
+            self.update_beams = True
+            self.uniform_freqs = _uniform_spacing(task.freq.to('Hz').value) is not None
+
+        if self.antennas is not task.antennas:
+            # Antenna positions and baseline groupings by beam pair are fixed for a given array.
+            self.antennas = task.antennas
+            self.antpos_enu = np.array([ant.pos_enu.to('m').value for ant in self.antennas],
+                                       dtype=self.real_dtype)
+            beam_ids = np.array([ant.beam_id for ant in self.antennas])
+            pairs = np.stack([beam_ids[task.ant1_inds], beam_ids[task.ant2_inds]], axis=1)
+            unique_pairs, pair_inds = np.unique(pairs, axis=0, return_inverse=True)
+            self.beam_pair_groups = {
+                tuple(pair): np.nonzero(pair_inds == pi)[0]
+                for pi, pair in enumerate(unique_pairs)
+            }
+            self.update_beams = True
+
+        self.current_time = task.time.jd
+        self.current_freq = task.freq.to("Hz").value
+        self.sources = task.sources
+
+    def apply_beam(self):
+        """Antenna stage: set antenna phasors, beam jones matrices and apparent coherencies."""
+        sources = self.task.sources
+        telescope = self.task.telescope
+
+        if sources.alt_az is None:
+            sources.update_positions(self.task.time, telescope.location)
+
+        if self.update_local_coherency:
+            self.update_source_coherency()
+
+        pos_lmn = np.asarray(sources.pos_lmn[..., sources.above_horizon], dtype=self.real_dtype)
+        inv_wavelength = self.current_freq / c_ms
+
+        # Antenna delays in meters, shape (Nants, Nsrcs), give phasors of shape
+        # ([Nfreqs,] Nants, Nsrcs).
+        ant_delay = np.dot(self.antpos_enu, pos_lmn)
+        self.antenna_phasors = self._work.get(
+            'antenna_phasors', np.shape(inv_wavelength) + ant_delay.shape, self.complex_dtype
+        )
+        anchor_interval = self.anchor_interval if self.uniform_freqs else None
+        error = _phasors(ant_delay, inv_wavelength, self.antenna_phasors, self._work,
+                         anchor_interval=anchor_interval)
+        self.fringe_error = max(self.fringe_error, error)
+
+        # Jones matrices only depend on the beam, so compute one per beam in use.
+        self.beam_jones = {}
+        for beam_id, antenna in self._task_beam_antennas(self.task).items():
+            self.beam_jones[beam_id] = self.get_beam_jones(antenna)
+
+        self.pair_coherency = {}
+        comp_shape = np.shape(inv_wavelength) + ant_delay.shape[-1:]
+        for beam_pair in self.beam_pair_groups:
+            app_coh = self._work.get(
+                ('apparent_coherency', beam_pair), comp_shape[:-1] + (4, comp_shape[-1]),
+                self.complex_dtype
             )
+            self.apply_jones(self.beam_jones[beam_pair[0]], self.beam_jones[beam_pair[1]],
+                             app_coh, diagonal=tuple(self.is_diagonal(bid) for bid in beam_pair))
+            self.pair_coherency[beam_pair] = app_coh
+
+    def _task_beam_antennas(self, task):
+        """An antenna for each beam in use on the baselines of a task."""
+        if task.antennas is not self.antennas:
+            # The beam pairs in use are only known for the current array.
+            return {}
+        beam_ids = {bid for pair in self.beam_pair_groups for bid in pair}
+        return {beam_id: next(ant for ant in self.antennas if ant.beam_id == beam_id)
+                for beam_id in beam_ids}
+
+    def make_visibility(self):
+        """
+        Visibilities on all baselines from a set of source components.
+
+        Returns
+        -------
+        vis_array : ndarray of complex
+            Visibilities ordered as [xx, yy, xy, yx] along the last axis. Shape (Nbls, 4)
+            for a single frequency, or (Nbls, Nfreqs, 4) if the task frequency is an array.
+        """
+        assert (isinstance(self.task.freq, Quantity))
+        srcs = self.task.sources
+
+        if self.update_positions:
+            srcs.update_positions(self.task.time, self.task.telescope.location)
+
+        if self.update_beams:
+            self.apply_beam()
+
+        ant1_inds = self.task.ant1_inds
+        ant2_inds = self.task.ant2_inds
+
+        # Baseline stage, with the frequency axis (if any) first.
+        freq_shape = self.task.freq.shape
+        vis_array = np.zeros(freq_shape + (self.task.Nbls, 4), dtype=complex)
+        for beam_pair, bl_inds in self.beam_pair_groups.items():
+            # Apparent coherency has shape ([Nfreqs,] 4, Nsrcs).
+            app_coh = self.pair_coherency[beam_pair]
+            vis = np.zeros(freq_shape + (bl_inds.size, 4), dtype=complex)
+            for fi in np.ndindex(freq_shape):
+                _baseline_gemm(self.antenna_phasors[fi], app_coh[fi].T,
+                               ant1_inds[bl_inds], ant2_inds[bl_inds], vis[fi],
+                               max_src_block=self.source_tile, work=self._work)
+            vis_array[..., bl_inds, :] = vis
+
+        if len(freq_shape) > 0:
+            vis_array = np.ascontiguousarray(np.swapaxes(vis_array, 0, 1))
+
+        return vis_array
+
+
+def _process_grid(Ntasks, Nsrcs, Npus, max_srcs_local=None):
+    """
+    Choose the shape of the grid of ranks over the (task, source) plane.
+
+    Ranks are arranged in Ntask_groups groups of Nsrc_groups ranks. The ranks in a group
+    share a range of tasks and each take a part of the sources, so their visibilities
+    are partial sums over sources. The number of source groups is the smallest divisor
+    of Npus that leaves no more task groups than tasks, and puts no more than
+    max_srcs_local sources on each rank. If the sources cannot be split that finely,
+    they are split as finely as possible, and the rest is left to sky parts in the
+    task loop.
+
+    Parameters
+    ----------
+    Ntasks : int
+        Number of tasks (baseline-time-frequencies).
+    Nsrcs : int
+        Number of source components.
+    Npus : int
+        Number of ranks.
+    max_srcs_local : int
+        Largest number of sources that fit in memory on a rank. If None, the sources
+        are only split if there are fewer tasks than ranks.
+
+    Returns
+    -------
+    Ntask_groups, Nsrc_groups : int
+        Shape of the process grid, with Ntask_groups * Nsrc_groups == Npus.
+    """
+    valid = [Nsrc_groups for Nsrc_groups in range(1, Npus + 1)
+             if Npus % Nsrc_groups == 0
+             and Npus // Nsrc_groups <= Ntasks and Nsrc_groups <= Nsrcs]
+    if not valid:
+        # More ranks than tasks and sources, some ranks will be idle.
+        return Npus, 1
+    for Nsrc_groups in valid:
+        if max_srcs_local is None or -(-Nsrcs // Nsrc_groups) <= max_srcs_local:
+            return Npus // Nsrc_groups, Nsrc_groups
+    return Npus // valid[-1], valid[-1]
+
+
+def _make_task_inds(Nbls, Ntimes, Nfreqs, Nsrcs, rank, Npus, vectorize_freqs=False,
+                    grid_shape=None):
+    """
+    Make iterators defining task and sources computed on rank.
+
+       Ranks are laid out on a (task, source) grid, see :func:`_process_grid` ---
+           (1) Npus < Nbltf -- Split by Nbltf, split sources in the task loop for memory's sake.
+           (2) Nbltf < Npus and Nsrcs > Npus -- Split by Nbltf and Nsrcs
+           (3) (Nsrcs, Nbltf) < Npus -- Split by Nbltf
+       - Ranks in the same task group are consecutive, so they are usually on one node.
+       - Within the task loop, decide on source chunks and make skymodels on the fly.
+       - If vectorize_freqs is set, each task covers all frequencies of a (bl, t),
+         so the frequency axis is not split.
+       - If grid_shape (Ntask_groups, Nsrc_groups) is not given, it is chosen by
+         :func:`_process_grid` without a memory limit.
+    """
+
+    if vectorize_freqs:
+        Nfreqs = 1
+
+    Nbltf = Nbls * Ntimes * Nfreqs
+
+    if grid_shape is None:
+        grid_shape = _process_grid(Nbltf, Nsrcs, Npus)
+    Ntask_groups, Nsrc_groups = grid_shape
+    task_group, src_group = divmod(rank, Nsrc_groups)
+
+    task_inds, Ntasks_local = simutils.iter_array_split(task_group, Nbltf, Ntask_groups)
+    src_inds, Nsrcs_local = simutils.iter_array_split(src_group, Nsrcs, Nsrc_groups)
+
+    return task_inds, src_inds, Ntasks_local, Nsrcs_local
+
+
+class _DynamicTaskIndices(object):
+    """
+    Task indices claimed in chunks from a counter shared by all ranks.
+
+    Each rank claims the next chunk of tasks when it has finished its previous chunk,
+    so ranks with cheaper tasks do more of them. Chunks are contiguous in the flattened
+    task array, in which baselines are the fastest axis, so the tasks in a chunk share
+    a time and frequency where possible.
+
+    The indices are iterated over once per sky part by uvdata_to_task_iter. Chunks are
+    numbered consecutively across sky parts, so a chunk claimed at the end of one sky
+    part is kept for the next.
+
+    Parameters
+    ----------
+    Ntasks : int
+        Number of tasks in the flattened task array.
+    chunk_size : int
+        Number of tasks claimed at a time.
+    counter : :class:`pyuvsim.mpi.Counter`
+        Counts the chunks claimed by all ranks.
+    """
+
+    def __init__(self, Ntasks, chunk_size, counter):
+        self.Ntasks = Ntasks
+        self.chunk_size = chunk_size
+        self.counter = counter
+        self.Nchunks = -(-Ntasks // chunk_size)
+        self.sky_part = 0
+        self.claimed = None
+
+    def __iter__(self):
+        first_chunk = self.sky_part * self.Nchunks
+        self.sky_part += 1
+        while True:
+            if self.claimed is None:
+                self.claimed = self.counter.next()
+            if self.claimed >= first_chunk + self.Nchunks:
+                return
+            task0 = (self.claimed - first_chunk) * self.chunk_size
+            self.claimed = None
+            yield from range(task0, min(task0 + self.chunk_size, self.Ntasks))
+
+
+class _PrefetchingTasks(object):
+    """
+    Tasks read up to depth tasks ahead, with their beam Jones matrices prefetched.
+
+    While a task is run, the engine's prefetch threads compute the Jones matrices of
+    the tasks after it (see :meth:`UVEngine.prefetch_jones`), so beam interpolation
+    overlaps with the fringe and sum of the current task. At most depth tasks are
+    held ahead, which bounds the memory of the prefetched matrices.
+
+    Parameters
+    ----------
+    tasks : iterable of UVTask or UVArrayTask
+        Tasks to run, in order.
+    engine : UVEngine
+        The engine the tasks are run with. It should have prefetch threads.
+    depth : int
+        Number of tasks read ahead.
+    task_inds : iterable
+        The task indices the tasks are made from. Reading ahead moves their `current`
+        index (if any) past the task being run, so it is put back for each task.
+    """
+
+    def __init__(self, tasks, engine, depth, task_inds=None):
+        self.tasks = tasks
+        self.engine = engine
+        self.depth = depth
+        self.task_inds = task_inds
+
+    def _read_ahead(self, task_iter, upcoming):
+        while len(upcoming) <= self.depth:
+            try:
+                task = next(task_iter)
+            except StopIteration:
+                return
+            upcoming.append((task, getattr(self.task_inds, 'current', None)))
+
+    def __iter__(self):
+        task_iter = iter(self.tasks)
+        upcoming = deque()
+        # The first Nprefetched upcoming tasks have been prefetched.
+        Nprefetched = 0
+        self._read_ahead(task_iter, upcoming)
+        while upcoming:
+            task, current = upcoming.popleft()
+            Nprefetched = max(Nprefetched - 1, 0)
+            if current is not None:
+                self.task_inds.current = current
+            yield task
+            # The task has been run, so the source positions at its time are known.
+            self._read_ahead(task_iter, upcoming)
+            while Nprefetched < len(upcoming) and self.engine.prefetch_jones(
+                upcoming[Nprefetched][0]
+            ):
+                Nprefetched += 1
+
+
+def _dynamic_task_chunk_size(task_chunk_size, Ntasks, Nbls_task, Npus):
+    """
+    Get the chunk size for dynamic task scheduling.
+
+    If 'auto', a chunk covers the baselines at one time and frequency, or fewer if that
+    would leave less than four chunks per rank.
+    """
+    if task_chunk_size == 'auto':
+        return max(min(Nbls_task, Ntasks // (4 * Npus)), 1)
+    return int(task_chunk_size)
+
+
+class _TaskCostModel(object):
+    """
+    Modeled run time of the tasks of a simulation, for balanced task scheduling.
+
+    A task at time t on baseline bl is modeled to take
+
+        overhead + up[t] * Nsrcs * (src_cost + uvbeam_cost * Nuvbeams[bl])
+
+    seconds, where up[t] is the fraction of sources above the horizon at time t and
+    Nuvbeams[bl] the number of antennas of the baseline with a UVBeam. Costs of ranges
+    of the flattened (Ntimes, Nfreqs_task, Nbls_task) task array are computed per
+    (time, frequency) block of baselines, without an array over all tasks.
+
+    Parameters
+    ----------
+    coefficients : tuple of float
+        (overhead, src_cost, uvbeam_cost) in seconds.
+    up_fraction : array_like of float
+        Fraction of sources above the horizon at each time.
+    Nsrcs : int
+        Number of sources on each rank, over all sky parts.
+    Nuvbeams : array_like of int
+        Number of antennas with a UVBeam for each baseline of the task array.
+    Nfreqs_task : int
+        Length of the frequency axis of the task array.
+    """
+
+    def __init__(self, coefficients, up_fraction, Nsrcs, Nuvbeams, Nfreqs_task):
+        overhead, src_cost, uvbeam_cost = coefficients
+        up_srcs = np.asarray(up_fraction) * Nsrcs
+        self.Nbls = len(Nuvbeams)
+        self.Nfreqs = Nfreqs_task
+        # Cost of each task at a time is base[t] + per_uvbeam[t] * Nuvbeams[bl].
+        self.base = overhead + up_srcs * src_cost
+        self.per_uvbeam = up_srcs * uvbeam_cost
+        self.uvbeams_cum = np.concatenate([[0], np.cumsum(Nuvbeams)])
+        block_cost = self.Nbls * self.base + self.per_uvbeam * self.uvbeams_cum[-1]
+        self.block_cum = np.concatenate([[0], np.cumsum(np.repeat(block_cost, Nfreqs_task))])
+
+    @property
+    def total(self):
+        return self.block_cum[-1]
+
+    def _block_prefix(self, block):
+        # Cost of the first bl baselines of a block, for bl in 0..Nbls.
+        time_i = block // self.Nfreqs
+        return np.arange(self.Nbls + 1) * self.base[time_i] + (
+            self.per_uvbeam[time_i] * self.uvbeams_cum
+        )
+
+    def cumulative(self, index):
+        """Cost of the tasks before index in the flattened task array."""
+        block, bl_i = divmod(index, self.Nbls)
+        if bl_i == 0:
+            return self.block_cum[block]
+        return self.block_cum[block] + self._block_prefix(block)[bl_i]
+
+    def split(self, Nparts):
+        """
+        Split the task array into Nparts contiguous ranges of about equal cost.
+
+        Returns
+        -------
+        array of int
+            Bounds of the ranges, of length Nparts + 1.
+        """
+        Nblocks = len(self.block_cum) - 1
+        bounds = [0]
+        for part in range(1, Nparts):
+            target = self.total * part / Nparts
+            block = min(np.searchsorted(self.block_cum, target, side='right') - 1, Nblocks - 1)
+            bl_i = np.searchsorted(self._block_prefix(block), target - self.block_cum[block])
+            bounds.append(max(block * self.Nbls + min(bl_i, self.Nbls), bounds[-1]))
+        bounds.append(Nblocks * self.Nbls)
+        return np.array(bounds)
+
+
+def _sample_indices(N, max_samples):
+    """Evenly spaced indices of at most max_samples out of N."""
+    return np.unique(np.linspace(0, N - 1, min(N, max_samples)).astype(int))
+
+
+def _up_fraction(input_uv, catalog, src_inds):
+    """Fraction of the sources src_inds of catalog above the horizon at each time."""
+    # Baselines are the fast axis, so this picks one LST per time.
+    lsts = input_uv.lst_array[::input_uv.Nbls]
+    if catalog.ra is None:
+        return np.ones(lsts.size)
+    lat = input_uv.telescope_location_lat_lon_alt[0]
+    ra = np.radians(catalog.ra[src_inds])
+    dec = np.radians(catalog.dec[src_inds])
+    sin_alt = (np.sin(dec) * np.sin(lat)
+               + np.cos(dec) * np.cos(lat) * np.cos(lsts[:, None] - ra))
+    return np.mean(sin_alt > 0, axis=1)
+
+
+def _uvbeam_antennas(input_uv, beam_list, beam_dict):
+    """Number of antennas with a UVBeam (rather than an analytic beam) on each baseline."""
+    names = dict(zip(input_uv.antenna_numbers, input_uv.antenna_names))
+
+    def is_uvbeam(antnum):
+        beam_id = 0 if beam_dict is None else beam_dict[names[antnum]]
+        return int(isinstance(beam_list[beam_id], UVBeam))
+
+    Nbls = input_uv.Nbls
+    return np.array([is_uvbeam(ant1) + is_uvbeam(ant2) for ant1, ant2
+                     in zip(input_uv.ant_1_array[:Nbls], input_uv.ant_2_array[:Nbls])])
+
+
+def _calibrate_task_cost(input_uv, catalog, beam_list, beam_dict, engine, up_fraction,
+                         Nuvbeams, src_inds, vectorize_freqs=False, factorize_antennas=False,
+                         Nsamples=4):
+    """
+    Fit the coefficients of :class:`_TaskCostModel` to the run time of sample tasks.
+
+    At a few times with few to many sources above the horizon, up to Nsamples tasks on
+    baselines with each number of UVBeam antennas are run in sequence with the sources
+    src_inds of catalog, as they would be in the simulation. The run times, including
+    making the tasks, are fit by least squares. If there are several tasks at a time,
+    the first one, which also sets up the sources for the time, is left out of the fit.
+    If the fit fails, all tasks are given the mean run time.
+
+    Returns
+    -------
+    tuple of float
+        (overhead, src_cost, uvbeam_cost) in seconds.
+    """
+    Ntimes = input_uv.Ntimes
+    tasks_shape = (Ntimes, 1 if vectorize_freqs else input_uv.Nfreqs, len(Nuvbeams))
+    times = np.argsort(up_fraction)[_sample_indices(Ntimes, 3)]
+    bls = np.concatenate([np.nonzero(Nuvbeams == count)[0][:Nsamples]
+                          for count in np.unique(Nuvbeams)])
+    sample_ids = [np.ravel_multi_index((time_i, 0, bl_i), tasks_shape)
+                  for time_i in times for bl_i in bls]
+
+    features, run_times = [], []
+    task_iter = uvdata_to_task_iter(sample_ids, input_uv, catalog.subselect(src_inds),
+                                    beam_list, beam_dict, vectorize_freqs=vectorize_freqs,
+                                    factorize_antennas=factorize_antennas)
+    for sample, task_id in enumerate(sample_ids):
+        start = pytime.perf_counter()
+        engine.set_task(next(task_iter))
+        engine.make_visibility()
+        run_time = pytime.perf_counter() - start
+        if len(bls) > 1 and sample % len(bls) == 0:
+            continue
+        time_i, _, bl_i = np.unravel_index(task_id, tasks_shape)
+        up_srcs = up_fraction[time_i] * len(src_inds)
+        features.append([1.0, up_srcs, up_srcs * Nuvbeams[bl_i]])
+        run_times.append(run_time)
+    coefficients = np.linalg.lstsq(np.array(features), np.array(run_times), rcond=None)[0]
+    coefficients = np.maximum(coefficients, 0)
+    if not coefficients[:2].any():
+        return (np.mean(run_times), 0.0, 0.0)
+    return tuple(coefficients)
+
+
+def _balanced_task_ranges(input_uv, catalog, beam_list, beam_dict, engine_kwargs, Ntask_groups,
+                          Nsrc_groups, Nsky_parts, vectorize_freqs=False,
+                          factorize_antennas=False, max_sample_srcs=2048, quiet=False):
+    """
+    Divide the tasks into contiguous ranges of about equal modeled cost.
+
+    The cost model (see :class:`_TaskCostModel`) is calibrated on rank 0 by running a
+    few sample tasks with an engine made with engine_kwargs (and its own Jones cache),
+    and the ranges are broadcast to all ranks. Must be called on all ranks.
+
+    Returns
+    -------
+    bounds : array of int
+        Bounds of the task ranges of the task groups, of length Ntask_groups + 1.
+    planned_cost : array of float
+        Modeled cost in seconds of each task group.
+    """
+    comm = mpi.get_comm()
+    plan = None
+    if mpi.get_rank() == 0:
+        src_inds = _sample_indices(catalog.Ncomponents, max_sample_srcs)
+        up_fraction = _up_fraction(input_uv, catalog, src_inds)
+        Nuvbeams = _uvbeam_antennas(input_uv, beam_list, beam_dict)
+        if factorize_antennas:
+            # Beams are evaluated per antenna, so their cost does not vary by task.
+            Nuvbeams = np.zeros(1, dtype=int)
+        engine_kwargs = dict(engine_kwargs, prefetch_threads=0,
+                             jones_cache=JonesCache(engine_kwargs['jones_cache'].max_bytes))
+        engine = (UVArrayEngine if factorize_antennas else UVEngine)(**engine_kwargs)
+        overhead, src_cost, uvbeam_cost = _calibrate_task_cost(
+            input_uv, catalog, beam_list, beam_dict, engine, up_fraction, Nuvbeams,
+            src_inds, vectorize_freqs=vectorize_freqs, factorize_antennas=factorize_antennas
+        )
+        # Tasks are run once per sky part, each with a part of the sources of the rank.
+        model = _TaskCostModel(
+            (overhead * Nsky_parts, src_cost, uvbeam_cost), up_fraction,
+            -(-catalog.Ncomponents // Nsrc_groups), Nuvbeams,
+            1 if vectorize_freqs else input_uv.Nfreqs
+        )
+        bounds = model.split(Ntask_groups)
+        planned_cost = np.diff([model.cumulative(index) for index in bounds])
+        plan = (bounds, planned_cost)
+        if not quiet:
+            print(f"Balanced task scheduling with a modeled cost of {model.total:.3g} s, "
+                  f"imbalance {_imbalance(planned_cost):.3f}.", flush=True)
+    return comm.bcast(plan, root=0)
+
+
+def _report_balance(loop_time, planned_cost=None, quiet=False):
+    """
+    Print the spread of the task loop time over ranks, and of the planned cost if set.
+
+    Imbalance is the ratio of the largest to the mean. Must be called on all ranks.
+    """
+    loop_times = mpi.get_comm().gather(loop_time, root=0)
+    if mpi.get_rank() != 0 or quiet:
+        return
+    loop_times = np.array(loop_times)
+    print(f"Task loop time per rank (s): min {loop_times.min():.3g}, "
+          f"max {loop_times.max():.3g}, imbalance {_imbalance(loop_times):.3f}", flush=True)
+    if planned_cost is not None:
+        print(f"Planned task cost per task group (s): min {planned_cost.min():.3g}, "
+              f"max {planned_cost.max():.3g}, imbalance {_imbalance(planned_cost):.3f}",
+              flush=True)
+
+
+def _imbalance(values):
+    mean = np.mean(values)
+    return np.max(values) / mean if mean > 0 else 1.0
+
+
+def uvdata_to_task_iter(task_ids, input_uv, catalog, beam_list, beam_dict, Nsky_parts=1,
+                        vectorize_freqs=False, factorize_antennas=False):
+    """
+    Generates UVTask objects.
+
+    Parameters
+    ----------
+    task_ids: range or iterable
+        Task indices in the full flattened meshgrid of parameters. This is iterated
+        over once for each sky part.
+    input_uv: :class:~`pyuvdata.UVData`
+        UVData object to be filled with data.
+    catalog: :class:~`simsetup.SkyModelData`
+        Source components.
+    beam_list: :class:~`pyuvsim.BeamList
+        BeamList carrying beam model (in object mode).
+    beam_dict: dict
+        Map of antenna numbers to index in beam_list.
+    Nsky_parts: int
+        Number of chunks to split the source catalog into, for memory's sake.
+    vectorize_freqs: bool
+        If True, each task covers all frequencies for a single (bl, t), and the
+        task_ids index the (Ntimes, 1, Nbls) task array. Otherwise, each task
+        is a single (bl, t, f) in the (Ntimes, Nfreqs, Nbls) task array.
+    factorize_antennas: bool
+        If True, yield UVArrayTask objects covering all baselines at a time, and the
+        baseline axis of the task array has length 1.
+
+    Yields
+    ------
+        Iterable of UVTask (or UVArrayTask) objects.
+    """
+
+    # The task_ids refer to tasks on the flattened meshgrid.
+    if not isinstance(input_uv, UVData):
+        raise TypeError("input_uv must be UVData object.")
+
+    #   Skymodel will now be passed in as a catalog array.
+    if not isinstance(catalog, SkyModelData):
+        raise TypeError("catalog must be a SkyModelData object.")
+    # Splitting the catalog for memory's sake.
+    Nsrcs_total = catalog.Ncomponents
+    if Nsky_parts > 1:
+        Nsky_parts = int(Nsky_parts)
+        src_iter = [simutils.iter_array_split(s, Nsrcs_total, Nsky_parts)[0]
+                    for s in range(Nsky_parts)]
+    else:
+        src_iter = [range(Nsrcs_total)]
+    # Build the antenna list.
+    antenna_names = input_uv.antenna_names
+    antennas = []
+    antpos_enu, antnums = input_uv.get_ENU_antpos()
+    for num, antname in enumerate(antenna_names):
+        if beam_dict is None:
+            beam_id = 0
+        else:
+            beam_id = beam_dict[antname]
+        antennas.append(Antenna(antname, num, antpos_enu[num], beam_id))
+
+    baselines = {}
+    zero_length = {}
+    Ntimes = input_uv.Ntimes
+    Nfreqs = input_uv.Nfreqs
+    Nbls = input_uv.Nbls
+
+    Nfreqs_task = 1 if vectorize_freqs else Nfreqs
+    Nbls_task = 1 if factorize_antennas else Nbls
+    tasks_shape = (Ntimes, Nfreqs_task, Nbls_task)
+    time_ax, freq_ax, bl_ax = range(3)
+
+    if factorize_antennas:
+        # Baselines are in the same order at each time.
+        ant_index = {antnum: ind for ind, antnum in enumerate(input_uv.antenna_numbers)}
+        ant1_inds = np.array([ant_index[antnum] for antnum in input_uv.ant_1_array[:Nbls]])
+        ant2_inds = np.array([ant_index[antnum] for antnum in input_uv.ant_2_array[:Nbls]])
+
+    tloc = [np.float64(x) for x in input_uv.telescope_location]
+
+    world = input_uv.extra_keywords.get('world', 'earth')
+
+    if world.lower() == 'earth':
+        location = EarthLocation.from_geocentric(*tloc, unit='m')
+    elif world.lower() == 'moon':
+        if not hasmoon:
+            raise ValueError("Need lunarsky module to simulate an array on the Moon.")
+        location = MoonLocation.from_selenocentric(*tloc, unit='m')
+    else:
+        raise ValueError("If world keyword is set, it must be either 'moon' or 'earth'.")
+    telescope = Telescope(input_uv.telescope_name, location, beam_list)
+    freq_array = input_uv.freq_array * units.Hz
+    time_array = Time(input_uv.time_array, scale='utc', format='jd', location=telescope.location)
+    for src_i in src_iter:
+        sky = catalog.get_skymodel(src_i)
+        if (
+            sky.spectral_type == 'flat'
+            and sky.freq_array is None
+            and sky.reference_frequency is None
+        ):
+            sky.freq_array = freq_array[0]
+        if sky.component_type == 'healpix' and hasattr(sky, 'healpix_to_point'):
+            sky.healpix_to_point()
+        if sky.spectral_type != 'flat':
+            sky.at_frequencies(freq_array[0])
+        unpolarized = catalog.polarized is None or not np.isin(catalog.polarized, src_i).any()
+
+        for task_index in task_ids:
+            # Shape indicates slowest to fastest index.
+            if not isinstance(task_index, tuple):
+                task_index = np.unravel_index(task_index, tasks_shape)
+            bl_i = task_index[bl_ax]
+            time_i = task_index[time_ax]
+            freq_i = task_index[freq_ax]
+
+            blti = bl_i + time_i * Nbls  # baseline is the fast axis
+
+            if vectorize_freqs:
+                freq_i = slice(0, Nfreqs)
+            freq = freq_array[0, freq_i]  # 0 = spw axis
+
+            if factorize_antennas:
+                task = UVArrayTask(sky, time_array[blti], freq, antennas,
+                                   ant1_inds, ant2_inds, telescope, freq_i)
+                task.uvdata_index = (slice(blti, blti + Nbls), 0, freq_i)
+                task.unpolarized = unpolarized
+                yield task
+                continue
+
+            # We reuse a lot of baseline info, so make the baseline list on the first go and reuse.
+            if bl_i not in baselines.keys():
+                antnum1 = input_uv.ant_1_array[blti]
+                antnum2 = input_uv.ant_2_array[blti]
+                index1 = np.where(input_uv.antenna_numbers == antnum1)[0][0]
+                index2 = np.where(input_uv.antenna_numbers == antnum2)[0][0]
+                baselines[bl_i] = Baseline(antennas[index1], antennas[index2])
+                zero_length[bl_i] = not np.any(baselines[bl_i].uvw.to_value('m'))
+
+            time = time_array[blti]
+            bl = baselines[bl_i]
+
+            task = UVTask(sky, time, freq, bl, telescope, freq_i)
+            task.uvdata_index = (blti, 0, freq_i)    # 0 = spectral window index
+            task.zero_length = zero_length[bl_i]
+            task.unpolarized = unpolarized
+
+            yield task
+        del sky
+
+
+def _redundancy_map(input_uv, tol):
+    """
+    Sort the baselines of a UVData object into redundant groups.
+
+    Baselines are redundant if their vectors (in ENU coordinates) differ by no more
+    than tol, or are linked by a chain of such baselines. A baseline is also redundant
+    with the conjugate of a baseline whose vector is reversed.
+
+    Parameters
+    ----------
+    input_uv : :class:~`pyuvdata.UVData`
+        The baselines must be in the same order at each time, with the baseline
+        axis varying fastest.
+    tol : float
+        Redundancy tolerance in meters.
+
+    Returns
+    -------
+    rep_inds : ndarray of int
+        Index of the representative baseline of each group, in ascending order.
+    group_inds : ndarray of int
+        Index in rep_inds of the group of each of the Nbls baselines.
+    conj : ndarray of bool
+        Whether each baseline is the reverse of the representative of its group.
+    """
+    Nbls = input_uv.Nbls
+    antpos, antnums = input_uv.get_ENU_antpos()
+    ant_index = {antnum: ind for ind, antnum in enumerate(antnums)}
+    ant1_inds = np.array([ant_index[antnum] for antnum in input_uv.ant_1_array[:Nbls]])
+    ant2_inds = np.array([ant_index[antnum] for antnum in input_uv.ant_2_array[:Nbls]])
+    bl_vecs = antpos[ant2_inds] - antpos[ant1_inds]
+
+    # Merge vectors that are identical to well within the tolerance first, so
+    # the neighbor search only runs over the distinct vectors.
+    keys = bl_vecs if tol == 0 else np.round(bl_vecs / (1e-3 * tol))
+    _, first_inds, vec_inds = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    vecs = bl_vecs[first_inds]
+    Nvecs = vecs.shape[0]
+
+    # Link all vectors and reversed vectors within tol of each other. Each connected
+    # component of vectors has a mirror component of the reversed vectors.
+    pairs = cKDTree(np.concatenate([vecs, -vecs])).query_pairs(r=tol, output_type='ndarray')
+    links = coo_matrix(
+        (np.ones(pairs.shape[0]), (pairs[:, 0], pairs[:, 1])), shape=(2 * Nvecs, 2 * Nvecs)
+    )
+    _, labels = connected_components(links, directed=False)
+    bl_labels = labels[:Nvecs][vec_inds.ravel()]
+    rev_labels = labels[Nvecs:][vec_inds.ravel()]
+
+    # A group is a component together with its mirror.
+    group_keys = np.minimum(bl_labels, rev_labels)
+    _, rep_inds, group_inds = np.unique(group_keys, return_index=True, return_inverse=True)
+    order = np.argsort(rep_inds)
+    rep_inds = rep_inds[order]
+    group_inds = np.argsort(order)[group_inds]
+    conj = bl_labels != bl_labels[rep_inds][group_inds]
+
+    return rep_inds, group_inds, conj
+
+
+def _resolve_source_tile(source_tile_size, Nsrcs, Nfreqs, precision):
+    """
+    Get the engine source tile size, probing on the root rank if 'auto'.
+
+    Returns None if sources should not be tiled.
+    """
+    if source_tile_size == 'auto':
+        source_tile_size = None
+        if Nsrcs > SOURCE_TILE_CANDIDATES[-1]:
+            if mpi.get_rank() == 0:
+                source_tile_size = probe_source_tile(
+                    Nsrcs=min(Nsrcs, 2 ** 18), Nfreqs=Nfreqs, precision=precision
+                )
+            source_tile_size = mpi.get_comm().bcast(source_tile_size, root=0)
+    return source_tile_size or None
+
+
+def _select_redundant_groups(input_uv, beam_dict, tol):
+    """
+    Select one baseline per redundant group for simulate_redundant_once.
+
+    Returns the selected UVData object and the outputs of _redundancy_map.
+    """
+    if beam_dict is not None:
+        beam_ids = {beam_dict[antname] for antname in input_uv.antenna_names}
+        if len(beam_ids) > 1:
+            raise ValueError("simulate_redundant_once requires all antennas to share a beam.")
+
+    rep_inds, group_inds, conj = _redundancy_map(input_uv, tol)
+    rep_blts = rep_inds[np.newaxis, :] + input_uv.Nbls * np.arange(input_uv.Ntimes)[:, np.newaxis]
+    uv_reduced = input_uv.select(blt_inds=rep_blts.ravel(), inplace=False)
+    return uv_reduced, (rep_inds, group_inds, conj)
+
+
+def _fill_redundant_groups(input_uv, uv_reduced, rep_inds, group_inds, conj):
+    """Make the full output of simulate_redundant_once from the simulated groups."""
+    uv_container = simsetup._complete_uvdata(input_uv, inplace=False)
+    if 'world' in input_uv.extra_keywords:
+        uv_container.extra_keywords['world'] = input_uv.extra_keywords['world']
+
+    red_data = uv_reduced.data_array.reshape(
+        (input_uv.Ntimes, rep_inds.size) + uv_reduced.data_array.shape[1:]
+    )
+    data = red_data[:, group_inds]
+    # For a shared beam, the visibility matrix of a reversed baseline is the Hermitian
+    # conjugate, so xy and yx are swapped.
+    data[:, conj] = np.conj(data[:, conj][..., [0, 1, 3, 2]])
+    uv_container.data_array = data.reshape(uv_container.data_array.shape)
+    return uv_container
+
+
+def _task_range_extent(task_range, time_i, Nbls, Nfreqs, Nbls_task, Nfreqs_task):
+    """
+    Get the part of the visibilities at a time covered by a contiguous range of tasks.
+
+    Within a time, tasks run over frequencies (slowest) and then baselines, so the range
+    covers a box of frequencies, and of all baselines unless it is within a single
+    frequency. UVArrayTasks cover all baselines, and frequency-vectorized tasks cover
+    all frequencies.
+
+    Parameters
+    ----------
+    task_range : range
+        Indices of the tasks in the flattened task array.
+    time_i : int
+        Time index.
+    Nbls, Nfreqs : int
+        Number of baselines and frequencies of the simulation.
+    Nbls_task, Nfreqs_task : int
+        Number of tasks along the baseline and frequency axes at each time.
+
+    Returns
+    -------
+    offset : tuple of int
+        Index of the first baseline and frequency of the box.
+    shape : tuple of int
+        Number of baselines and frequencies in the box, which are zero if the range
+        has no tasks at time_i.
+    """
+    Ntasks_time = Nbls_task * Nfreqs_task
+    first = max(task_range.start - time_i * Ntasks_time, 0)
+    last = min(task_range.stop - time_i * Ntasks_time, Ntasks_time) - 1
+    if first > last:
+        return (0, 0), (0, 0)
+    (freq0, bl0), (freq1, bl1) = divmod(first, Nbls_task), divmod(last, Nbls_task)
+    if freq0 != freq1 or Nbls_task == 1:
+        bl0, bl1 = 0, Nbls - 1
+    if Nfreqs_task == 1:
+        freq0, freq1 = 0, Nfreqs - 1
+    return (bl0, freq0), (bl1 - bl0 + 1, freq1 - freq0 + 1)
+
+
+def _task_range_bytes(task_range, Nbls, Nfreqs, Nbls_task, Nfreqs_task):
+    """Size of the visibility blocks of a contiguous range of tasks, see _VisibilityBlocks."""
+    Ntasks_time = Nbls_task * Nfreqs_task
+    Nelements = 0
+    for time_i in range(task_range.start // Ntasks_time, -(-task_range.stop // Ntasks_time)):
+        _, shape = _task_range_extent(task_range, time_i, Nbls, Nfreqs, Nbls_task, Nfreqs_task)
+        Nelements += shape[0] * shape[1] * 4
+    return Nelements * np.dtype(complex).itemsize
+
+
+def _rank_extent(task_inds, Nbls, Nfreqs, Nbls_task, Nfreqs_task):
+    """
+    Get the extent function of the visibility blocks of a rank, see _VisibilityBlocks.
+
+    If the tasks of the rank are a fixed range, blocks only cover their baselines and
+    frequencies at each time. Otherwise (with dynamic scheduling) they cover all of them.
+    """
+    if not isinstance(task_inds, range):
+        return None
+    return functools.partial(_task_range_extent, task_inds, Nbls=Nbls, Nfreqs=Nfreqs,
+                             Nbls_task=Nbls_task, Nfreqs_task=Nfreqs_task)
+
+
+def _shift_index(index, start):
+    """Shift an integer or slice index along an axis to start from start."""
+    if isinstance(index, slice):
+        return slice(index.start - start, index.stop - start)
+    return index - start
+
+
+class _VisibilityBlocks(object):
+    """
+    Visibilities accumulated locally on a rank, in blocks of one time each.
+
+    Each block holds the visibilities of a box of baselines and frequencies at one time,
+    shape (Nbls_block, Nfreqs_block, 4), starting from the baseline and frequency in
+    `offsets`. Blocks cover all baselines and frequencies, which is a contiguous block
+    of rows of the UVData data array, unless extent is given. Blocks are only allocated
+    for the times that the rank has tasks at.
+
+    If stream_to is set (a :class:`_ShardWriter` or :class:`_WindowWriter`), blocks are
+    written to it and dropped as soon as a task at another time is added. This keeps a
+    single block if tasks are added in order of time. Writers add to what was written
+    before, so a time that is revisited later is written again and summed.
+
+    Parameters
+    ----------
+    Nbls, Nfreqs : int
+        Number of baselines and frequencies of the simulation.
+    stream_to : _ShardWriter or _WindowWriter
+        Writer to stream finished blocks to.
+    extent : callable
+        Function of a time index returning the offset and shape of the box of
+        baselines and frequencies that the tasks of the rank cover at that time,
+        as :func:`_task_range_extent`. Tasks added must lie within it.
+    """
+
+    def __init__(self, Nbls, Nfreqs, stream_to=None, extent=None):
+        self.Nbls = Nbls
+        self.Nfreqs = Nfreqs
+        self.blocks = {}
+        self.offsets = {}
+        self.stream_to = stream_to
+        self.extent = extent
+
+    @property
+    def block_shape(self):
+        """Shape of the visibilities at one time."""
+        return (self.Nbls, self.Nfreqs, 4)
+
+    def add(self, uvdata_index, vis):
+        """Add the visibilities of a task (UVTask or UVArrayTask) at its uvdata_index."""
+        blti, _, freq_ind = uvdata_index
+        if isinstance(blti, slice):
+            # All baselines at one time.
+            time_i = blti.start // self.Nbls
+            bls = _shift_index(blti, time_i * self.Nbls)
+        else:
+            time_i, bls = divmod(blti, self.Nbls)
+        block = self.blocks.get(time_i)
+        if block is None:
+            if self.stream_to is not None:
+                # The other times are finished on this rank.
+                self.write(self.stream_to)
+            offset, shape = self._extent(time_i)
+            block = np.zeros(tuple(shape) + (4,), dtype=complex)
+            self.blocks[time_i] = block
+            self.offsets[time_i] = tuple(offset)
+        bl0, freq0 = self.offsets[time_i]
+        block[_shift_index(bls, bl0), _shift_index(freq_ind, freq0)] += vis
+
+    def _extent(self, time_i):
+        if self.extent is None:
+            return (0, 0), self.block_shape[:2]
+        return self.extent(time_i)
+
+    def restore(self, time_i, block, offset):
+        """
+        Put back a block saved at offset, as from a checkpoint.
+
+        The block is widened to cover the tasks of this rank at its time, which may
+        have changed since it was saved (e.g. with balanced scheduling).
+        """
+        boxes = [(tuple(offset), block.shape[:2])]
+        extent_offset, extent_shape = self._extent(time_i)
+        if min(extent_shape) > 0:
+            boxes.append((extent_offset, extent_shape))
+        start = [min(box_offset[ax] for box_offset, _ in boxes) for ax in range(2)]
+        stop = [max(box_offset[ax] + box_shape[ax] for box_offset, box_shape in boxes)
+                for ax in range(2)]
+        self.blocks[time_i] = np.zeros((stop[0] - start[0], stop[1] - start[1], 4),
+                                       dtype=complex)
+        self.offsets[time_i] = tuple(start)
+        self.blocks[time_i][_block_region(np.subtract(offset, start), block.shape)] = block
+
+    def clear(self):
+        """Drop all blocks."""
+        self.blocks.clear()
+        self.offsets.clear()
+
+    def write(self, writer):
+        """Write all blocks to a _ShardWriter or _WindowWriter, and drop them."""
+        for time_i in sorted(self.blocks):
+            writer.write(time_i, self.blocks.pop(time_i), self.offsets.pop(time_i))
+
+
+def _block_region(offset, shape):
+    """Slices of the baselines and frequencies of a block at offset with shape."""
+    return tuple(slice(start, start + size) for start, size in zip(offset, shape[:2]))
+
+
+class _ShardWriter(object):
+    """
+    Writer of the visibility blocks of a rank to its own shard file.
+
+    Blocks are added to datasets named `time_<index>` in an HDF5 file, holding all
+    baselines and frequencies at a time, which start out as zeros. The file is created
+    on the first write, so ranks that write nothing leave no file. Shards are combined
+    into one data set with :func:`pyuvsim.utils.merge_shards`.
+
+    Parameters
+    ----------
+    shard_dir : str
+        Directory for the shard files.
+    block_shape : tuple of int
+        Shape (Nbls, Nfreqs, 4) of the visibilities at one time.
+    """
+
+    def __init__(self, shard_dir, block_shape):
+        self.path = simutils.shard_filename(shard_dir, mpi.get_rank())
+        self.block_shape = block_shape
+        self.file = None
+
+    def write(self, time_i, block, offset=(0, 0)):
+        """Add the block of visibilities at time index time_i, starting at offset."""
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = h5py.File(self.path, 'w')
+        name = f"time_{time_i}"
+        if name not in self.file:
+            self.file.create_dataset(name, shape=self.block_shape, dtype=complex)
+        self.file[name][_block_region(offset, block.shape)] += block
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class _WindowWriter(object):
+    """
+    Writer of visibility blocks into the data array on rank 0, through an RMA window.
+
+    Each block is added to its part of the rows of its time with a passive target
+    access epoch, so ranks can write their blocks whenever they finish them, without
+    synchronizing.
+
+    Parameters
+    ----------
+    vis_data : mpi4py.MPI.Win
+        Window on the data array of rank 0, with shape (Nblts, 1, Nfreqs, 4).
+    block_shape : tuple of int
+        Shape (Nbls, Nfreqs, 4) of the visibilities at one time.
+    """
+
+    def __init__(self, vis_data, block_shape):
+        self.vis_data = vis_data
+        self.block_shape = block_shape
+
+    def accumulate(self, time_i, block, offset=(0, 0)):
+        """Add a block to the data array, within an access epoch on rank 0."""
+        # Times are contiguous in the data array, time_i times from its start.
+        target = time_i * int(np.prod(self.block_shape)) * block.itemsize
+        datatype = mpi.MPI.C_DOUBLE_COMPLEX.Create_subarray(
+            self.block_shape, block.shape, tuple(offset) + (0,)
+        ).Commit()
+        self.vis_data.Accumulate(block, 0, target=(target, 1, datatype), op=mpi.MPI.SUM)
+        datatype.Free()
+
+    def write(self, time_i, block, offset=(0, 0)):
+        """Add the block of visibilities at time index time_i, starting at offset."""
+        self.vis_data.Lock(0)
+        self.accumulate(time_i, block, offset)
+        self.vis_data.Unlock(0)
+
+
+def _reduce_source_groups(vis_blocks, source_comm):
+    """
+    Sum the partial visibilities of ranks holding the same tasks and different sources.
+
+    The blocks are summed onto rank 0 of source_comm, and cleared on the other ranks.
+    Ranks in source_comm have the same tasks, so they hold blocks of the same shapes for
+    the same times.
+
+    Parameters
+    ----------
+    vis_blocks : _VisibilityBlocks
+        Visibilities accumulated on this rank over its part of the sources.
+    source_comm : mpi4py.MPI.Intracomm
+        Communicator of the ranks in a task group of the process grid.
+    """
+    blocks = vis_blocks.blocks
+    for time_i in sorted(blocks):
+        if source_comm.rank == 0:
+            source_comm.Reduce(mpi.MPI.IN_PLACE, blocks[time_i], op=mpi.MPI.SUM, root=0)
+        else:
+            source_comm.Reduce(blocks[time_i], None, op=mpi.MPI.SUM, root=0)
+    if source_comm.rank != 0:
+        vis_blocks.clear()
+
+
+def _reduce_node(vis_blocks):
+    """
+    Sum the local visibility blocks of the ranks of each node in node shared memory.
+
+    The node root allocates a shared slab with a block for each time held by any rank
+    of the node, covering the box of baselines and frequencies of the blocks of all
+    ranks of the node at that time. Each rank adds its blocks into the slab directly,
+    with the baselines split into one partition per rank: in each of node size rounds,
+    every rank adds to a different partition, so no locks are needed. On the node root,
+    the blocks are then replaced by views into the slab, and they are cleared on the
+    other ranks. Must be called on all ranks.
+
+    Returns
+    -------
+    mpi4py.MPI.Win
+        The shared window holding the slab. It must be freed (on all ranks of the node)
+        once the node root is done with the blocks.
+    """
+    node_comm = mpi.get_node_comm()
+    node_rank, node_size = node_comm.rank, node_comm.size
+    blocks, offsets = vis_blocks.blocks, vis_blocks.offsets
+    local_boxes = [(time_i, offsets[time_i], block.shape) for time_i, block in blocks.items()]
+    # Box of each time as (first baseline, first frequency, last baseline, last frequency).
+    boxes = {}
+    for rank_boxes in node_comm.allgather(local_boxes):
+        for time_i, (bl0, freq0), (Nbls_block, Nfreqs_block, _) in rank_boxes:
+            box = (bl0, freq0, bl0 + Nbls_block, freq0 + Nfreqs_block)
+            if time_i in boxes:
+                box = (min(box[0], boxes[time_i][0]), min(box[1], boxes[time_i][1]),
+                       max(box[2], boxes[time_i][2]), max(box[3], boxes[time_i][3]))
+            boxes[time_i] = box
+    times = sorted(boxes)
+    shapes = [(boxes[time_i][2] - boxes[time_i][0], boxes[time_i][3] - boxes[time_i][1], 4)
+              for time_i in times]
+    starts = np.cumsum([0] + [int(np.prod(shape)) for shape in shapes])
+
+    itemsize = np.dtype(complex).itemsize
+    nbytes = int(starts[-1]) * itemsize
+    win = mpi.MPI.Win.Allocate_shared(nbytes if node_rank == 0 else 0, itemsize,
+                                      comm=node_comm)
+    buf, _ = win.Shared_query(0)
+    slab = np.ndarray(buffer=buf, dtype=complex, shape=(int(starts[-1]),))
+    views = {time_i: slab[starts[ind]:starts[ind + 1]].reshape(shapes[ind])
+             for ind, time_i in enumerate(times)}
+    if node_rank == 0:
+        slab[...] = 0
+    node_comm.Barrier()
+
+    bounds = np.linspace(0, vis_blocks.Nbls, node_size + 1).astype(int)
+    for step in range(node_size):
+        part = (node_rank + step) % node_size
+        for time_i, block in blocks.items():
+            bl0, freq0 = offsets[time_i]
+            box_bl0, box_freq0 = boxes[time_i][:2]
+            first = max(bounds[part], bl0)
+            last = min(bounds[part + 1], bl0 + block.shape[0])
+            if first < last:
+                freqs = slice(freq0 - box_freq0, freq0 - box_freq0 + block.shape[1])
+                views[time_i][first - box_bl0:last - box_bl0, freqs] += (
+                    block[first - bl0:last - bl0]
+                )
+        node_comm.Barrier()
+
+    vis_blocks.clear()
+    if node_rank == 0:
+        blocks.update(views)
+        offsets.update({time_i: boxes[time_i][:2] for time_i in times})
+    return win
+
+
+def _reduce_visibilities(vis_blocks, vis_data):
+    """
+    Sum the local visibility blocks of all ranks into the data array on rank 0.
+
+    The blocks are first summed in shared memory on each node. Each node root then
+    adds the node's blocks to the data array through the RMA window vis_data, in a
+    single access epoch. Must be called on all ranks.
+
+    Parameters
+    ----------
+    vis_blocks : _VisibilityBlocks
+        Visibilities accumulated on this rank. On node roots, they are replaced by
+        the sum over the node.
+    vis_data : mpi4py.MPI.Win
+        Window on the data array of rank 0, with shape (Nblts, 1, Nfreqs, 4).
+    """
+    node_win = _reduce_node(vis_blocks)
+    if mpi.get_node_comm().rank == 0:
+        writer = _WindowWriter(vis_data, vis_blocks.block_shape)
+        vis_data.Lock(0)
+        for time_i, block in sorted(vis_blocks.blocks.items()):
+            writer.accumulate(time_i, block, vis_blocks.offsets[time_i])
+        vis_data.Unlock(0)
+    vis_blocks.clear()
+    node_win.Free()
+
+
+def _collect_visibilities(vis_blocks, vis_data, source_comm, shard_writer, output_mode):
+    """
+    Collect the visibilities of all ranks, as set by output_mode.
+
+    In 'single' mode, they are summed into the data array on rank 0 through the
+    window vis_data, which is freed. In 'shards' mode, they are summed on the root rank
+    of each node, which writes them to its shard. In 'stream' mode, each rank writes
+    the blocks it has left to its shard. Must be called on all ranks.
+    """
+    if output_mode == 'stream':
+        vis_blocks.write(shard_writer)
+    else:
+        if source_comm is not None:
+            _reduce_source_groups(vis_blocks, source_comm)
+        if output_mode == 'single':
+            _reduce_visibilities(vis_blocks, vis_data)
+        else:
+            node_win = _reduce_node(vis_blocks)
+            vis_blocks.write(shard_writer)
+            node_win.Free()
+    if source_comm is not None:
+        source_comm.Free()
+    if shard_writer is not None:
+        shard_writer.close()
+    # The output is complete once all node roots have finished.
+    mpi.get_comm().Barrier()
+    if vis_data is not None:
+        vis_data.Free()
+
+
+def _stream_target(output_mode, Nsky_parts, dynamic, checkpoints, shard_writer, vis_data,
+                   block_shape):
+    """
+    Get the writer that visibility blocks are streamed to as each time is finished.
+
+    In 'stream' mode, blocks go to the shard of the rank, unless there are sky parts,
+    which revisit earlier times. With dynamic scheduling, the chunks claimed by a rank
+    are spread over all times, so blocks are also written out as the rank goes (to the
+    data array on rank 0, or to the shard), rather than kept to the end. Blocks written
+    out are not in the checkpoints, so this is not done with checkpoints.
+
+    Returns
+    -------
+    _ShardWriter or _WindowWriter
+        The writer, or None if blocks are kept to the end.
+    """
+    if output_mode == 'stream' and Nsky_parts == 1:
+        return shard_writer
+    if dynamic and not checkpoints:
+        if output_mode == 'single':
+            return _WindowWriter(vis_data, block_shape)
+        return shard_writer
+    return None
+
 
-        # coherency is a 2x2 matrix
-        # [ |Ex|^2, Ex* Ey, Ey* Ex |Ey|^2 ]
-        # where x and y vectors along the local alt/az axes.
+def _setup_shard_writer(output_mode, block_shape, shard_dir=None, checkpoint_interval=None,
+                        resume=False):
+    """
+    Check the output options and set up the shard writer of this rank.
 
-        # Apparent coherency gives the direction and polarization dependent baseline response to
-        # a source.
+    Shards left in shard_dir by an earlier run are removed. block_shape is the shape
+    (Nbls, Nfreqs, 4) of the visibilities at one time. Must be called on all ranks.
 
-        coherency = self.local_coherency[:, :, self.task.freq_i, :]
+    Returns
+    -------
+    _ShardWriter
+        The shard writer of this rank, or None in 'single' output mode.
+    """
+    if output_mode not in ['single', 'shards', 'stream']:
+        raise ValueError("output_mode must be one of 'single', 'shards' or 'stream'.")
+    if output_mode == 'single':
+        return None
+    if shard_dir is None:
+        raise ValueError("shard_dir must be set to write shards.")
+    if output_mode == 'stream' and (checkpoint_interval or resume):
+        raise ValueError("Checkpoints cannot be used with output_mode 'stream', since "
+                         "streamed visibilities are not kept.")
+
+    if mpi.get_rank() == 0:
+        simutils.remove_shards(shard_dir)
+    mpi.get_comm().Barrier()
+    return _ShardWriter(shard_dir, block_shape)
+
+
+class _TaskRanges(object):
+    """
+    A set of task indices, stored as sorted, disjoint half-open ranges.
 
-        self.beam2_jones = np.swapaxes(self.beam2_jones, 0, 1).conj()  # Transpose at each component
+    Each rank works through its tasks mostly in order, so the indices it has finished
+    are described by a few ranges however many tasks there are.
 
-        self.apparent_coherency = np.einsum(
-            "abz,bcz,cdz->adz", self.beam1_jones, coherency, self.beam2_jones
-        )
+    Parameters
+    ----------
+    ranges : array_like of int, optional
+        Shape (Nranges, 2) array of [start, stop) ranges to add.
+    """
 
-    def make_visibility(self):
-        """ Visibility contribution from a set of source components """
-        assert (isinstance(self.task.freq, Quantity))
-        srcs = self.task.sources
-        time = self.task.time
-        location = self.task.telescope.location
+    def __init__(self, ranges=None):
+        self.starts = []
+        self.stops = []
+        if ranges is not None:
+            for start, stop in ranges:
+                self.add_range(int(start), int(stop))
+
+    def add_range(self, start, stop):
+        """Add the indices from start to stop (exclusive), merging ranges they touch."""
+        first = bisect.bisect_left(self.stops, start)
+        last = bisect.bisect_right(self.starts, stop)
+        if first < last:
+            start = min(start, self.starts[first])
+            stop = max(stop, self.stops[last - 1])
+        self.starts[first:last] = [start]
+        self.stops[first:last] = [stop]
+
+    def add(self, index):
+        """Add a single index."""
+        self.add_range(index, index + 1)
+
+    def __contains__(self, index):
+        ind = bisect.bisect_right(self.starts, index) - 1
+        return ind >= 0 and index < self.stops[ind]
+
+    def __len__(self):
+        return sum(stop - start for start, stop in zip(self.starts, self.stops))
+
+    @property
+    def ranges(self):
+        """Shape (Nranges, 2) int64 array of the [start, stop) ranges."""
+        return np.array([self.starts, self.stops], dtype=np.int64).T.reshape(-1, 2)
+
+
+class _ResumableTaskIndices(object):
+    """
+    Task indices that skip tasks finished before a checkpoint.
 
-        if self.update_positions:
-            srcs.update_positions(time, location)
+    Tasks are identified across sky parts by sky_part * Ntasks + task_index, which
+    also records how far the sky part loop has got. The indices are iterated over once
+    per sky part by uvdata_to_task_iter, which makes one task per index as it goes, so
+    the task being simulated is the one with index `current`.
 
-        if self.update_beams:
-            self.apply_beam()
+    Parameters
+    ----------
+    task_ids : range or iterable
+        Task indices on this rank, iterated over once per sky part.
+    Ntasks : int
+        Number of tasks in the flattened task array.
+    skip : _TaskRanges
+        Tasks (across sky parts) that are already finished.
+    """
 
-        pos_lmn = srcs.pos_lmn[..., srcs.above_horizon]
+    def __init__(self, task_ids, Ntasks, skip):
+        self.task_ids = task_ids
+        self.Ntasks = Ntasks
+        self.skip = skip
+        self.sky_part = 0
+        self.current = None
 
-        # need to convert uvws from meters to wavelengths
-        uvw_wavelength = self.task.baseline.uvw / speed_of_light * self.task.freq.to('1/s')
-        fringe = np.exp(2j * np.pi * np.dot(uvw_wavelength, pos_lmn))
-        vij = self.apparent_coherency * fringe
+    def __iter__(self):
+        offset = self.sky_part * self.Ntasks
+        self.sky_part += 1
+        for task_index in self.task_ids:
+            if offset + task_index in self.skip:
+                continue
+            self.current = offset + task_index
+            yield task_index
 
-        # Sum over source component axis:
-        vij = np.sum(vij, axis=2)
 
-        # Reshape to be [xx, yy, xy, yx]
-        vis_vector = np.asarray([vij[0, 0], vij[1, 1], vij[0, 1], vij[1, 0]])
-        return vis_vector
+class _Checkpoint(object):
+    """
+    Periodic checkpoints of the visibilities accumulated on a rank.
 
+    Each rank writes its own file, holding its visibility blocks, the ranges of tasks
+    it has finished (across sky parts) and the layout of the simulation, without
+    synchronizing with other ranks. A resumed simulation must have the same layout.
+    Files are written to a temporary name and then renamed, so a failure while writing
+    leaves the previous checkpoint in place.
 
-def _make_task_inds(Nbls, Ntimes, Nfreqs, Nsrcs, rank, Npus):
+    Parameters
+    ----------
+    checkpoint_dir : str
+        Directory for the checkpoint files.
+    layout : dict
+        Sizes defining the simulation and how it is split among ranks.
+    interval : float
+        Minutes between checkpoints. If None, no checkpoints are written.
     """
-    Make iterators defining task and sources computed on rank.
 
-       Three options ---
-           (1) Npus < Nbltf -- Split by Nbltf, split sources in the task loop for memory's sake.
-           (2) Nbltf < Npus and Nsrcs > Npus -- Split by Nsrcs only
-           (3) (Nsrcs, Nbltf) < Npus -- Split by Nbltf
-       - Split by instrument axes here.
-       - Within the task loop, decide on source chunks and make skymodels on the fly.
+    def __init__(self, checkpoint_dir, layout, interval=None):
+        self.path = os.path.join(checkpoint_dir, f"rank_{mpi.get_rank():05d}.npz")
+        self.layout = layout
+        self.interval = interval
+        self.completed = _TaskRanges()
+        self.last_save = pytime.time()
+
+    def load(self, vis_blocks):
+        """Restore the visibilities and finished tasks of this rank, if it has a checkpoint."""
+        if not os.path.exists(self.path):
+            return False
+        with np.load(self.path) as checkpoint:
+            layout = dict(zip(checkpoint['layout_keys'].tolist(),
+                              checkpoint['layout'].tolist()))
+            if layout != self.layout:
+                raise ValueError(
+                    f"The checkpoint {self.path} was written by a simulation with a different "
+                    f"layout: {layout}, expected {self.layout}."
+                )
+            for time_i, offset in zip(checkpoint['times'].tolist(),
+                                      checkpoint['offsets'].tolist()):
+                vis_blocks.restore(time_i, checkpoint[f"block_{time_i}"], offset)
+            self.completed = _TaskRanges(checkpoint['completed'])
+        return True
+
+    def update(self, vis_blocks, task_index):
+        """Record a finished task, and write a checkpoint if one is due."""
+        self.completed.add(task_index)
+        if self.interval is not None and pytime.time() - self.last_save >= 60 * self.interval:
+            self.save(vis_blocks)
+
+    def finish(self, vis_blocks):
+        """Write a last checkpoint at the end of the task loop, if checkpoints are on."""
+        if self.interval is not None:
+            self.save(vis_blocks)
+
+    def save(self, vis_blocks):
+        """Write a checkpoint."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        blocks = {f"block_{time_i}": block for time_i, block in vis_blocks.blocks.items()}
+        times = sorted(vis_blocks.blocks)
+        offsets = np.array([vis_blocks.offsets[time_i] for time_i in times], dtype=np.int64)
+        tmp_path = self.path[:-len('.npz')] + '_tmp.npz'
+        np.savez(tmp_path, times=np.array(times, dtype=np.int64),
+                 offsets=offsets.reshape(-1, 2), completed=self.completed.ranges,
+                 layout_keys=np.array(list(self.layout)),
+                 layout=np.array(list(self.layout.values()), dtype=np.int64), **blocks)
+        os.replace(tmp_path, self.path)
+        self.last_save = pytime.time()
+
+
+def _resume_task_indices(task_inds, checkpoint, vis_blocks, Ntasks, Nsrc_groups):
     """
+    Load the checkpoint of this rank and skip the tasks finished before it.
 
-    Nbltf = Nbls * Ntimes * Nfreqs
+    Tasks finished by any rank with the same sources are skipped, so that this works
+    with dynamic scheduling, where tasks are not always claimed by the same rank.
+    Must be called on all ranks.
+    """
+    comm = mpi.get_comm()
+    if checkpoint.load(vis_blocks):
+        print(f"Resuming from {checkpoint.path} with {len(checkpoint.completed)} tasks done.",
+              flush=True)
+    src_group = mpi.get_rank() % Nsrc_groups
+    all_completed = comm.allgather((src_group, checkpoint.completed.ranges))
+    skip = _TaskRanges(np.concatenate(
+        [ranges for group, ranges in all_completed if group == src_group]
+    ))
+    return _ResumableTaskIndices(task_inds, Ntasks, skip)
 
-    split_srcs = False
 
-    if (Nbltf < Npus) and (Npus < Nsrcs):
-        split_srcs = True
+def _remove_checkpoint(checkpoint_dir):
+    """Remove the checkpoint files of a finished simulation."""
+    for path in glob.glob(os.path.join(checkpoint_dir, 'rank_*.npz')):
+        os.remove(path)
+    if os.path.isdir(checkpoint_dir) and not os.listdir(checkpoint_dir):
+        os.rmdir(checkpoint_dir)
 
-    if split_srcs:
-        src_inds, Nsrcs_local = simutils.iter_array_split(rank, Nsrcs, Npus)
-        task_inds = range(Nbltf)
-        Ntasks_local = Nbltf
-    else:
-        task_inds, Ntasks_local = simutils.iter_array_split(rank, Nbltf, Npus)
-        src_inds = range(Nsrcs)
-        Nsrcs_local = Nsrcs
 
-    return task_inds, src_inds, Ntasks_local, Nsrcs_local
+def _sky_Nfreqs(catalog, Nfreqs):
+    """Number of frequencies of the SkyModels made from catalog in the task loop."""
+    # Sources with a spectral model are evaluated at all simulated frequencies.
+    return catalog.Nfreqs if catalog.spectral_type == 'flat' else Nfreqs
 
 
-def uvdata_to_task_iter(task_ids, input_uv, catalog, beam_list, beam_dict, Nsky_parts=1):
+def _sky_decomposition(Ntasks, Nsrcs, Npus, Npus_node, mem_avail, src_mem, rank=0):
     """
-    Generates UVTask objects.
+    Choose the process grid and number of sky parts that fit the sources in memory.
+
+    Up to half of mem_avail is allowed for the sources of the ranks of a node, each
+    taking src_mem bytes per source on each rank.
 
     Parameters
     ----------
-    task_ids: range
-        Task indices in the full flattened meshgrid of parameters.
-    input_uv: :class:~`pyuvdata.UVData`
-        UVData object to be filled with data.
-    catalog: :class:~`simsetup.SkyModelData`
-        Source components.
-    beam_list: :class:~`pyuvsim.BeamList
-        BeamList carrying beam model (in object mode).
-    beam_dict: dict
-        Map of antenna numbers to index in beam_list.
+    Ntasks : int
+        Number of tasks in the simulation.
+    Nsrcs : int
+        Number of source components.
+    Npus : int
+        Number of ranks.
+    Npus_node : int
+        Number of ranks on a node.
+    mem_avail : float
+        Memory available on a node in bytes.
+    src_mem : float
+        Memory used per source on a rank in bytes,
+        see :func:`pyuvsim.utils.estimate_source_memory_usage`.
+    rank : int
+        Rank to get the number of local sources for.
 
-    Yields
-    ------
-        Iterable of UVTask objects.
+    Returns
+    -------
+    grid_shape : tuple of int
+        (Ntask_groups, Nsrc_groups).
+    Nsky_parts : int
+        Number of parts the sources on the rank are split into in the task loop.
+    Nsrcs_local : int
+        Number of sources on the rank.
     """
+    skymodel_mem_max = 0.5 * mem_avail
+    src_mem_footprint = src_mem * Npus_node
 
-    # The task_ids refer to tasks on the flattened meshgrid.
-    if not isinstance(input_uv, UVData):
-        raise TypeError("input_uv must be UVData object.")
+    Ntask_groups, Nsrc_groups = _process_grid(
+        Ntasks, Nsrcs, Npus, max_srcs_local=max(int(skymodel_mem_max // src_mem_footprint), 1)
+    )
+    _, Nsrcs_local = simutils.iter_array_split(rank % Nsrc_groups, Nsrcs, Nsrc_groups)
 
-    #   Skymodel will now be passed in as a catalog array.
-    if not isinstance(catalog, SkyModelData):
-        raise TypeError("catalog must be a SkyModelData object.")
-    # Splitting the catalog for memory's sake.
-    Nsrcs_total = catalog.Ncomponents
-    if Nsky_parts > 1:
-        Nsky_parts = int(Nsky_parts)
-        src_iter = [simutils.iter_array_split(s, Nsrcs_total, Nsky_parts)[0]
-                    for s in range(Nsky_parts)]
-    else:
-        src_iter = [range(Nsrcs_total)]
-    # Build the antenna list.
-    antenna_names = input_uv.antenna_names
-    antennas = []
-    antpos_enu, antnums = input_uv.get_ENU_antpos()
-    for num, antname in enumerate(antenna_names):
-        if beam_dict is None:
-            beam_id = 0
-        else:
-            beam_id = beam_dict[antname]
-        antennas.append(Antenna(antname, num, antpos_enu[num], beam_id))
+    Nsky_parts = np.ceil(Nsrcs_local * src_mem_footprint / float(skymodel_mem_max))
+    Nsky_parts = max(int(Nsky_parts), 1)
+    if Nsky_parts > Nsrcs_local:
+        raise ValueError("Insufficient memory for simulation.")
+    return (Ntask_groups, Nsrc_groups), Nsky_parts, Nsrcs_local
 
-    baselines = {}
-    Ntimes = input_uv.Ntimes
-    Nfreqs = input_uv.Nfreqs
-    Nbls = input_uv.Nbls
 
-    tasks_shape = (Ntimes, Nfreqs, Nbls)
-    time_ax, freq_ax, bl_ax = range(3)
+def _setup_process_grid(Ntasks, catalog, Nfreqs_sky=None, Nfreqs_per_task=1,
+                        precision='double', quiet=False):
+    """
+    Lay out the ranks on a (task, source) grid that fits the sky model in memory.
 
-    tloc = [np.float64(x) for x in input_uv.telescope_location]
+    The shape of the grid and the number of sky parts are chosen by
+    :func:`_sky_decomposition` from the smallest memory available on any node, with the
+    memory per source from :func:`pyuvsim.utils.estimate_source_memory_usage`. Must be
+    called on all ranks.
 
-    world = input_uv.extra_keywords.get('world', 'earth')
+    Parameters
+    ----------
+    Ntasks : int
+        Number of tasks in the simulation.
+    catalog : :class:~`simsetup.SkyModelData`
+        The full source catalog.
+    Nfreqs_sky : int
+        Number of frequencies of the SkyModels made in the task loop.
+        Defaults to the number of frequencies of the catalog.
+    Nfreqs_per_task : int
+        Number of frequencies computed at once by the engine.
+    precision : str
+        Working precision of the engine, 'double' or 'single'.
+    quiet : bool
+        Do not print the grid shape.
 
-    if world.lower() == 'earth':
-        location = EarthLocation.from_geocentric(*tloc, unit='m')
-    elif world.lower() == 'moon':
-        if not hasmoon:
-            raise ValueError("Need lunarsky module to simulate an array on the Moon.")
-        location = MoonLocation.from_selenocentric(*tloc, unit='m')
-    else:
-        raise ValueError("If world keyword is set, it must be either 'moon' or 'earth'.")
-    telescope = Telescope(input_uv.telescope_name, location, beam_list)
-    freq_array = input_uv.freq_array * units.Hz
-    time_array = Time(input_uv.time_array, scale='utc', format='jd', location=telescope.location)
-    for src_i in src_iter:
-        sky = catalog.get_skymodel(src_i)
-        if (
-            sky.spectral_type == 'flat'
-            and sky.freq_array is None
-            and sky.reference_frequency is None
-        ):
-            sky.freq_array = freq_array[0]
-        if sky.component_type == 'healpix' and hasattr(sky, 'healpix_to_point'):
-            sky.healpix_to_point()
-        if sky.spectral_type != 'flat':
-            sky.at_frequencies(freq_array[0])
+    Returns
+    -------
+    grid_shape : tuple of int
+        (Ntask_groups, Nsrc_groups).
+    Nsky_parts : int
+        Number of parts the sources on each rank are split into in the task loop.
+    source_comm : mpi4py.MPI.Intracomm
+        Communicator of the ranks in the same task group as this rank, which hold
+        partial visibilities over different sources. None if sources are not split.
+    """
+    comm = mpi.get_comm()
+    rank = mpi.get_rank()
+    if Nfreqs_sky is None:
+        Nfreqs_sky = catalog.Nfreqs
 
-        for task_index in task_ids:
-            # Shape indicates slowest to fastest index.
-            if not isinstance(task_index, tuple):
-                task_index = np.unravel_index(task_index, tasks_shape)
-            bl_i = task_index[bl_ax]
-            time_i = task_index[time_ax]
-            freq_i = task_index[freq_ax]
+    # Estimating required memory to decide how to split source array.
+    # The process grid must be the same on all ranks, so use the smallest estimate.
+    mem_avail = comm.allreduce(
+        simutils.get_avail_memory() - mpi.get_max_node_rss(return_per_node=True) * 2**30,
+        op=mpi.MPI.MIN
+    )
+    src_mem = simutils.estimate_source_memory_usage(1, Nfreqs_sky, Nfreqs_per_task, precision)
 
-            blti = bl_i + time_i * Nbls  # baseline is the fast axis
+    (Ntask_groups, Nsrc_groups), Nsky_parts, _ = _sky_decomposition(
+        Ntasks, catalog.Ncomponents, mpi.get_Npus(), mpi.node_comm.Get_size(), mem_avail,
+        src_mem, rank=rank
+    )
+    if rank == 0 and not quiet:
+        print(f"Process grid: {Ntask_groups} task groups x {Nsrc_groups} source groups",
+              flush=True)
 
-            # We reuse a lot of baseline info, so make the baseline list on the first go and reuse.
-            if bl_i not in baselines.keys():
-                antnum1 = input_uv.ant_1_array[blti]
-                antnum2 = input_uv.ant_2_array[blti]
-                index1 = np.where(input_uv.antenna_numbers == antnum1)[0][0]
-                index2 = np.where(input_uv.antenna_numbers == antnum2)[0][0]
-                baselines[bl_i] = Baseline(antennas[index1], antennas[index2])
+    # Ranks with the same tasks sum their partial visibilities over sources.
+    source_comm = None
+    if Nsrc_groups > 1:
+        source_comm = comm.Split(color=rank // Nsrc_groups, key=rank)
 
-            time = time_array[blti]
-            bl = baselines[bl_i]
-            freq = freq_array[0, freq_i]  # 0 = spw axis
+    return (Ntask_groups, Nsrc_groups), Nsky_parts, source_comm
 
-            task = UVTask(sky, time, freq, bl, telescope, freq_i)
-            task.uvdata_index = (blti, 0, freq_i)    # 0 = spectral window index
 
-            yield task
-        del sky
+def _setup_checkpoint(task_inds, vis_blocks, count, layout, checkpoint_dir=None,
+                      checkpoint_interval=None, resume=False):
+    """
+    Set up checkpoints of this rank, and restore its last checkpoint if resuming.
 
+    Tasks finished before the checkpoint are skipped and counted toward the progress
+    count. Must be called on all ranks.
 
-def _check_ntasks_valid(Ntasks_tot):
-    """Check that the size of the task array won't overflow the gather."""
+    Returns
+    -------
+    task_inds : _ResumableTaskIndices or the input task_inds
+        Task indices to simulate, which record the current task for checkpoints.
+    checkpoint : _Checkpoint
+        The checkpoint of this rank, or None if checkpoints are not used.
+    """
+    if not (checkpoint_interval or resume):
+        return task_inds, None
+    if checkpoint_dir is None:
+        raise ValueError("checkpoint_dir must be set to checkpoint or resume a simulation.")
 
-    # Found experimentally, this is the limit on the number of tasks
-    # that can be gathered with MPI.
-    MAX_NTASKS_GATHER = 10226018
+    checkpoint = _Checkpoint(checkpoint_dir, layout, interval=checkpoint_interval)
+    if not resume:
+        return _ResumableTaskIndices(task_inds, layout['Ntasks'], _TaskRanges()), checkpoint
 
-    if Ntasks_tot >= MAX_NTASKS_GATHER:
-        raise ValueError(
-            f"Too many tasks for MPI to gather successfully: {Ntasks_tot}\n"
-            "\t Consider splitting your simulation into multiple smaller jobs "
-            "and joining them together with UVData.\n"
-            "\t This error will go away when issue #289 is closed."
-        )
+    task_inds = _resume_task_indices(
+        task_inds, checkpoint, vis_blocks, layout['Ntasks'], layout['Nsrc_groups']
+    )
+    count.next(len(checkpoint.completed))
+    return task_inds, checkpoint
 
 
-def run_uvdata_uvsim(input_uv, beam_list, beam_dict=None, catalog=None, quiet=False):
+def _report_engine_stats(engine, jones_cache, quiet=False, report_fringe_error=False):
+    """Collect statistics of the engines of all ranks and print them on rank 0."""
+    comm = mpi.get_comm()
+    cache_hits = comm.reduce(jones_cache.hits, op=mpi.MPI.SUM, root=0)
+    cache_misses = comm.reduce(jones_cache.misses, op=mpi.MPI.SUM, root=0)
+    fringe_error = comm.reduce(engine.fringe_error, op=mpi.MPI.MAX, root=0)
+    prefetched = comm.reduce(engine.jones_prefetched, op=mpi.MPI.SUM, root=0)
+    if mpi.get_rank() == 0 and not quiet:
+        print("Calculations Complete.", flush=True)
+        print(f"Jones cache hits: {cache_hits}, misses: {cache_misses}", flush=True)
+        if prefetched:
+            print(f"Jones matrices prefetched: {prefetched}", flush=True)
+        if report_fringe_error:
+            print(f"Max fringe recurrence error: {fringe_error:.3e}", flush=True)
+
+
+def run_uvdata_uvsim(input_uv, beam_list, beam_dict=None, catalog=None, quiet=False,
+                     vectorize_freqs=False, factorize_antennas=False, jones_cache_mb=256,
+                     precision='double', source_tile_size='auto', fringe_anchor_interval=16,
+                     simulate_redundant_once=False, redundancy_tol=0.01,
+                     task_scheduling='static', task_chunk_size='auto',
+                     checkpoint_interval=None, checkpoint_dir=None, resume=False,
+                     output_mode='single', shard_dir=None, jones_prefetch_depth=0,
+                     jones_prefetch_threads=2):
     """
     Run uvsim from UVData object.
 
@@ -378,10 +2673,90 @@ def run_uvdata_uvsim(input_uv, beam_list, beam_dict=None, catalog=None, quiet=Fa
         Immutable source parameters.
     quiet: bool
         Do not print anything.
+    vectorize_freqs: bool
+        Compute all frequencies of a (baseline, time) in a single task, evaluating
+        fringes, beams, and coherencies as (Nfreqs, Nsrcs) arrays. This reduces the
+        number of tasks by a factor of Nfreqs, at the cost of Nfreqs times more
+        memory per task.
+    factorize_antennas: bool
+        Compute all baselines at a time in a single task. Fringe phasors and beam
+        Jones matrices are evaluated once per antenna and combined into baselines,
+        rather than evaluated anew for every baseline.
+    jones_cache_mb: float
+        Memory budget in MiB for the cache of beam Jones matrices on each rank.
+        Set to zero to disable the cache.
+    precision: str
+        Working precision of the engine, 'double' or 'single'. In single precision,
+        source positions, beam Jones matrices, coherencies and fringes are float32 and
+        complex64, which halves their memory and memory traffic. Sums over sources are
+        accumulated in double precision in blocks, and the output is always double
+        precision.
+    source_tile_size: int or str
+        Number of sources processed at a time by the engine, so that the work arrays
+        stay in the CPU cache. If 'auto', the tile size is chosen by timing the engine
+        on this machine (see :func:`probe_source_tile`) for catalogs larger than the
+        largest candidate tile size, and tiling is only used if it is faster.
+        Set to zero to process all sources at once.
+    fringe_anchor_interval: int
+        For frequency-vectorized tasks with uniformly spaced frequencies, fringes are
+        evaluated with a complex exponential every fringe_anchor_interval channels and
+        stepped from one channel to the next with complex multiplications in between.
+        The largest error of the stepped fringes is printed at the end. Set to zero to
+        evaluate every channel with a complex exponential.
+    simulate_redundant_once: bool
+        Simulate one baseline per redundant group, and fill the visibilities of the other
+        baselines in the group from it (conjugated for reversed baselines). This requires
+        all antennas to share a beam.
+    redundancy_tol: float
+        Tolerance in meters on baseline vectors for simulate_redundant_once.
+    task_scheduling: str
+        How tasks are divided among ranks. If 'static', each rank gets an equal share of
+        the tasks in advance. If 'dynamic', ranks claim chunks of tasks from a shared
+        counter as they go, so that ranks with cheaper tasks do more of them. Each
+        rank writes out the visibilities of a time once it moves on to another, unless
+        checkpoints are used. Dynamic scheduling is not used when sources rather than
+        tasks are split among ranks.
+        If 'balanced', each task group gets a contiguous range of tasks in advance,
+        sized so that the ranges have about equal cost under a model of task run time
+        calibrated by timing a few sample tasks (see :class:`_TaskCostModel`). The
+        spread of the planned cost and of the task loop time over ranks is printed
+        at the end.
+    task_chunk_size: int or str
+        Number of tasks claimed at a time with dynamic scheduling. If 'auto', a chunk
+        covers all baselines at a time and frequency, or fewer if there would be
+        fewer than four chunks per rank.
+    checkpoint_interval: float
+        Minutes between checkpoints of the visibilities and finished tasks of each rank,
+        written to checkpoint_dir. If None, no checkpoints are written.
+    checkpoint_dir: str
+        Directory for checkpoint files. Required if checkpoint_interval or resume is set.
+    resume: bool
+        Resume from the checkpoints in checkpoint_dir, skipping the tasks finished
+        before them. The simulation must be run with the same number of ranks, and
+        be split among them in the same way.
+    output_mode: str
+        How the visibilities are collected. If 'single', they are summed into the data
+        array on rank 0. If 'shards', the root rank of each node sums the visibilities
+        of its node and writes them to a shard file in shard_dir at the end. If
+        'stream', every rank writes its visibilities to a shard file as soon as it has
+        finished each time, which keeps memory use down to one time per rank. Streaming
+        falls back to writing at the end if the sources are split into sky parts.
+        Shards are combined with :func:`pyuvsim.utils.merge_shards`.
+    shard_dir: str
+        Directory for shard files. Required if output_mode is 'shards' or 'stream'.
+    jones_prefetch_depth: int
+        Number of tasks read ahead in the task loop, whose beam Jones matrices are
+        computed by a pool of jones_prefetch_threads threads on each rank while the
+        current task runs, so that beam interpolation overlaps with the fringe and sum.
+        Only tasks at the same time and with the same sources as the current task are
+        prefetched. Set to zero to compute Jones matrices as they are needed.
+    jones_prefetch_threads: int
+        Number of prefetch threads on each rank, if jones_prefetch_depth is set.
 
     Returns
     -------
-    :class:~`pyuvdata.UVData` instance containing simulated visibilities.
+    :class:~`pyuvdata.UVData` instance containing simulated visibilities. If output_mode
+    is 'shards' or 'stream', it only holds the metadata, and its data array is None.
     """
     if mpi is None:
         raise ImportError("You need mpi4py to use the uvsim module. "
@@ -400,6 +2775,37 @@ def run_uvdata_uvsim(input_uv, beam_list, beam_dict=None, catalog=None, quiet=Fa
     if not ((input_uv.Npols == 4) and (input_uv.polarization_array.tolist() == [-5, -6, -7, -8])):
         raise ValueError("input_uv must have XX,YY,XY,YX polarization")
 
+    if task_scheduling not in ['static', 'dynamic', 'balanced']:
+        raise ValueError("task_scheduling must be one of 'static', 'dynamic' or 'balanced'.")
+
+    if simulate_redundant_once and output_mode != 'single':
+        raise ValueError("simulate_redundant_once requires output_mode 'single'.")
+
+    shard_writer = _setup_shard_writer(
+        output_mode, (input_uv.Nbls, input_uv.Nfreqs, 4), shard_dir=shard_dir,
+        checkpoint_interval=checkpoint_interval, resume=resume
+    )
+
+    if simulate_redundant_once:
+        uv_reduced, redundancy = _select_redundant_groups(input_uv, beam_dict, redundancy_tol)
+        if rank == 0 and not quiet:
+            print(f"Simulating {uv_reduced.Nbls} redundant groups of {input_uv.Nbls} baselines.",
+                  flush=True)
+
+        uv_reduced = run_uvdata_uvsim(
+            uv_reduced, beam_list, beam_dict=beam_dict, catalog=catalog, quiet=quiet,
+            vectorize_freqs=vectorize_freqs, factorize_antennas=factorize_antennas,
+            jones_cache_mb=jones_cache_mb, precision=precision,
+            source_tile_size=source_tile_size, fringe_anchor_interval=fringe_anchor_interval,
+            task_scheduling=task_scheduling, task_chunk_size=task_chunk_size,
+            checkpoint_interval=checkpoint_interval, checkpoint_dir=checkpoint_dir,
+            resume=resume, jones_prefetch_depth=jones_prefetch_depth,
+            jones_prefetch_threads=jones_prefetch_threads
+        )
+        if rank == 0:
+            return _fill_redundant_groups(input_uv, uv_reduced, *redundancy)
+        return
+
     # The root node will initialize our simulation
     # Read input file and make uvtask list
     if rank == 0 and not quiet:
@@ -408,48 +2814,73 @@ def run_uvdata_uvsim(input_uv, beam_list, beam_dict=None, catalog=None, quiet=Fa
         print('Nfreqs:', input_uv.Nfreqs, flush=True)
         print('Nsrcs:', catalog.Ncomponents, flush=True)
     if rank == 0:
-        uv_container = simsetup._complete_uvdata(input_uv, inplace=False)
+        # With shards, the data array is never gathered on rank 0.
+        uv_container = simsetup._complete_uvdata(input_uv, inplace=False,
+                                                 metadata_only=output_mode != 'single')
         if 'world' in input_uv.extra_keywords:
             uv_container.extra_keywords['world'] = input_uv.extra_keywords['world']
-        vis_data = mpi.MPI.Win.Create(uv_container._data_array.value, comm=mpi.world_comm)
-    else:
-        vis_data = mpi.MPI.Win.Create(None, comm=mpi.world_comm)
+    vis_data = None
+    if output_mode == 'single':
+        vis_data = mpi.MPI.Win.Create(uv_container._data_array.value if rank == 0 else None,
+                                      comm=mpi.world_comm)
 
     Nbls = input_uv.Nbls
     Ntimes = input_uv.Ntimes
     Nfreqs = input_uv.Nfreqs
     Nsrcs = catalog.Ncomponents
 
-    task_inds, src_inds, Ntasks_local, Nsrcs_local = _make_task_inds(
-        Nbls, Ntimes, Nfreqs, Nsrcs, rank, Npus
-    )
+    Nbls_task = 1 if factorize_antennas else Nbls
+    Nfreqs_task = 1 if vectorize_freqs else Nfreqs
 
     # Construct beam objects from strings
     beam_list.set_obj_mode(use_shared_mem=True)
 
-    # Estimating required memory to decide how to split source array.
-    mem_avail = (simutils.get_avail_memory()
-                 - mpi.get_max_node_rss(return_per_node=True) * 2**30)
-
-    Npus_node = mpi.node_comm.Get_size()
-    skymodel_mem_footprint = (
-        simutils.estimate_skymodel_memory_usage(Nsrcs, catalog.Nfreqs) * Npus_node
+    Ntasks = Ntimes * Nbls_task * Nfreqs_task
+    (Ntask_groups, Nsrc_groups), Nsky_parts, source_comm = _setup_process_grid(
+        Ntasks, catalog, Nfreqs_sky=_sky_Nfreqs(catalog, Nfreqs),
+        Nfreqs_per_task=Nfreqs if vectorize_freqs else 1, precision=precision, quiet=quiet
+    )
+    task_inds, src_inds, _, _ = _make_task_inds(
+        Nbls_task, Ntimes, Nfreqs, Nsrcs, rank, Npus, vectorize_freqs=vectorize_freqs,
+        grid_shape=(Ntask_groups, Nsrc_groups)
     )
 
-    # Allow up to 50% of available memory for SkyModel data.
-    skymodel_mem_max = 0.5 * mem_avail
-
-    Nsky_parts = np.ceil(skymodel_mem_footprint / float(skymodel_mem_max))
-    Nsky_parts = max(Nsky_parts, 1)
-    if Nsky_parts > Nsrcs:
-        raise ValueError("Insufficient memory for simulation.")
-
-    Ntasks_tot = Ntimes * Nbls * Nfreqs * Nsky_parts
-
-    local_task_iter = uvdata_to_task_iter(
-        task_inds, input_uv, catalog.subselect(src_inds),
-        beam_list, beam_dict, Nsky_parts=Nsky_parts
+    source_tile_size = _resolve_source_tile(
+        source_tile_size, Nsrcs, Nfreqs if vectorize_freqs else 1, precision
     )
+    if rank == 0 and not quiet and source_tile_size is not None:
+        print(f"Source tile size: {source_tile_size}", flush=True)
+
+    jones_cache = JonesCache(max_bytes=int(jones_cache_mb * 2**20))
+    engine_kwargs = {'jones_cache': jones_cache, 'precision': precision,
+                     'source_tile': source_tile_size,
+                     'anchor_interval': fringe_anchor_interval or None,
+                     'prefetch_threads': jones_prefetch_threads if jones_prefetch_depth else 0}
+    if factorize_antennas:
+        engine = UVArrayEngine(**engine_kwargs)
+    else:
+        engine = UVEngine(**engine_kwargs)
+
+    task_counter = None
+    planned_cost = None
+    if task_scheduling == 'dynamic' and Nsrc_groups == 1:
+        # Tasks are split among ranks (rather than sources), so claim them in chunks.
+        chunk_size = _dynamic_task_chunk_size(task_chunk_size, Ntasks, Nbls_task, Npus)
+        task_counter = mpi.Counter()
+        task_inds = _DynamicTaskIndices(Ntasks, chunk_size, task_counter)
+        if rank == 0 and not quiet:
+            print(f"Dynamic task scheduling with chunks of {chunk_size} tasks.", flush=True)
+    elif task_scheduling == 'balanced':
+        bounds, planned_cost = _balanced_task_ranges(
+            input_uv, catalog, beam_list, beam_dict, engine_kwargs, Ntask_groups, Nsrc_groups,
+            Nsky_parts, vectorize_freqs=vectorize_freqs,
+            factorize_antennas=factorize_antennas, quiet=quiet
+        )
+        task_group = rank // Nsrc_groups
+        task_inds = range(bounds[task_group], bounds[task_group + 1])
+
+    # Each source group does all tasks of its task group.
+    Ntasks_tot = Ntasks * Nsky_parts * Nsrc_groups
 
     Ntasks_tot = comm.reduce(Ntasks_tot, op=mpi.MPI.MAX, root=0)
     if rank == 0 and not quiet:
@@ -457,46 +2888,75 @@ def run_uvdata_uvsim(input_uv, beam_list, beam_dict=None, catalog=None, quiet=Fa
         print("Tasks: ", Ntasks_tot, flush=True)
         pbar = simutils.progsteps(maxval=Ntasks_tot)
 
-    engine = UVEngine()
-    count = mpi.Counter()
-    size_complex = np.ones(1, dtype=complex).nbytes
-    data_array_shape = (Nbls * Ntimes, 1, Nfreqs, 4)
-    uvdata_indices = []
-
+    # Progress is counted locally and passed on once per node, on a timer.
+    count = mpi.ProgressCounter(report=pbar.update if rank == 0 and not quiet else None)
+    # Visibilities are summed locally, and only collected at the end unless streamed.
+    stream_to = _stream_target(output_mode, Nsky_parts, task_counter is not None,
+                               bool(checkpoint_interval or resume), shard_writer, vis_data,
+                               (Nbls, Nfreqs, 4))
+    vis_blocks = _VisibilityBlocks(Nbls, Nfreqs, stream_to=stream_to,
+                                   extent=_rank_extent(task_inds, Nbls, Nfreqs, Nbls_task,
+                                                       Nfreqs_task))
+    layout = {'Npus': Npus, 'Ntask_groups': Ntask_groups, 'Nsrc_groups': Nsrc_groups,
+              'Nsky_parts': Nsky_parts, 'Ntasks': Ntasks, 'Nbls': Nbls, 'Ntimes': Ntimes,
+              'Nfreqs': Nfreqs, 'Nsrcs': Nsrcs}
+    task_inds, checkpoint = _setup_checkpoint(
+        task_inds, vis_blocks, count, layout, checkpoint_dir=checkpoint_dir,
+        checkpoint_interval=checkpoint_interval, resume=resume
+    )
+    local_task_iter = uvdata_to_task_iter(
+        task_inds, input_uv, catalog.subselect(src_inds),
+        beam_list, beam_dict, Nsky_parts=Nsky_parts, vectorize_freqs=vectorize_freqs,
+        factorize_antennas=factorize_antennas
+    )
+    if jones_prefetch_depth:
+        local_task_iter = _PrefetchingTasks(local_task_iter, engine, jones_prefetch_depth,
+                                            task_inds=task_inds)
+    # Times, baselines and frequencies covered by this rank, for profiling. These are
+    # kept as sets, so that their size does not grow with the number of tasks.
+    local_times, local_bls, local_freqs = set(), set(), set()
+
+    loop_start = pytime.time()
     for task in local_task_iter:
         engine.set_task(task)
         vis = engine.make_visibility()
-
-        blti, spw, freq_ind = task.uvdata_index
-
-        uvdata_indices.append(task.uvdata_index)
-
-        flat_ind = np.ravel_multi_index(
-            (blti, spw, freq_ind, 0), data_array_shape
-        )
-        offset = flat_ind * size_complex
-
-        vis_data.Lock(0)
-        vis_data.Accumulate(vis, 0, target=offset, op=mpi.MPI.SUM)
-        vis_data.Unlock(0)
-
-        cval = count.next()
-        if rank == 0 and not quiet:
-            pbar.update(cval)
-
-    request = comm.Ibarrier()
-
-    while not request.Test():
-        if rank == 0 and not quiet:
-            cval = count.current_value()
-            pbar.update(cval)
-
+        vis_blocks.add(task.uvdata_index, vis)
+        if checkpoint is not None:
+            checkpoint.update(vis_blocks, task_inds.current)
+
+        blti, _, freq_ind = task.uvdata_index
+        if isinstance(blti, slice):
+            blti = blti.start
+        if isinstance(freq_ind, slice):
+            # Frequency-vectorized tasks fill a contiguous block of all frequencies.
+            freq_ind = freq_ind.start
+
+        time_i, bl_i = divmod(blti, Nbls)
+        local_times.add(time_i)
+        local_bls.add(bl_i)
+        local_freqs.add(freq_ind)
+
+        count.next()
+
+    if checkpoint is not None:
+        checkpoint.finish(vis_blocks)
+    loop_time = pytime.time() - loop_start
+    engine.close()
+
+    # Wait for all ranks, reporting progress in the meantime.
+    count.finish()
     count.free()
+    if task_counter is not None:
+        task_counter.free()
     if rank == 0 and not quiet:
         pbar.finish()
 
-    if rank == 0 and not quiet:
-        print("Calculations Complete.", flush=True)
+    _collect_visibilities(vis_blocks, vis_data, source_comm, shard_writer, output_mode)
+    del vis_blocks
+
+    _report_engine_stats(engine, jones_cache, quiet=quiet,
+                         report_fringe_error=vectorize_freqs and bool(fringe_anchor_interval))
+    _report_balance(loop_time, planned_cost, quiet=quiet)
 
     # If profiling is active, save meta data:
     from .profiling import prof     # noqa
@@ -504,12 +2964,9 @@ def run_uvdata_uvsim(input_uv, beam_list, beam_dict=None, catalog=None, quiet=Fa
         # Saving axis sizes on current rank (local) and for the whole job (global).
         # These lines are affected by issue 179 of line_profiler, so the nocover
         # above will need to stay until this issue is resolved (see profiling.py).
-        task_inds = np.array(uvdata_indices)
-        bl_inds = task_inds[:, 0] % Nbls
-        time_inds = (task_inds[:, 0] - bl_inds) // Nbls
-        Ntimes_loc = np.unique(time_inds).size
-        Nbls_loc = np.unique(bl_inds).size
-        Nfreqs_loc = np.unique(task_inds[:, 2]).size
+        Ntimes_loc = len(local_times)
+        Nbls_loc = Nbls if factorize_antennas else len(local_bls)
+        Nfreqs_loc = Nfreqs if vectorize_freqs else len(local_freqs)
         axes_dict = {
             'Ntimes_loc': Ntimes_loc,
             'Nbls_loc': Nbls_loc,
@@ -522,13 +2979,11 @@ def run_uvdata_uvsim(input_uv, beam_list, beam_dict=None, catalog=None, quiet=Fa
             for k, v in axes_dict.items():
                 afile.write("{} \t {:d}\n".format(k, int(v)))
 
-    vis_data.Free()
-
     if rank == 0:
         return uv_container
 
 
-def run_uvsim(params, return_uv=False, quiet=False):
+def run_uvsim(params, return_uv=False, quiet=False, resume=False):
     """
     Run a simulation off of an obsparam yaml file.
 
@@ -540,6 +2995,9 @@ def run_uvsim(params, return_uv=False, quiet=False):
         If true, do not write results to file and return uv_out. (Default False)
     quiet: bool
         If True, do not print anything to stdout. (Default False)
+    resume: bool
+        If True, resume from the checkpoints set in the filing section of the
+        parameter file, skipping finished tasks. (Default False)
 
     Returns
     -------
@@ -560,9 +3018,24 @@ def run_uvsim(params, return_uv=False, quiet=False):
     input_uv = UVData()
     beam_list = None
     beam_dict = None
+    sim_options = None
+    checkpoint_options = None
+    output_options = None
     skydata = SkyModelData()
 
     if rank == 0:
+        if isinstance(params, str):
+            with open(params, 'r') as pfile:
+                param_dict = yaml.safe_load(pfile)
+            config_path = os.path.dirname(params)
+        else:
+            param_dict = params
+            config_path = param_dict.get('config_path', '')
+        sim_options = simsetup.parse_simulation_params(param_dict.get('simulation', {}))
+        checkpoint_options = simsetup.parse_checkpoint_params(param_dict.get('filing', {}),
+                                                              config_path=config_path)
+        output_options = simsetup.parse_output_params(param_dict.get('filing', {}))
+
         start = Time.now()
         input_uv, beam_list, beam_dict = simsetup.initialize_uvdata_from_params(params)
         skydata, source_list_name = simsetup.initialize_catalog_from_params(
@@ -573,25 +3046,24 @@ def run_uvsim(params, return_uv=False, quiet=False):
         skydata = simsetup.SkyModelData(skydata)
         print(f"Skymodel setup took {(Time.now() - start).to('minute'):.3f}")
 
-    input_uv = comm.bcast(input_uv, root=0)
+    # Per-baseline-time metadata arrays are shared on each node rather than copied.
+    input_uv = mpi.uvdata_shared_bcast(input_uv, root=0)
     beam_list = comm.bcast(beam_list, root=0)
     beam_dict = comm.bcast(beam_dict, root=0)
+    sim_options = comm.bcast(sim_options, root=0)
+    checkpoint_options = comm.bcast(checkpoint_options, root=0)
+    output_options = comm.bcast(output_options, root=0)
     skydata.share(root=0)
 
     start = Time.now()
     uv_out = run_uvdata_uvsim(
-        input_uv, beam_list, beam_dict=beam_dict, catalog=skydata, quiet=quiet
+        input_uv, beam_list, beam_dict=beam_dict, catalog=skydata, quiet=quiet, resume=resume,
+        **sim_options, **checkpoint_options, **output_options
     )
     if rank == 0:
         print(f"Run uvdata uvsim took {(Time.now() - start).to('minute'):.3f}")
 
     if rank == 0:
-        if isinstance(params, str):
-            with open(params, 'r') as pfile:
-                param_dict = yaml.safe_load(pfile)
-        else:
-            param_dict = params
-
         if 'obs_param_file' in input_uv.extra_keywords:
             obs_param_file = input_uv.extra_keywords['obs_param_file']
             telescope_config_file = input_uv.extra_keywords['telescope_config_name']
@@ -607,15 +3079,318 @@ def run_uvsim(params, return_uv=False, quiet=False):
         history += (' Based on config files: ' + obs_param_file + ', '
                     + telescope_config_file + ', ' + antenna_location_file)
         history += ' Npus = ' + str(mpi.Npus) + '.'
+        history += ' Precision = ' + sim_options['precision'] + '.'
 
         # add pyuvdata version info
         history += uv_out.pyuvdata_version_str
 
         uv_out.history = history
 
-        simutils.write_uvdata(uv_out, param_dict, dryrun=return_uv)
+        shard_dir = None
+        if output_options['output_mode'] != 'single':
+            shard_dir = output_options['shard_dir']
+            if return_uv:
+                simutils.merge_shards(uv_out, shard_dir)
+        simutils.write_uvdata(uv_out, param_dict, dryrun=return_uv, shard_dir=shard_dir)
+        if not return_uv:
+            # The results are safely written, so the checkpoints are no longer needed.
+            _remove_checkpoint(checkpoint_options['checkpoint_dir'])
+        if shard_dir is not None:
+            simutils.remove_shards(shard_dir)
 
     if return_uv:
         return uv_out
 
     comm.Barrier()
+
+
+# Memory used by the interpreter and imported packages on each rank.
+PROCESS_BASE_BYTES = 2 ** 28
+
+
+def _array_bytes(obj, keys):
+    """Total size in bytes of the array attributes keys of obj that are set."""
+    return int(sum(np.asarray(getattr(obj, key)).nbytes for key in keys
+                   if getattr(obj, key, None) is not None))
+
+
+def _uvbeam_bytes(beam_list):
+    """Total size in bytes of the data arrays of the UVBeams in beam_list."""
+    return int(sum(beam.data_array.nbytes for beam in beam_list if isinstance(beam, UVBeam)))
+
+
+def _task_group_costs(model, bounds):
+    """Modeled cost of the task ranges given by bounds."""
+    return np.diff([model.cumulative(index) for index in bounds])
+
+
+def plan_uvdata_uvsim(input_uv, beam_list, beam_dict=None, catalog=None, Nnodes=1,
+                      Nranks_per_node=1, mem_per_node='4G', time_tasks=True,
+                      vectorize_freqs=False, factorize_antennas=False, jones_cache_mb=256,
+                      precision='double', source_tile_size='auto', fringe_anchor_interval=16,
+                      simulate_redundant_once=False, redundancy_tol=0.01,
+                      task_scheduling='static', task_chunk_size='auto', jones_prefetch_depth=0,
+                      jones_prefetch_threads=2, output_mode='single'):
+    """
+    Plan a simulation from a UVData object, without running it.
+
+    This works out how :func:`run_uvdata_uvsim` would split the simulation over
+    Nnodes nodes with Nranks_per_node ranks each, and estimates the memory used on each
+    node and the run time. It does not need MPI.
+
+    The memory estimate counts, on each rank, the interpreter, the sources of a sky
+    part and the engine work arrays per source
+    (see :func:`pyuvsim.utils.estimate_source_memory_usage`), the UVBeam interpolation
+    data, the Jones cache budget and the local visibility blocks; shared on each node,
+    the catalog, the UVData metadata, the UVBeams and the buffer the visibilities of
+    the node are summed in; and on rank 0, the output data, flag and nsample arrays.
+    With Jones prefetching, the Jones matrices of the tasks read ahead are also counted
+    on each rank.
+
+    If time_tasks is set, the run time is estimated by timing a few sample tasks on
+    this machine and scaling them up with the model of :class:`_TaskCostModel`.
+    It does not include setup, reduction or writing the output.
+
+    Parameters
+    ----------
+    input_uv : :class:~`pyuvdata.UVData`
+        Provides baseline/time/frequency information.
+    beam_list : :class:~`pyuvsim.BeamList`
+        Beams of the simulation.
+    beam_dict : dict
+        {`antenna_name` : `beam_id`}, see :func:`run_uvdata_uvsim`.
+    catalog : :class:~`simsetup.SkyModelData`
+        The source catalog.
+    Nnodes : int
+        Number of nodes.
+    Nranks_per_node : int
+        Number of MPI ranks on each node.
+    mem_per_node : str or int
+        Memory of each node, in bytes or with a unit as in '200G'.
+    time_tasks : bool
+        Estimate the run time by timing sample tasks.
+
+    The other parameters are the simulation options of :func:`run_uvdata_uvsim`.
+
+    Returns
+    -------
+    dict
+        The plan, which can be written out as JSON. Sizes are in bytes and
+        times in seconds.
+    """
+    if not isinstance(input_uv, UVData):
+        raise TypeError("input_uv must be UVData object")
+    if task_scheduling not in ['static', 'dynamic', 'balanced']:
+        raise ValueError("task_scheduling must be one of 'static', 'dynamic' or 'balanced'.")
+    if Nnodes < 1 or Nranks_per_node < 1:
+        raise ValueError("Nnodes and Nranks_per_node must be positive.")
+
+    mem_per_node = simutils.parse_memory_size(mem_per_node)
+    Npus = Nnodes * Nranks_per_node
+    beam_list.set_obj_mode()
+
+    sim_uv = input_uv
+    if simulate_redundant_once:
+        sim_uv, _ = _select_redundant_groups(input_uv, beam_dict, redundancy_tol)
+
+    Nbls = sim_uv.Nbls
+    Ntimes = sim_uv.Ntimes
+    Nfreqs = sim_uv.Nfreqs
+    Nsrcs = catalog.Ncomponents
+    Nbls_task = 1 if factorize_antennas else Nbls
+    Nfreqs_task = 1 if vectorize_freqs else Nfreqs
+    Nfreqs_per_task = Nfreqs if vectorize_freqs else 1
+    Ntasks = Ntimes * Nbls_task * Nfreqs_task
+    Nfreqs_sky = _sky_Nfreqs(catalog, Nfreqs)
+
+    # Memory in use on a node when run_uvdata_uvsim lays out the process grid.
+    beam_bytes = _uvbeam_bytes(beam_list)
+    node_shared = {
+        'catalog': _array_bytes(catalog, SkyModelData.put_in_shared),
+        'uvdata_metadata': int(sum(
+            param.value.nbytes for param in input_uv.__dict__.values()
+            if type(getattr(param, 'value', None)) is np.ndarray
+        )),
+        'beams': beam_bytes,
+    }
+    setup_bytes = Nranks_per_node * (PROCESS_BASE_BYTES + beam_bytes) + sum(node_shared.values())
+    mem_avail = mem_per_node - setup_bytes
+    if mem_avail <= 0:
+        raise ValueError("Insufficient memory for simulation.")
+
+    src_mem = simutils.estimate_source_memory_usage(1, Nfreqs_sky, Nfreqs_per_task, precision)
+    (Ntask_groups, Nsrc_groups), Nsky_parts, Nsrcs_local = _sky_decomposition(
+        Ntasks, Nsrcs, Npus, Nranks_per_node, mem_avail, src_mem
+    )
+    Ntasks_local = -(-Ntasks // Ntask_groups)
+    dynamic = task_scheduling == 'dynamic' and Nsrc_groups == 1
+    stream = output_mode == 'stream' and Nsky_parts == 1
+
+    # Visibility blocks are kept per time, for all times covered by the tasks of a rank,
+    # and summed over the ranks of a node.
+    block_bytes = Nbls * Nfreqs * 4 * np.dtype(np.complex128).itemsize
+    bounds = [simutils.iter_array_split(group, Ntasks, Ntask_groups)[0].start
+              for group in range(Ntask_groups)] + [Ntasks]
+    if stream:
+        vis_bytes = block_bytes
+    elif dynamic:
+        # Blocks cover all baselines and frequencies, and are written out once a rank
+        # moves on from their time, so a rank holds the times of one chunk.
+        chunk_size = _dynamic_task_chunk_size(task_chunk_size, Ntasks, Nbls_task, Npus)
+        Ntimes_local = min(-(-chunk_size // (Nbls_task * Nfreqs_task)) + 1, Ntimes)
+        vis_bytes = Ntimes_local * block_bytes
+        reduction_bytes = min(Ntimes_local * Nranks_per_node, Ntimes) * block_bytes
+    else:
+        # Blocks cover the baselines and frequencies of the task range of a rank.
+        vis_bytes = max(
+            _task_range_bytes(range(bounds[group], bounds[group + 1]), Nbls, Nfreqs,
+                              Nbls_task, Nfreqs_task)
+            for group in range(Ntask_groups)
+        )
+        groups_per_node = max(Nranks_per_node // Nsrc_groups, 1)
+        reduction_bytes = max(
+            _task_range_bytes(
+                range(bounds[group], bounds[min(group + groups_per_node, Ntask_groups)]),
+                Nbls, Nfreqs, Nbls_task, Nfreqs_task
+            )
+            for group in range(0, Ntask_groups, groups_per_node)
+        )
+    per_rank = {
+        'process': PROCESS_BASE_BYTES,
+        # The sources of the rank are copied out of the shared catalog.
+        'catalog_subset': -(-node_shared['catalog'] * Nsrcs_local // max(Nsrcs, 1)),
+        'sky_model': simutils.estimate_source_memory_usage(
+            -(-Nsrcs_local // Nsky_parts), Nfreqs_sky, Nfreqs_per_task, precision
+        ),
+        'beam_interpolation': beam_bytes,
+        'jones_cache': int(jones_cache_mb * 2**20),
+        # Jones matrices of both antennas of each task read ahead.
+        'jones_prefetch': jones_prefetch_depth * 2 * 4 * Nfreqs_per_task * (
+            -(-Nsrcs_local // Nsky_parts) * np.dtype(PRECISION_DTYPES[precision][1]).itemsize
+        ),
+        'visibilities': vis_bytes,
+    }
+    if not stream:
+        node_shared['reduction'] = reduction_bytes
+    rank0 = {'output': 0}
+    if output_mode == 'single':
+        # Data, flag and nsample arrays.
+        Nelements = input_uv.Nblts * input_uv.Nfreqs * 4
+        rank0['output'] = Nelements * (np.dtype(np.complex128).itemsize + 1 + 8)
+        if simulate_redundant_once:
+            rank0['output'] += sim_uv.Nblts * Nfreqs * 4 * (np.dtype(np.complex128).itemsize + 9)
+    peak_per_node = (Nranks_per_node * sum(per_rank.values()) + sum(node_shared.values())
+                     + sum(rank0.values()))
+
+    if task_scheduling == 'balanced':
+        schedule = 'balanced'
+    elif dynamic:
+        schedule = 'dynamic'
+    else:
+        schedule = 'static'
+    plan = {
+        'Nnodes': Nnodes,
+        'Nranks_per_node': Nranks_per_node,
+        'mem_per_node': mem_per_node,
+        'Nbls': Nbls,
+        'Ntimes': Ntimes,
+        'Nfreqs': Nfreqs,
+        'Nsrcs': Nsrcs,
+        'Ntasks': Ntasks,
+        'task_scheduling': schedule,
+        'output_mode': output_mode,
+        'process_grid': {'Ntask_groups': Ntask_groups, 'Nsrc_groups': Nsrc_groups},
+        'Nsky_parts': Nsky_parts,
+        'Ntasks_per_rank': Ntasks_local,
+        'Nsrcs_per_rank': Nsrcs_local,
+        'memory': {
+            'per_rank': per_rank,
+            'node_shared': node_shared,
+            'rank0': rank0,
+            'peak_per_node': int(peak_per_node),
+            'fits': bool(peak_per_node <= mem_per_node),
+        },
+        'runtime': None,
+    }
+    if not time_tasks:
+        return plan
+
+    if source_tile_size == 'auto':
+        source_tile_size = None
+        if Nsrcs > SOURCE_TILE_CANDIDATES[-1]:
+            source_tile_size = probe_source_tile(
+                Nsrcs=min(Nsrcs, 2 ** 18), Nfreqs=Nfreqs_per_task, precision=precision
+            )
+    engine_kwargs = {'jones_cache': JonesCache(max_bytes=int(jones_cache_mb * 2**20)),
+                     'precision': precision, 'source_tile': source_tile_size or None,
+                     'anchor_interval': fringe_anchor_interval or None}
+    engine = (UVArrayEngine if factorize_antennas else UVEngine)(**engine_kwargs)
+    src_inds = _sample_indices(Nsrcs, 2048)
+    up_fraction = _up_fraction(sim_uv, catalog, src_inds)
+    Nuvbeams = _uvbeam_antennas(sim_uv, beam_list, beam_dict)
+    if factorize_antennas:
+        Nuvbeams = np.zeros(1, dtype=int)
+    overhead, src_cost, uvbeam_cost = _calibrate_task_cost(
+        sim_uv, catalog, beam_list, beam_dict, engine, up_fraction, Nuvbeams, src_inds,
+        vectorize_freqs=vectorize_freqs, factorize_antennas=factorize_antennas
+    )
+    model = _TaskCostModel((overhead * Nsky_parts, src_cost, uvbeam_cost), up_fraction,
+                           -(-Nsrcs // Nsrc_groups), Nuvbeams, Nfreqs_task)
+    if schedule == 'balanced':
+        bounds = model.split(Ntask_groups)
+    group_costs = _task_group_costs(model, bounds)
+    wall_time = model.total / Ntask_groups if schedule == 'dynamic' else group_costs.max()
+    plan['runtime'] = {
+        'task_cost_coefficients': {'overhead': float(overhead), 'src_cost': float(src_cost),
+                                   'uvbeam_cost': float(uvbeam_cost)},
+        'cpu_time': float(model.total * Nsrc_groups),
+        'wall_time': float(wall_time),
+        'imbalance': float(_imbalance(group_costs)),
+    }
+    return plan
+
+
+def plan_uvsim(params, Nnodes=1, Nranks_per_node=1, mem_per_node='4G', time_tasks=True):
+    """
+    Plan a simulation from an obsparam yaml file, without running it.
+
+    The setup of :func:`run_uvsim` is done on this process alone, and the simulation
+    is planned with :func:`plan_uvdata_uvsim`. The output_mode of the filing section
+    is taken into account.
+
+    Parameters
+    ----------
+    params : str or dict
+        Path to a parameter yaml file, or the parameters read from one.
+    Nnodes : int
+        Number of nodes.
+    Nranks_per_node : int
+        Number of MPI ranks on each node.
+    mem_per_node : str or int
+        Memory of each node, in bytes or with a unit as in '200G'.
+    time_tasks : bool
+        Estimate the run time by timing sample tasks.
+
+    Returns
+    -------
+    dict
+        The plan, see :func:`plan_uvdata_uvsim`.
+    """
+    if isinstance(params, str):
+        with open(params, 'r') as pfile:
+            param_dict = yaml.safe_load(pfile)
+    else:
+        param_dict = params
+    sim_options = simsetup.parse_simulation_params(param_dict.get('simulation', {}))
+    output_options = simsetup.parse_output_params(param_dict.get('filing', {}))
+
+    input_uv, beam_list, beam_dict = simsetup.initialize_uvdata_from_params(params)
+    skydata, _ = simsetup.initialize_catalog_from_params(params, input_uv,
+                                                         return_recarray=False)
+    skydata = simsetup.SkyModelData(skydata)
+
+    return plan_uvdata_uvsim(
+        input_uv, beam_list, beam_dict=beam_dict, catalog=skydata, Nnodes=Nnodes,
+        Nranks_per_node=Nranks_per_node, mem_per_node=mem_per_node, time_tasks=time_tasks,
+        output_mode=output_options['output_mode'], **sim_options
+    )
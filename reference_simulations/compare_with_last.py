@@ -11,6 +11,7 @@ import warnings
 import argparse
 import os
 
+import numpy as np
 from pyuvdata import UVData
 
 
@@ -46,4 +47,7 @@ for k in new_files.keys():
         uv_old.read_uvh5(old_files[k], run_check_acceptability=False)
         uv_new.read_uvh5(new_files[k], run_check_acceptability=False)
     uv_new.history = uv_old.history
-    print(k, uv_old == uv_new)
+    # Report the deviation too, since results from single precision runs will not be equal.
+    max_dev = np.max(np.abs(uv_new.data_array - uv_old.data_array))
+    max_rel_dev = max_dev / np.max(np.abs(uv_old.data_array))
+    print(k, uv_old == uv_new, f"max deviation: {max_dev:.3e} ({max_rel_dev:.3e} relative)")
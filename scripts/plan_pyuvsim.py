@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- mode: python; coding: utf-8 -*
+# Copyright (c) 2018 Radio Astronomy Software Group
+# Licensed under the 3-clause BSD License
+
+import argparse
+import json
+
+import pyuvsim
+
+parser = argparse.ArgumentParser(
+    description="A command-line script to plan a pyuvsim simulation from a parameter file, "
+                "without running it. Prints the split of the simulation over ranks, the "
+                "estimated memory per node and the estimated run time."
+)
+parser.add_argument('paramsfile', type=str, help='Parameter yaml file.')
+parser.add_argument('--nodes', type=int, default=1, help='Number of nodes.')
+parser.add_argument('--ranks-per-node', type=int, default=1,
+                    help='Number of MPI ranks on each node.')
+parser.add_argument('--mem', type=str, default='4G',
+                    help='Memory of each node, in bytes or with a unit (e.g. 200G).')
+parser.add_argument('--no-timing', action='store_true',
+                    help='Do not time sample tasks to estimate the run time.')
+parser.add_argument('--json', type=str, default=None,
+                    help='Write the plan to this JSON file.')
+
+args = parser.parse_args()
+
+plan = pyuvsim.uvsim.plan_uvsim(
+    args.paramsfile, Nnodes=args.nodes, Nranks_per_node=args.ranks_per_node,
+    mem_per_node=args.mem, time_tasks=not args.no_timing
+)
+
+grid = plan['process_grid']
+memory = plan['memory']
+print(f"Nbls: {plan['Nbls']}, Ntimes: {plan['Ntimes']}, Nfreqs: {plan['Nfreqs']}, "
+      f"Nsrcs: {plan['Nsrcs']}")
+print(f"Tasks: {plan['Ntasks']} ({plan['task_scheduling']} scheduling)")
+print(f"Process grid: {grid['Ntask_groups']} task groups x {grid['Nsrc_groups']} source groups")
+print(f"Nsky parts: {plan['Nsky_parts']}")
+print(f"Peak memory per node: {memory['peak_per_node'] / 2**30:.3f} GiB of "
+      f"{plan['mem_per_node'] / 2**30:.3f} GiB" + ("" if memory['fits'] else " (does not fit)"))
+if plan['runtime'] is not None:
+    print(f"Approximate wall time: {plan['runtime']['wall_time']:.3g} s, "
+          f"imbalance {plan['runtime']['imbalance']:.3f}")
+
+if args.json is not None:
+    with open(args.json, 'w') as jfile:
+        json.dump(plan, jfile, indent=2)